@@ -0,0 +1,281 @@
+"""
+Benchmarks of the hot paths of the trivia API.
+
+Seeds a synthetic question bank into the database at --database (a SQLite
+file by default, or e.g. postgresql://localhost:5432/trivia_bench), then
+times, through the Flask test client:
+
+    pages       GET /api/v1.0/questions, random category and page
+    search      POST /api/v1.0/questions with a search term
+    quiz        POST /api/v1.0/quizzes with --previous previous questions
+    categories  POST, GET, PATCH and DELETE of a category
+
+and, given the --http url of a server running on the same database, the
+same read paths through the HTTP load generator of loadtest.py. Prints, or
+writes to --output, a json report of the throughput, latency percentiles
+and peak memory of each scenario, to be compared between commits, with the
+plans of the main queries (index or sequential scans).
+
+The tables of the database are dropped and seeded again when they do not
+hold --questions questions and --categories categories, or with --reseed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr import create_app  # noqa: E402
+from flaskr.bulk import insert_chunk  # noqa: E402
+from models import db, notify_change, Question, Category  # noqa: E402
+from migrate import migrate  # noqa: E402
+import loadtest  # noqa: E402
+from sqlalchemy import MetaData, func  # noqa: E402
+
+WORDS = (
+    'river mountain planet king queen painter novel war ocean island city '
+    'element engine music poet empire desert forest bridge tower planet '
+    'medicine bone moon star comet atom theory canvas symphony opera goal '
+    'league champion museum statue dynasty volcano glacier temple language '
+    'alphabet number prime triangle circle square century treaty battle '
+    'invention telescope microscope vaccine orbit gravity energy metal gold'
+).split()
+
+SEED_CHUNK_SIZE = 10000
+
+
+def sentence(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for i in range(rng.randint(low, high)))
+
+
+def seed_database(questions, categories, seed):
+    """Empties the tables and fills them with a random question bank."""
+    rng = random.Random(seed)
+    db.session.remove()  # its locks would block the drop
+    # every table, also those of the migrations without a model
+    # (schema_migrations, change_events)
+    tables = MetaData()
+    tables.reflect(bind=db.engine,
+                   only=lambda name, meta: not name.startswith('sqlite_'))
+    tables.drop_all(bind=db.engine)
+    migrate(db.engine)
+
+    db.session.execute(Category.__table__.insert(),
+                       [{'type': f'Category {i}'} for i in range(1, categories + 1)])
+    db.session.commit()
+    category_ids = [id for id, in db.session.query(Category.id)]
+
+    for start in range(0, questions, SEED_CHUNK_SIZE):
+        insert_chunk([
+            (sentence(rng, 5, 12).capitalize() + '?', sentence(rng, 1, 3),
+             rng.choice(category_ids), rng.randint(1, 5))
+            for i in range(start, min(start + SEED_CHUNK_SIZE, questions))])
+
+    db.session.execute('ANALYZE')  # statistics for the query planner
+    db.session.commit()
+
+    notify_change(Question.__tablename__, 'reload', None)
+    notify_change(Category.__tablename__, 'reload', None)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            name: round(loadtest.percentile(latencies, fraction) * 1000, 3)
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1))
+        },
+        'errors': errors,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def measure(client, requests, iterations):
+    """Sends `iterations` of the (method, path, json body) `requests`, in
+    turn, after a warm up round."""
+    for method, path, body in requests[:10]:
+        client.open(path, method=method, json=body)
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        method, path, body = requests[i % len(requests)]
+        request_start = time.perf_counter()
+        res = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - request_start)
+        if res.status_code >= 400 and res.status_code != 404:
+            errors += 1
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def measure_categories(client, iterations, rng):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        request_start = time.perf_counter()
+        name = f'bench {rng.random()}'
+        res = client.post('/api/v1.0/categories', json={'type': name})
+        id = res.get_json().get('id') if res.status_code == 201 else None
+        if id is None:
+            errors += 1
+            continue
+        statuses = [
+            client.get(f'/api/v1.0/categories/{id}').status_code,
+            client.patch(f'/api/v1.0/categories/{id}',
+                         json={'type': name + ' renamed'}).status_code,
+            client.delete(f'/api/v1.0/categories/{id}').status_code,
+        ]
+        latencies.append(time.perf_counter() - request_start)
+        errors += sum(status >= 400 for status in statuses)
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def scenarios(category_ids, question_ids, previous, rng, count):
+    """Returns the request lists of the read scenarios."""
+    pages = max(len(question_ids) // len(category_ids) // 10, 1)
+    return {
+        'pages': [
+            ('GET', f'/api/v1.0/questions?currCat={rng.choice(category_ids)}'
+                    f'&page={rng.randint(1, pages)}', None)
+            for i in range(count)],
+        'search': [
+            ('POST', '/api/v1.0/questions',
+             {'searchTerm': ' '.join(rng.sample(WORDS, rng.randint(1, 2)))})
+            for i in range(count)],
+        'quiz': [
+            ('POST', '/api/v1.0/quizzes',
+             {'previous_questions': rng.sample(question_ids, min(previous, len(question_ids))),
+              'quiz_category': {'id': 0}})
+            for i in range(max(count // 10, 1))],
+    }
+
+
+def query_plans(category_id):
+    """Returns the plans the database chose for the queries of the question
+    pages, of the difficulty filter and of the category lookup by type."""
+    page = Question.query.filter(Question.category_id == category_id)
+    queries = {
+        'pages': page.order_by(Question.question, Question.id).offset(100).limit(10),
+        'pages_count': page.order_by(None).with_entities(func.count()),
+        'difficulty': Question.query.filter(Question.difficulty == 5),
+        'category_by_type': Category.query.filter(
+            func.lower(Category.type) == 'category 1'),
+    }
+    explain = ('EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite'
+               else 'EXPLAIN ')
+    plans = {}
+    for name, query in queries.items():
+        sql = str(query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        plans[name] = [' '.join(str(column) for column in row)
+                       for row in db.session.execute(explain + sql)]
+    return plans
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--database', default='sqlite:///' + os.path.join(
+        tempfile.gettempdir(), 'trivia_bench.db'))
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reseed', action='store_true')
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help='requests per scenario')
+    parser.add_argument('--previous', type=int, default=1000,
+                        help='length of the previous_questions of the quiz scenario')
+    parser.add_argument('--scenario', action='append', dest='scenarios',
+                        choices=('pages', 'search', 'quiz', 'categories'),
+                        help='scenario to run, may be repeated, all by default')
+    parser.add_argument('--http', default=None,
+                        help='base url of a server on the same database')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds per scenario over http')
+    parser.add_argument('--question-store', action='store_true',
+                        help='serve the reads from the in-memory read store')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+    selected = args.scenarios or ['pages', 'search', 'quiz', 'categories']
+
+    app = create_app({'DATABASE_PATH': args.database,
+                      'QUESTION_STORE': args.question_store})
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'database': db.engine.dialect.name,
+        'questions': args.questions,
+        'categories': args.categories,
+        'seed': args.seed,
+        'question_store': args.question_store,
+    }
+
+    with app.app_context():
+        if (args.reseed or Question.query.count() != args.questions
+                or Category.query.count() != args.categories):
+            start = time.perf_counter()
+            seed_database(args.questions, args.categories, args.seed)
+            report['seed_seconds'] = round(time.perf_counter() - start, 1)
+
+        category_ids = [id for id, in db.session.query(Category.id)]
+        question_ids = [id for id, in db.session.query(Question.id)]
+        report['query_plans'] = query_plans(category_ids[0])
+    report['peak_rss_mb_after_seed'] = peak_rss_mb()
+
+    rng = random.Random(args.seed)
+    # distinct requests, so that pages and searches are not served from the
+    # response cache
+    requests = scenarios(category_ids, question_ids, args.previous, rng,
+                         args.iterations)
+    client = app.test_client()
+    report['scenarios'] = {}
+    for name in selected:
+        if name == 'categories':
+            result = measure_categories(client, max(args.iterations // 4, 1), rng)
+        else:
+            result = measure(client, requests[name], args.iterations)
+        report['scenarios'][name] = result
+
+    if args.http:
+        report['http'] = {}
+        for name in selected:
+            if name == 'categories':
+                continue
+            http_requests = [(method, path, json.dumps(body).encode() if body else b'')
+                             for method, path, body in requests[name]]
+            report['http'][name] = asyncio.run(loadtest.run(
+                args.http, http_requests, args.concurrency, args.duration, []))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+HTTP load generator for the trivia API.
+
+Keeps --concurrency connections busy against each server for --duration
+seconds, cycling through the --request list, and prints one json report per
+server: requests per second, latency percentiles, errors, and the resident
+memory of the server processes (--pid, with their children) so that serving
+modes can be compared at equal memory.
+
+E.g. the WSGI app against the ASGI app:
+
+    gunicorn -w 4 -b 127.0.0.1:8000 'flaskr:create_app()' &
+    uvicorn flaskr.asgi:app --workers 1 --port 8001 &
+    python benchmarks/loadtest.py http://127.0.0.1:8000 http://127.0.0.1:8001 \\
+        --pid <gunicorn master pid> --pid <uvicorn pid> --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_REQUESTS = [
+    'GET /api/v1.0/categories',
+    'GET /api/v1.0/questions?page=1&currCat=1',
+    'POST /api/v1.0/quizzes {"previous_questions": [], "quiz_category": {"id": 0}}',
+]
+
+
+def parse_request(spec):
+    # "<METHOD> <path> [json body]"
+    parts = spec.split(' ', 2)
+    body = parts[2].encode() if len(parts) > 2 else b''
+    return parts[0].upper(), parts[1], body
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def rss_bytes(pids):
+    """Resident memory of `pids` and all their descendants (Linux only)."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+            except OSError:
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+    total, todo, seen = 0, list(pids), set()
+    while todo:
+        pid = todo.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        todo += children.get(pid, [])
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    return status, keep_alive
+
+
+async def client(url, requests, deadline, latencies, errors, offset):
+    host, port = url.hostname, url.port or 80
+    connection = None
+    i = offset
+    while time.perf_counter() < deadline:
+        method, path, body = requests[i % len(requests)]
+        i += 1
+        message = (f'{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\n'
+                   f'Content-Type: application/json\r\n'
+                   f'Content-Length: {len(body)}\r\n\r\n').encode() + body
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            reader, writer = connection
+            writer.write(message)
+            status, keep_alive = await read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            errors['connection'] = errors.get('connection', 0) + 1
+            connection = None
+            continue
+
+        latencies.append(time.perf_counter() - start)
+        if status >= 500:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+        if not keep_alive:
+            connection[1].close()
+            connection = None
+
+    if connection is not None:
+        connection[1].close()
+
+
+async def run(base_url, requests, concurrency, duration, pids):
+    url = urlsplit(base_url)
+    requests = [(method, url.path.rstrip('/') + path, body)
+                for method, path, body in requests]
+    latencies, errors = [], {}
+
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(client(url, requests, deadline, latencies, errors, i)
+                           for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    report = {
+        'url': base_url,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            name: round(percentile(latencies, fraction) * 1000, 3)
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1))
+        } if latencies else None,
+        'errors': errors,
+    }
+    if pids:
+        rss = rss_bytes(pids)
+        report['rss_mb'] = round(rss / 2 ** 20, 1)
+        report['requests_per_second_per_100mb'] = round(
+            report['requests_per_second'] / (rss / 2 ** 20) * 100, 1) if rss else None
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('urls', nargs='+', help='base url of each server')
+    parser.add_argument('--request', action='append', dest='requests',
+                        help='"<METHOD> <path> [json body]", may be repeated')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--pid', type=int, action='append', dest='pids', default=[],
+                        help='server process id, one per url, in the same order')
+    args = parser.parse_args()
+
+    requests = [parse_request(spec) for spec in args.requests or DEFAULT_REQUESTS]
+    reports = []
+    for i, base_url in enumerate(args.urls):
+        pids = [args.pids[i]] if i < len(args.pids) else []
+        reports.append(asyncio.run(
+            run(base_url, requests, args.concurrency, args.duration, pids)))
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+WebSocket load test of the live quiz rooms of the ASGI app.
+
+Creates a room on the server at the base url, connects --clients players to
+it, then plays the room as its host: every --interval seconds, the next
+question is started, each player answering it as soon as it arrives. Prints
+a json report of the time the questions and results took to reach all the
+players from the host request (the broadcast fan-out), of the answer round
+trips, and of the resident memory of the server (--pid, with its children).
+
+The players all run in this process, raise the limit of open files first:
+
+    uvicorn flaskr.asgi:app --port 8001 &
+    ulimit -n 30000
+    python benchmarks/rooms_loadtest.py http://127.0.0.1:8001 --clients 10000 \\
+        --pid <uvicorn pid>
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import percentile, rss_bytes  # noqa: E402
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={
+        'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def summary(latencies, expected):
+    latencies = sorted(latencies)
+    return {
+        'received': len(latencies),
+        'missing': expected - len(latencies),
+        'latency_ms': {
+            name: round(percentile(latencies, fraction) * 1000, 3)
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1))
+        } if latencies else None,
+    }
+
+
+class Stats:
+    def __init__(self):
+        self.arrivals = {}  # (message type, index) -> arrival times
+        self.answers = []  # answer round trips
+        self.errors = 0
+
+
+async def player(ws_url, number, stats, connected, done):
+    try:
+        async with websockets.connect(ws_url, max_size=2 ** 20,
+                                      ping_interval=None) as socket:
+            connected.append(number)
+            sent = {}
+            async for text in socket:
+                now = time.perf_counter()
+                message = json.loads(text)
+                kind = message['type']
+                if kind in ('question', 'results'):
+                    stats.arrivals.setdefault((kind, message['index']), []).append(now)
+                if kind == 'question':
+                    sent[message['index']] = time.perf_counter()
+                    await socket.send(json.dumps({
+                        'type': 'answer', 'index': message['index'],
+                        'answer': 'guess' if number % 2 else 'other guess'}))
+                elif kind == 'answered':
+                    stats.answers.append(now - sent.pop(message['index']))
+                elif kind == 'finished':
+                    break
+    except (OSError, websockets.WebSocketException):
+        stats.errors += 1
+    finally:
+        done.append(number)
+
+
+async def run(base_url, clients, category, questions, interval, connect_batch, pids):
+    url = urlsplit(base_url)
+    loop = asyncio.get_event_loop()
+    room = await loop.run_in_executor(None, post, base_url + '/api/v1.0/rooms', {
+        'quiz_category': {'id': category}, 'count': questions})
+    ws_url = (f'ws://{url.netloc}{url.path.rstrip("/")}/api/v1.0/rooms/'
+              f'{room["room_id"]}/players')
+
+    stats, connected, done = Stats(), [], []
+    start = time.perf_counter()
+    tasks = []
+    for first in range(0, clients, connect_batch):
+        batch = range(first, min(first + connect_batch, clients))
+        tasks += [asyncio.ensure_future(player(f'{ws_url}?name=p{i}', i, stats,
+                                               connected, done))
+                  for i in batch]
+        # wait for the batch to connect, or fail
+        while len(connected) + len(done) < batch[-1] + 1:
+            await asyncio.sleep(0.01)
+    connect_seconds = time.perf_counter() - start
+    players = len(connected)
+
+    next_url = f'{base_url}/api/v1.0/rooms/{room["room_id"]}/next'
+    started = []  # host request time of each step
+    for step in range(room['total_questions'] + 1):
+        started.append(time.perf_counter())
+        await loop.run_in_executor(None, post, next_url,
+                                   {'host_token': room['host_token']})
+        await asyncio.sleep(interval)
+    await asyncio.wait(tasks, timeout=interval * 2)
+
+    report = {
+        'url': base_url,
+        'clients': clients,
+        'connected': players,
+        'connect_seconds': round(connect_seconds, 2),
+        'errors': stats.errors,
+        'questions': {}, 'results': {},
+    }
+    for (kind, index), arrivals in sorted(stats.arrivals.items()):
+        # questions are started by step `index`, their results shown by the next one
+        origin = started[index] if kind == 'question' else started[index + 1]
+        report['questions' if kind == 'question' else 'results'][index] = summary(
+            [arrival - origin for arrival in arrivals], players)
+    report['answers'] = summary(stats.answers, players * room['total_questions'])
+    if pids:
+        report['rss_mb'] = round(rss_bytes(pids) / 2 ** 20, 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('url', help='base url of the ASGI server')
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--category', type=int, default=0,
+                        help='category of the room, 0 for all')
+    parser.add_argument('--questions', type=int, default=5)
+    parser.add_argument('--interval', type=float, default=3,
+                        help='seconds between two questions')
+    parser.add_argument('--connect-batch', type=int, default=500,
+                        help='players connecting at the same time')
+    parser.add_argument('--pid', type=int, action='append', dest='pids', default=[])
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.url.rstrip('/'), args.clients, args.category,
+                             args.questions, args.interval, args.connect_batch,
+                             args.pids))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,13 +4,119 @@ load_dotenv()
 
 # SECRET_KEY = os.urandom(32)
 
-HOST = os.environ['HOST']
-PORT = os.environ['PORT']
-USERNAME = os.environ['USERNAME']
-PASSWORD = os.environ['PASSWORD']
-DATABASE_NAME = os.environ['DATABASE_NAME']
+HOST = os.environ.get('HOST', 'localhost')
+PORT = os.environ.get('PORT', '5432')
+USERNAME = os.environ.get('USERNAME', 'postgres')
+PASSWORD = os.environ.get('PASSWORD', '')
+DATABASE_NAME = os.environ.get('DATABASE_NAME', 'trivia')
 
 database_path = f'postgresql://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/{DATABASE_NAME}'
 
 SQLALCHEMY_DATABASE_URI = database_path
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# ==============================================
+# Engine profiles, passed to setup_db() by name, ENGINE_PROFILE by default.
+# pool_size, max_overflow, pool_timeout (seconds to wait for a connection
+# before failing), pool_pre_ping and pool_recycle (seconds) are SQLAlchemy
+# engine options; statement_timeout (milliseconds, 0 for none) and
+# prepared_statements (server-side statement cache of the asyncpg pool of
+# flaskr.asgi) are applied by setup_db() on Postgres.
+# ==============================================
+ENGINE_PROFILE = os.environ.get('ENGINE_PROFILE', 'web')
+
+ENGINE_PROFILES = {
+    # request handling: enough connections for the worker threads and a
+    # burst on top, fail fast rather than queue requests behind the pool
+    'web': {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 5,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'statement_timeout': 5000,
+        'prepared_statements': True,
+    },
+    # imports, exports and other CLI commands: one long-lived connection
+    # and no limit on the duration of a statement
+    'batch': {
+        'pool_size': 1,
+        'max_overflow': 1,
+        'pool_timeout': 60,
+        'pool_pre_ping': True,
+        'pool_recycle': 3600,
+        'statement_timeout': 0,
+        'prepared_statements': True,
+    },
+    # test suite: small pool, errors surface instead of waiting
+    'test': {
+        'pool_size': 2,
+        'max_overflow': 5,
+        'pool_timeout': 2,
+        'pool_pre_ping': False,
+        'pool_recycle': -1,
+        'statement_timeout': 10000,
+        'prepared_statements': False,
+    },
+}
+
+# ==============================================
+# Read replicas, comma-separated database urls of the same database system
+# as database_path. Read-only requests are sent to one of them, chosen
+# 'round_robin' or by 'least_connections'. Replicas are assumed to be at
+# most REPLICA_LAG_SECONDS behind the primary: a client reads from the
+# primary for that long after its own writes.
+# ==============================================
+REPLICA_DATABASE_PATHS = [path for path in
+                          os.environ.get('REPLICA_DATABASE_URLS', '').split(',')
+                          if path]
+REPLICA_STRATEGY = os.environ.get('REPLICA_STRATEGY', 'round_robin')
+REPLICA_LAG_SECONDS = float(os.environ.get('REPLICA_LAG_SECONDS', 5))
+
+# ==============================================
+# Request instrumentation (see flaskr/instrumentation.py), off by default.
+# Only INSTRUMENTATION_SAMPLE_RATE of the requests, from 0 to 1, are timed.
+# ==============================================
+INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 0.1))
+
+# ==============================================
+# Read store (see flaskr/read_store.py), off by default: question pages,
+# single questions and quizzes are then served from a compact in-memory
+# copy of the questions table instead of ORM instances.
+# ==============================================
+QUESTION_STORE = os.environ.get('QUESTION_STORE', '').lower() in ('1', 'true', 'yes')
+
+# ==============================================
+# Change feed (see flaskr/change_feed.py), on by default: publishes the
+# changes of each process to the others, so that the in-process caches and
+# indexes of every worker follow the writes of all of them. They have no
+# other expiry: turn it off only when serving from a single process.
+# ==============================================
+CHANGE_FEED = os.environ.get('CHANGE_FEED', 'true').lower() in ('1', 'true', 'yes')
+
+# ==============================================
+# Request coalescing (see flaskr/response_cache.py), on by default:
+# identical concurrent GET requests of the cached endpoints wait for the
+# first of them and share its response, instead of all querying the
+# database for the same result.
+# ==============================================
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', 'true').lower() in ('1', 'true', 'yes')
+
+# ==============================================
+# Rate limiting (see flaskr/rate_limit.py), off while RATE_LIMIT_PER_SECOND
+# is 0: each client address may send RATE_LIMIT_PER_SECOND requests per
+# second to each route, in bursts of up to RATE_LIMIT_BURST, the requests
+# beyond being answered 429.
+# ==============================================
+RATE_LIMIT_PER_SECOND = float(os.environ.get('RATE_LIMIT_PER_SECOND', 0))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 20))
+
+# ==============================================
+# Reverse proxies in front of the app, 0 when clients connect to it
+# directly. Behind TRUSTED_PROXIES proxies, the address of the client (used
+# by the rate limiting) and the scheme are taken from the X-Forwarded-For
+# and X-Forwarded-Proto headers they set. Only set it behind proxies which
+# set them, or clients could send any address.
+# ==============================================
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
@@ -1,38 +1,141 @@
 from crypt import methods
 from email import message
+import datetime
 import json
 import os
 import re
 from unicodedata import category
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, current_app, request, abort, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import and_
+from sqlalchemy import and_, tuple_
+from sqlalchemy.exc import IntegrityError
 from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from models import setup_db, db, unit_of_work, use_change_feed, pool_metrics, \
+    Question, Category
+from .quiz import (formatted_questions, parse_accuracy, parse_category_id,
+                   parse_count, question_index, random_question,
+                   random_questions)
+from . import read_store
+from . import quiz_sessions
+from .catalog import category_catalog, find_category
+from .search import search_questions
+from .response_cache import cached_response, use_single_flight, SingleFlight
+from .rate_limit import init_rate_limit
+from .replicas import read_only, remember_writes
+from .instrumentation import init_instrumentation, span
+from .change_feed import init_change_feed
+from .attempts import answer_key, attempt_writer, is_correct
+from .analytics import question_stats
+from .leaderboard import init_leaderboards, leaderboards, ALL_CATEGORIES, TOP_SIZE, WINDOWS
+from config import database_path, CHANGE_FEED, INSTRUMENTATION, QUESTION_STORE, \
+    RATE_LIMIT_BURST, RATE_LIMIT_PER_SECOND, SINGLE_FLIGHT, TRUSTED_PROXIES
+from . import bulk
+from migrate import migrate_command
 
 QUESTIONS_PER_PAGE = 10
 
+# Ids looked up per query by the batch endpoints
+IDS_PER_QUERY = 500
+
 # ==============================================
 # SEE MY DOCUMENTATION IN 'DOCS.md' FILE
 # ==============================================
 
 
-def paginate_questions(request, all_questions):
+# ------------------------------------------------------------------------
+# Offset of the page sent as '?page=<val>', pages before the first counting
+# as the first one, as in asgi.py
+# ------------------------------------------------------------------------
+def page_offset(request):
     page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    questions = [question.format() for question in all_questions]
-    new_book_list = questions[start:end]
-    return new_book_list
+    return max(page - 1, 0) * QUESTIONS_PER_PAGE
+
+
+# ------------------------------------------------------------------------
+# Paginates a Question query inside the database instead of in python.
+# Only the rows of the requested page are fetched (LIMIT/OFFSET), and the
+# total is taken from a separate COUNT. Rows are ordered by (question, id),
+# which also allows keyset pagination through the '?cursor=<last id>' arg:
+# the page then starts right after the question with that id, so deep pages
+# cost the same as the first one.
+# Returns a tuple of (formatted questions, total number of questions)
+# ------------------------------------------------------------------------
+def paginate_questions(request, selection):
+    cursor = request.args.get('cursor', None, type=int)
+
+    total_questions = selection.order_by(None).count()
+
+    selection = selection.order_by(Question.question, Question.id)
+    if cursor is not None:
+        last_question = db.session.query(Question.question).filter(
+            Question.id == cursor).scalar()
+        selection = selection.filter(
+            tuple_(Question.question, Question.id) > tuple_(last_question, cursor))
+    else:
+        selection = selection.offset(page_offset(request))
+
+    questions = selection.limit(QUESTIONS_PER_PAGE).all()
+    with span('serialize'):
+        formatted = [question.format() for question in questions]
+    return formatted, total_questions
+
+
+# ------------------------------------------------------------------------
+# Paginates the questions of category `category_id` like
+# paginate_questions(), from the read store when there is one.
+# ------------------------------------------------------------------------
+def paginate_category(request, category_id):
+    store = read_store.question_store
+    if store is None:
+        return paginate_questions(
+            request, Question.query.filter(Question.category_id == category_id))
+
+    cursor = request.args.get('cursor', None, type=int)
+    return store.page(category_id, page_offset(request), QUESTIONS_PER_PAGE, cursor)
+
+
+def next_cursor(questions):
+    # id of the last question on a full page, to be sent back as '?cursor='
+    if len(questions) < QUESTIONS_PER_PAGE:
+        return None
+    return questions[-1]['id']
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('DATABASE_PATH', database_path))
+
+    if app.config.get('INSTRUMENTATION', INSTRUMENTATION):
+        init_instrumentation(app)
+
+    proxies = app.config.get('TRUSTED_PROXIES', TRUSTED_PROXIES)
+    if proxies:
+        # the client address seen by the rate limiting is the forwarded one
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    # after the instrumentation, which then counts the requests limited
+    rate = app.config.get('RATE_LIMIT_PER_SECOND', RATE_LIMIT_PER_SECOND)
+    if rate:
+        init_rate_limit(app, rate, app.config.get('RATE_LIMIT_BURST', RATE_LIMIT_BURST))
+
+    use_single_flight(
+        SingleFlight() if app.config.get('SINGLE_FLIGHT', SINGLE_FLIGHT) else None)
+
+    if app.config.get('CHANGE_FEED', CHANGE_FEED):
+        init_change_feed(app)
+    else:
+        use_change_feed(None)
+
+    read_store.use_question_store(
+        read_store.QuestionStore()
+        if app.config.get('QUESTION_STORE', QUESTION_STORE) else None)
+
+    init_leaderboards(app)
 
     """
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -40,6 +143,10 @@ def create_app(test_config=None):
     CORS(app, resources={f'{re.escape(r"*/api/*")}': {'origins': '*'}})
     # CORS(app)
 
+    app.cli.add_command(bulk.import_command)
+    app.cli.add_command(bulk.export_command)
+    app.cli.add_command(migrate_command)
+
     """
     @TODO: Use the after_request decorator to set Access-Control-Allow
     """
@@ -50,7 +157,7 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Methods',
                              'GET, POST, PATCH, DELETE, OPTIONS')
         # response.headers.add('Access-Control-Allow-Origin', r'*/api/*')
-        return response
+        return remember_writes(response)
 
     """
     @TODO:
@@ -64,10 +171,23 @@ def create_app(test_config=None):
             'message': 'Welcome User'
         })
 
+    # ------------------------------------------------------------------------
+    # GET /api/v1.0/pool
+    # State of the database connection pool of this worker
+    # ------------------------------------------------------------------------
+    @app.route('/api/v1.0/pool')
+    def get_pool():
+        return jsonify({
+            'success': True,
+            'pool': pool_metrics()
+        })
+
     @app.route('/api/v1.0/categories', methods=['GET', 'POST'])
+    @cached_response
+    @read_only('GET')
     def get_categories():
         if request.method == 'GET':
-            categories = Category.query.order_by(Category.type).all()
+            categories = category_catalog.all()
 
             if len(categories) == 0 or categories is None:
                 abort(404)
@@ -75,26 +195,34 @@ def create_app(test_config=None):
             return jsonify({
                 'success': True,
                 # 'categories': [cat.type for cat in categories]
-                'categories': [cat.format() for cat in categories]
+                'categories': categories
             })
 
         elif request.method == 'POST':
             body = request.get_json()
-            if 'type' not in body:
+            if not isinstance(body.get('type'), str):
                 abort(422)
 
-            existing = Category.query.filter(
-                Category.type.ilike(body.get('type'))).one_or_none()
+            existing = category_catalog.find(body.get('type'))
 
             if existing is not None:  # category already existing
                 return jsonify({
                     'success': True,
                     'message': f'Already existing category',
-                    'id': existing.id
+                    'id': existing['id']
                 }), 200
 
             category = Category(type=body.get('type'))
-            category.insert()  # into database
+            try:
+                category.insert()  # into database
+            except IntegrityError:  # added meanwhile, by another request
+                db.session.rollback()
+                category_catalog.invalidate()
+                return jsonify({
+                    'success': True,
+                    'message': f'Already existing category',
+                    'id': category_catalog.find(body.get('type'))['id']
+                }), 200
 
             return jsonify({
                 'success': True,
@@ -107,23 +235,27 @@ def create_app(test_config=None):
     # DELETE /api/v1.0/category/<cat_id>: Deletes category <cat_id> record
     # ------------------------------------------------------------------------
     @app.route('/api/v1.0/categories/<int:cat_id>', methods=['GET', 'PATCH', 'DELETE'])
+    @read_only('GET')
     def request_category(cat_id):
-        category = Category.query.filter(
-            Category.id == cat_id).one_or_none()
-
-        if category is None:
+        if category_catalog.get(cat_id) is None:
             abort(404)
 
         if request.method == 'GET':
             return jsonify({
                 'success': True,
-                'category': category.format()
+                'category': category_catalog.get(cat_id)
             })
 
+        category = Category.query.filter(
+            Category.id == cat_id).one_or_none()
+
+        if category is None:
+            abort(404)
+
         elif request.method == 'PATCH':
             body = request.get_json()
             if body is not None:
-                if 'type' not in body:
+                if not isinstance(body.get('type'), str):
                     abort(422)
             else:
                 abort(400)
@@ -131,7 +263,11 @@ def create_app(test_config=None):
             cat_type = body.get('type')
             category.type = cat_type
 
-            category.update()
+            try:
+                category.update()
+            except IntegrityError:  # another category has this type
+                db.session.rollback()
+                abort(422)
 
             return jsonify({
                 'success': True,
@@ -165,37 +301,38 @@ def create_app(test_config=None):
     # ?page: specifies which page to show, if question number spans multiple pages
     # -----------------------------------------------------------------------------
     @app.route('/api/v1.0/questions')
+    @cached_response
+    @read_only('GET')
     def get_questions():
         # Fetch all categories order-by type
         curr_cat_id = request.args.get('currCat', 1, type=int)
 
-        categories = Category.query.order_by(Category.type).all()
+        categories = category_catalog.all()
 
         if len(categories) == 0 or categories is None:
             abort(404)
 
         # Pick the first category in db in alphabetical order
         # as default category
-        current_category = Category.query.filter(
-            Category.id == curr_cat_id).one_or_none()
+        current_category = category_catalog.get(curr_cat_id)
 
         if current_category is None:
             current_category = categories[0]
 
-        # Fetch all questions belonging to current category
-        questions = Question.query.filter(
-            Question.category == current_category.type).order_by(Question.question).all()
-        formatted_questions_set = paginate_questions(request, questions)
+        # Fetch the current page of questions belonging to current category
+        formatted_questions_set, total_questions = paginate_category(
+            request, current_category['id'])
 
-        if len(questions) == 0 or len(formatted_questions_set) == 0:
+        if total_questions == 0 or len(formatted_questions_set) == 0:
             abort(404)
 
         return jsonify({
             'success': True,
             'questions': formatted_questions_set,
-            'total_questions': len(questions),
-            'categories': [category.format() for category in categories],
-            'current_category': current_category.format()
+            'total_questions': total_questions,
+            'next_cursor': next_cursor(formatted_questions_set),
+            'categories': categories,
+            'current_category': current_category
         })
 
     """
@@ -209,7 +346,18 @@ def create_app(test_config=None):
     # GET /api/v1.0/questions/<id>: get the details of question with id <id>
     # ----------------------------------------------------------------
     @app.route('/api/v1.0/questions/<int:que_id>', methods=['GET', 'DELETE'])
+    @cached_response
+    @read_only('GET')
     def delete_question(que_id):
+        if request.method == 'GET' and read_store.question_store is not None:
+            question = read_store.question_store.get(que_id)
+            if question is None:
+                abort(404)
+            return jsonify({
+                'success': True,
+                'question': question
+            })
+
         question = Question.query.filter(
             Question.id == que_id).one_or_none()
 
@@ -230,6 +378,88 @@ def create_app(test_config=None):
                 'deleted': question.id
             })
 
+    # ----------------------------------------------------------------
+    # GET /api/v1.0/questions/<id>/stats: times question <id> was served
+    # and answered, its correct rate and average answer time (see analytics.py)
+    # ----------------------------------------------------------------
+    @app.route('/api/v1.0/questions/<int:que_id>/stats')
+    @read_only('GET')
+    def get_question_stats(que_id):
+        if question_index.key(que_id) is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'question_id': que_id,
+            'stats': question_stats.question(que_id)
+        })
+
+    # ------------------------------------------------------------------------
+    # PATCH /api/v1.0/questions: Updates the category and/or difficulty of
+    # many questions in a single transaction
+    #      data: {"ids": [1, 2, 3], "category": "Science", "difficulty": 2}
+    # DELETE /api/v1.0/questions: Deletes many questions in a single transaction
+    #      data: {"ids": [1, 2, 3]}
+    # ------------------------------------------------------------------------
+    @app.route('/api/v1.0/questions', methods=['PATCH', 'DELETE'])
+    def batch_questions():
+        body = request.get_json()
+        if body is None:
+            abort(400)
+
+        ids = body.get('ids')
+        if not isinstance(ids, list) or not all(
+                isinstance(id, int) and not isinstance(id, bool) for id in ids):
+            abort(422)
+
+        questions = []
+        for start in range(0, len(ids), IDS_PER_QUERY):
+            questions += Question.query.filter(
+                Question.id.in_(ids[start:start + IDS_PER_QUERY])).all()
+
+        if len(questions) == 0:
+            abort(404)
+        # read before the commit expires them
+        found_ids = sorted(question.id for question in questions)
+
+        if request.method == 'PATCH':
+            changes = {}
+            if 'category' in body:
+                category = find_category(body.get('category'))
+                if category is None:  # unknown category
+                    abort(422)
+                changes['category_id'] = category['id']
+
+            if 'difficulty' in body:
+                try:
+                    changes['difficulty'] = int(body.get('difficulty'))
+                except (TypeError, ValueError):
+                    abort(422)
+
+            if not changes:
+                abort(422)
+
+            with unit_of_work():
+                for question in questions:
+                    for field, value in changes.items():
+                        setattr(question, field, value)
+                    question.update()
+
+            return jsonify({
+                'success': True,
+                'updated': found_ids
+            })
+
+        elif request.method == 'DELETE':
+            with unit_of_work():
+                for question in questions:
+                    question.delete()
+
+            return jsonify({
+                'success': True,
+                'deleted': found_ids
+            })
+
     """
     @TODO:
     Create an endpoint to POST a new question,
@@ -248,6 +478,7 @@ def create_app(test_config=None):
     #           "category": "category",
     #           "difficulty": 5
     #       }
+    # "category" is the type of an existing category, or its id
     # E.g.
     # curl -X POST https://localhost:5000/api/v1.0/questions
     # -H "Content-Type:application/json"
@@ -262,35 +493,28 @@ def create_app(test_config=None):
         if 'searchTerm' in avail_fields:
             searchTerm = body.get('searchTerm')
             current_cat = None
-            found_questions = None
 
             if 'currentCategoryId' in avail_fields:
-                current_cat = Category.query.filter(
-                    Category.id == int(body.get('currentCategoryId'))).one_or_none()
+                current_cat = category_catalog.get(
+                    int(body.get('currentCategoryId')))
 
                 if current_cat is None:
                     abort(422)
 
-                found_questions = Question.query.filter(
-                    Question.category == current_cat.type, Question.question.ilike(f'%{searchTerm}%')).all()
-
-            else:
-                # If no category is specified, find all questions
-                # containing term
-                found_questions = Question.query.filter(
-                    Question.question.ilike(f'%{searchTerm}%')).all()
+            # If no category is specified, search all questions.
+            # Results are ranked by relevance (see search.py)
+            paginated_questions_set, total_questions = search_questions(
+                searchTerm, current_cat['id'] if current_cat else None,
+                page_offset(request), QUESTIONS_PER_PAGE)
 
-            if len(found_questions) == 0 or found_questions is None:
+            if total_questions == 0 or len(paginated_questions_set) == 0:
                 abort(404)
 
-            paginated_questions_set = paginate_questions(
-                request, found_questions)
-
             return jsonify({
                 'success': True,
                 'questions': paginated_questions_set,
-                'total_questions': len(found_questions),
-                'current_category': current_cat.format()
+                'total_questions': total_questions,
+                'current_category': current_cat
             })
 
         elif ('question' in avail_fields and 'answer' in avail_fields
@@ -298,11 +522,14 @@ def create_app(test_config=None):
 
             que = body.get('question')
             ans = body.get('answer')
-            cat = body.get('category')
+            cat = find_category(body.get('category'))
             diff = body.get('difficulty')
 
+            if cat is None:  # unknown category
+                abort(422)
+
             question = Question(question=que, answer=ans,
-                                category=cat, difficulty=diff)
+                                category_id=cat['id'], difficulty=diff)
 
             question.insert()
 
@@ -314,6 +541,64 @@ def create_app(test_config=None):
         else:
             abort(422)
 
+    # ------------------------------------------------------------------------
+    # POST /api/v1.0/questions/bulk?format=<ndjson|csv>&chunk_size=<n>:
+    # Imports the questions streamed in the request body, one per line
+    # (see bulk.py). Invalid lines are reported and skipped.
+    # E.g.
+    # curl -X POST http://localhost:5000/api/v1.0/questions/bulk
+    # -H "Content-Type:application/x-ndjson" --data-binary @questions.ndjson
+    # ------------------------------------------------------------------------
+    @app.route('/api/v1.0/questions/bulk', methods=['POST'])
+    def post_questions_bulk():
+        format = request.args.get('format')
+        if format is None:
+            format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+
+        chunk_size = request.args.get(
+            'chunk_size', bulk.chunk_size_setting(), type=int)
+
+        if format not in bulk.FORMATS or chunk_size < 1:
+            abort(400)
+
+        lines = (line.decode('utf-8', errors='replace')
+                 for line in request.stream)
+        summary = bulk.import_questions(lines, format, chunk_size)
+
+        return jsonify({
+            'success': True,
+            'inserted': summary['inserted'],
+            'total_errors': summary['total_errors'],
+            'errors': summary['errors']
+        })
+
+    # ------------------------------------------------------------------------
+    # GET /api/v1.0/questions/export?format=<ndjson|csv>&category=<c>&difficulty=<d>:
+    # Streams all questions, optionally only those of category <c> (type or
+    # id) and/or difficulty <d>, in the format of the bulk import.
+    # ------------------------------------------------------------------------
+    @app.route('/api/v1.0/questions/export')
+    def export_questions():
+        format = request.args.get('format', 'ndjson')
+        difficulty = request.args.get('difficulty', None, type=int)
+        category_id = None
+
+        if format not in bulk.FORMATS:
+            abort(400)
+
+        if 'category' in request.args:
+            category = find_category(request.args.get('category'))
+            if category is None:
+                abort(404)
+            category_id = category['id']
+
+        return Response(
+            stream_with_context(bulk.export_questions(
+                format, category_id, difficulty, bulk.chunk_size_setting())),
+            mimetype=bulk.CONTENT_TYPES[format],
+            headers={'Content-Disposition':
+                     f'attachment; filename=questions.{format}'})
+
     """
     @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -342,22 +627,47 @@ def create_app(test_config=None):
     # Retrieves all questions for category <cat_id>
     # ------------------------------------------------------------------------
     @app.route('/api/v1.0/categories/<int:cat_id>/questions')
+    @cached_response
+    @read_only('GET')
     def get_quest_by_categpry(cat_id):
-        category = Category.query.filter(Category.id == cat_id).one_or_none()
-
-        questions = Question.query.filter(
-            Question.category == category.type).all()
+        category = category_catalog.get(cat_id)
 
-        if len(questions) == 0:
+        if category is None:
             abort(404)
 
-        paginated_questions_set = paginate_questions(request, questions)
+        paginated_questions_set, total_questions = paginate_category(
+            request, category['id'])
+
+        if total_questions == 0 or len(paginated_questions_set) == 0:
+            abort(404)
 
         return jsonify({
             'success': True,
             'questions': paginated_questions_set,
-            'total_questions': len(questions),
-            'current_category': category.format(),
+            'total_questions': total_questions,
+            'next_cursor': next_cursor(paginated_questions_set),
+            'current_category': category,
+        })
+
+    # -----------------------------------------------------------------------------
+    # GET /api/v1.0/categories/<cat_id>/stats: the stats of the questions of
+    # category <cat_id>, of all categories for 0, in total and by difficulty
+    # ----------------------------------------------------------------------------
+    @app.route('/api/v1.0/categories/<int:cat_id>/stats')
+    @read_only('GET')
+    def get_category_stats(cat_id):
+        category = None
+        if cat_id != ALL_CATEGORIES:
+            category = category_catalog.get(cat_id)
+            if category is None:
+                abort(404)
+
+        stats, difficulties = question_stats.category(cat_id)
+        return jsonify({
+            'success': True,
+            'category': category,
+            'stats': stats,
+            'difficulties': difficulties
         })
 
     """
@@ -376,38 +686,193 @@ def create_app(test_config=None):
     # Retrieves a new randomized question in the current category
     # ----------------------------------------------------------------------------
     @app.route('/api/v1.0/quizzes', methods=['POST'])
+    @read_only('POST')
     def post_quizzes():
         body = request.get_json()
-        if 'previous_questions' in body and 'quiz_category' in body:
+        if 'session_id' in body:
+            return next_session_question(body.get('session_id'))
+
+        elif 'previous_questions' in body and 'quiz_category' in body:
             previous_questions = body.get('previous_questions')
-            quiz_category = body.get('quiz_category')
+            try:
+                # quiz_category id is 0 (ALL_CATEGORIES) when 'all' is specified
+                category_id = parse_category_id(body.get('quiz_category'))
+                # share of the previous questions answered correctly
+                accuracy = parse_accuracy(body.get('accuracy'))
+                count = parse_count(body.get('count'))
+            except ValueError:
+                abort(422)
 
-            new_question_pool = None
-            if quiz_category['id'] == 0:  # when 'all' is specified as category
-                new_question_pool = Question.query.filter(
-                    Question.id.notin_(previous_questions)).all()
+            if count is not None:
+                # the next `count` questions at once, read with one query
+                questions = random_questions(
+                    category_id, previous_questions, count, accuracy)
+                question_stats.served(current_app._get_current_object(), questions)
+                return jsonify({
+                    'success': True,
+                    'questions': questions
+                })
 
-            else:  # where quiz_category is selected
-                new_question_pool = Question.query.filter(
-                    Question.category == quiz_category['type'], Question.id.notin_(previous_questions)).all()
+            # Select a random question from the unused questions, of a
+            # difficulty matching the accuracy of the player if given,
+            # without loading the question pool (see quiz.py)
+            new_random_question = random_question(
+                category_id, previous_questions, accuracy)
 
-            if len(new_question_pool) == 0 or new_question_pool is None:
+            if new_random_question is None:
                 return jsonify({
                     'success': True,
                     'question': None
                 })
 
-            # Select a random question from list of unused questions
-            new_random_question = random.choice(new_question_pool)
-
+            question_stats.served(current_app._get_current_object(),
+                                  [new_random_question])
             return jsonify({
                 'success': True,
-                'question': new_random_question.format()
+                'question': new_random_question
             })
 
         else:
             abort(422)
 
+    # -----------------------------------------------------------------------------
+    # POST /api/v1.0/quizzes/answers:
+    # Checks the answer of a player to a question, and records the attempt
+    #      data: {"question_id": 1, "answer": "Maya Angelou",
+    #             "player": "ann", "answer_ms": 5400}
+    # The attempt is written in the background (see attempts.py)
+    # ----------------------------------------------------------------------------
+    @app.route('/api/v1.0/quizzes/answers', methods=['POST'])
+    def post_quiz_answer():
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(422)
+        question_id = body.get('question_id')
+        answer = body.get('answer')
+        player = body.get('player')
+        answer_ms = body.get('answer_ms')
+        if (not isinstance(question_id, int) or isinstance(question_id, bool)
+                or not isinstance(answer, str)
+                or not (player is None or isinstance(player, str) and 0 < len(player) <= 64)
+                or not (answer_ms is None or isinstance(answer_ms, int)
+                        and not isinstance(answer_ms, bool) and answer_ms >= 0)):
+            abort(422)
+
+        key = answer_key.get(question_id)
+        placement = question_index.key(question_id)
+        if key is None or placement is None:
+            abort(404)
+        words, expected = key
+        category_id, difficulty = placement
+        correct = is_correct(answer, words)
+        created_at = datetime.datetime.utcnow()
+
+        if not attempt_writer.submit(current_app._get_current_object(), {
+                'player': player,
+                'question_id': question_id,
+                'category_id': category_id,
+                'correct': correct,
+                'answer_ms': answer_ms,
+                'created_at': created_at}):
+            abort(503)
+        question_stats.answered(current_app._get_current_object(), question_id,
+                                category_id, difficulty, correct, answer_ms)
+
+        return jsonify({
+            'success': True,
+            'question_id': question_id,
+            'correct': correct,
+            'answer': expected
+        })
+
+    # -----------------------------------------------------------------------------
+    # GET /api/v1.0/leaderboard?category=<cat_id>&window=<all|day|week>&limit=<n>:
+    # Retrieves the players with the most correct answers, in category
+    # <cat_id> (all categories by default), from the in-memory leaderboards
+    # (see leaderboard.py)
+    # ----------------------------------------------------------------------------
+    @app.route('/api/v1.0/leaderboard')
+    def get_leaderboard():
+        category_id = request.args.get('category', ALL_CATEGORIES, type=int)
+        window = request.args.get('window', 'all')
+        limit = request.args.get('limit', 10, type=int)
+        if category_id < 0 or window not in WINDOWS or not 0 < limit <= TOP_SIZE:
+            abort(422)
+
+        category = None
+        if category_id != ALL_CATEGORIES:
+            category = category_catalog.get(category_id)
+            if category is None:
+                abort(404)
+
+        players, total_players = leaderboards.top(category_id, window, limit)
+        return jsonify({
+            'success': True,
+            'category': category,
+            'window': window,
+            'players': players,
+            'total_players': total_players
+        })
+
+    # -----------------------------------------------------------------------------
+    # POST /api/v1.0/quizzes/sessions:
+    # Starts a quiz session with a shuffled order of the questions of
+    # 'quiz_category'. The next question is then requested with
+    # POST /api/v1.0/quizzes and body {"session_id": <id>}
+    # DELETE /api/v1.0/quizzes/sessions/<session_id>: Ends the session
+    # ----------------------------------------------------------------------------
+    @app.route('/api/v1.0/quizzes/sessions', methods=['POST'])
+    def post_quiz_session():
+        body = request.get_json()
+        if body is None or 'quiz_category' not in body:
+            abort(422)
+
+        try:
+            # quiz_category id is 0 (ALL_CATEGORIES) when 'all' is specified
+            category_id = parse_category_id(body.get('quiz_category'))
+            seed = quiz_sessions.parse_seed(body.get('seed'))
+        except ValueError:
+            abort(422)
+
+        session_id, total_questions = quiz_sessions.create_session(category_id, seed)
+
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'total_questions': total_questions
+        }), 201
+
+    @app.route('/api/v1.0/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def delete_quiz_session(session_id):
+        if not quiz_sessions.session_store.delete(session_id):
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'deleted': session_id
+        })
+
+    def next_session_question(session_id):
+        while True:
+            try:
+                question_id = quiz_sessions.session_store.advance(session_id)
+            except KeyError:  # unknown or expired session
+                abort(404)
+
+            if question_id is None:  # every question has been served
+                return jsonify({
+                    'success': True,
+                    'question': None
+                })
+
+            question = formatted_questions([question_id]).get(question_id)
+            if question is not None:  # else deleted since session start
+                question_stats.served(current_app._get_current_object(), [question])
+                return jsonify({
+                    'success': True,
+                    'question': question
+                })
+
     """
     @TODO:
     Create error handlers for all expected errors
@@ -440,6 +905,14 @@ def create_app(test_config=None):
             "message": "unprocessable"
         }), 422
 
+    @app.errorhandler(503)
+    def unavailable(error):
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": "service unavailable"
+        }), 503
+
     @app.errorhandler(405)
     def method_not_allowed(error):
         return jsonify({
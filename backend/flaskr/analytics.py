@@ -0,0 +1,217 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+from models import db, QuestionBucketStat, QuestionStat
+
+# ==============================================
+# Per question analytics: how often each question is served by
+# POST /api/v1.0/quizzes, how often it is answered, correctly, and in how
+# long, by POST /api/v1.0/quizzes/answers, also added up per category and
+# difficulty (category ALL_CATEGORIES for all of them).
+# The requests only add to counters kept in memory, a dict lookup each. A
+# thread of each process adds them to the question_stats and
+# question_bucket_stats tables every FLUSH_SECONDS, with one upsert per
+# table: the counters of every process end up in the tables.
+# The stats are read by primary key, a row per question, a row per
+# difficulty for a category, plus the counters of this process not added
+# to the tables yet.
+# ==============================================
+
+FLUSH_SECONDS = 5
+UPSERT_BATCH_SIZE = 1000
+
+ALL_CATEGORIES = 0
+
+FIELDS = ('served', 'answered', 'correct', 'timed', 'answer_ms_total')
+SERVED, ANSWERED, CORRECT, TIMED, ANSWER_MS_TOTAL = range(len(FIELDS))
+
+logger = logging.getLogger(__name__)
+
+
+def upsert_statement(table, keys):
+    """Adds the counters of a row to those of the row with the same keys."""
+    columns = keys + FIELDS
+    return text(
+        f'INSERT INTO {table} ({", ".join(columns)}) '
+        f'VALUES ({", ".join(":" + column for column in columns)}) '
+        f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET '
+        + ', '.join(f'{field} = {table}.{field} + excluded.{field}' for field in FIELDS))
+
+
+UPSERTS = (
+    upsert_statement(QuestionStat.__tablename__, ('question_id',)),
+    upsert_statement(QuestionBucketStat.__tablename__, ('category_id', 'difficulty')),
+)
+
+
+def summary(counters):
+    served, answered, correct, timed, answer_ms_total = counters
+    return {
+        'served': served,
+        'answered': answered,
+        'correct': correct,
+        'correct_rate': round(correct / answered, 4) if answered else None,
+        'avg_answer_ms': round(answer_ms_total / timed, 1) if timed else None,
+    }
+
+
+class QuestionAnalytics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # one flush at a time
+        # counters not added to the tables yet, by question id and by
+        # (category id, difficulty), then while being added
+        self.pending = ({}, {})
+        self.flushing = ({}, {})
+        self.app = None
+        self.pid = None  # process of the flushing thread
+        self.failed_flushes = 0
+
+    def count(self, app, question_id, category_id, difficulty, values):
+        """Adds the (field index, value) `values` to the counters of the
+        question and of its buckets."""
+        self.app = app
+        if self.pid != os.getpid():
+            self.start()
+        difficulty = difficulty or 0
+        with self.lock:
+            questions, buckets = self.pending
+            keys = ((ALL_CATEGORIES, difficulty),) if not category_id \
+                else ((ALL_CATEGORIES, difficulty), (category_id, difficulty))
+            targets = [questions.setdefault(question_id, [0] * len(FIELDS))]
+            targets += [buckets.setdefault(key, [0] * len(FIELDS)) for key in keys]
+            for counters in targets:
+                for field, value in values:
+                    counters[field] += value
+
+    def served(self, app, questions):
+        """Counts the formatted `questions` served."""
+        for question in questions:
+            self.count(app, question['id'], question['category_id'],
+                       question['difficulty'], ((SERVED, 1),))
+
+    def answered(self, app, question_id, category_id, difficulty, correct, answer_ms):
+        values = [(ANSWERED, 1), (CORRECT, int(correct))]
+        if answer_ms is not None:
+            values += [(TIMED, 1), (ANSWER_MS_TOTAL, answer_ms)]
+        self.count(app, question_id, category_id, difficulty, values)
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            # counters inherited through a fork are the parent's to write
+            self.pending = ({}, {})
+            self.flushing = ({}, {})
+            threading.Thread(target=self.run, name='question-analytics',
+                             daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            self.flush()
+
+    def flush(self):
+        """Adds the pending counters to the tables, returns whether they
+        were, or none was pending."""
+        with self.flush_lock:
+            return self.flush_pending()
+
+    def flush_pending(self):
+        with self.lock:
+            if not any(self.pending) or self.app is None:
+                return True
+            self.flushing = self.pending
+            self.pending = ({}, {})
+        questions, buckets = self.flushing
+
+        rows = (
+            [dict(zip(FIELDS, counters), question_id=id)
+             for id, counters in sorted(questions.items())],
+            [dict(zip(FIELDS, counters), category_id=category_id, difficulty=difficulty)
+             for (category_id, difficulty), counters in sorted(buckets.items())],
+        )
+        with self.app.app_context():
+            try:
+                # in key order, so that concurrent flushes cannot deadlock
+                for statement, table_rows in zip(UPSERTS, rows):
+                    for start in range(0, len(table_rows), UPSERT_BATCH_SIZE):
+                        db.session.execute(
+                            statement, table_rows[start:start + UPSERT_BATCH_SIZE])
+                db.session.commit()
+                flushed = True
+            except Exception:
+                db.session.rollback()
+                logger.exception('could not write the stats of %d questions',
+                                 len(questions))
+                flushed = False
+            finally:
+                db.session.remove()
+
+        with self.lock:
+            if not flushed:  # tried again on the next flush
+                for flushing, pending in zip((questions, buckets), self.pending):
+                    for key, counters in flushing.items():
+                        total = pending.setdefault(key, [0] * len(FIELDS))
+                        for field, value in enumerate(counters):
+                            total[field] += value
+                self.failed_flushes += 1
+            self.flushing = ({}, {})
+        return flushed
+
+    def unflushed(self, index, key):
+        """Counters of `key` in the pending or flushing dicts `index`."""
+        totals = [0] * len(FIELDS)
+        with self.lock:
+            for counters in (self.pending[index].get(key), self.flushing[index].get(key)):
+                if counters is not None:
+                    totals = [total + value for total, value in zip(totals, counters)]
+        return totals
+
+    def question(self, question_id):
+        """Returns the stats of the question."""
+        row = QuestionStat.query.get(question_id)
+        counters = self.unflushed(0, question_id)
+        if row is not None:
+            counters = [value + getattr(row, field)
+                        for value, field in zip(counters, FIELDS)]
+        return summary(counters)
+
+    def category(self, category_id):
+        """Returns the stats of the questions of category `category_id`, all
+        categories for ALL_CATEGORIES, in total and by difficulty."""
+        by_difficulty = {}
+        for row in QuestionBucketStat.query.filter(
+                QuestionBucketStat.category_id == category_id):
+            by_difficulty[row.difficulty] = [getattr(row, field) for field in FIELDS]
+        with self.lock:
+            difficulties = {difficulty for buckets in (self.pending[1], self.flushing[1])
+                            for category, difficulty in buckets
+                            if category == category_id}
+        for difficulty in difficulties:
+            stored = by_difficulty.get(difficulty, [0] * len(FIELDS))
+            by_difficulty[difficulty] = [
+                total + value for total, value
+                in zip(stored, self.unflushed(1, (category_id, difficulty)))]
+
+        totals = [sum(values) for values in zip([0] * len(FIELDS), *by_difficulty.values())]
+        return summary(totals), [dict(summary(counters), difficulty=difficulty)
+                                 for difficulty, counters in sorted(by_difficulty.items())]
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending[0]),
+                'failed_flushes': self.failed_flushes,
+            }
+
+
+question_stats = QuestionAnalytics()
+# the counters still pending when the process exits
+atexit.register(question_stats.flush)
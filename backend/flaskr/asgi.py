@@ -0,0 +1,432 @@
+import asyncio
+import random
+
+import asyncpg
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from config import database_path, ENGINE_PROFILE, ENGINE_PROFILES
+from . import create_app, QUESTIONS_PER_PAGE
+from . import quiz_sessions
+from .analytics import question_stats
+from .quiz import parse_accuracy, parse_count, question_index
+from .rooms import rooms, MAX_ROOM_QUESTIONS
+
+# ==============================================
+# ASGI entry point of the trivia API, for the requirements-asgi.txt extras:
+#
+#     uvicorn flaskr.asgi:app --workers 2
+#
+# The read-heavy routes below are served by async handlers querying
+# Postgres through asyncpg, so a worker keeps serving other requests while
+# it waits on the database. Every other route (all the writes) is passed to
+# the Flask app of create_app(), mounted in the same process: responses
+# have the same shape, and the writes go through the models, keeping the
+# shared quiz index and sessions up to date.
+# The live quiz rooms of flaskr/rooms.py are only served here, their
+# players being connected over WebSocket.
+# ==============================================
+
+# Connections opened by the asyncpg pool of each worker on startup, it
+# grows up to pool_size + max_overflow of the engine profile
+POOL_MIN_SIZE = 2
+
+QUESTION_COLUMNS = 'id, question, answer, category_id, difficulty'
+
+ERROR_MESSAGES = {
+    400: 'bad request',
+    403: 'forbidden',
+    404: 'resource not found',
+    422: 'unprocessable',
+}
+
+pool = None
+pool_timeout = None
+mounted_app = None  # the Flask app, whose database the question stats go to
+
+
+def json_response(data, status=200):
+    # same headers as the after_request hook of create_app()
+    return JSONResponse(data, status_code=status, headers={
+        'Access-Control-Allow-headers': 'Content-Type, Accept, Authorization',
+        'Access-Control-Allow-Methods': 'GET, POST, PATCH, DELETE, OPTIONS'
+    })
+
+
+def error(status):
+    return json_response({
+        'success': False,
+        'error': status,
+        'message': ERROR_MESSAGES[status]
+    }, status)
+
+
+def format_question(row, categories):
+    # same fields as Question.format()
+    category = categories.get(row['category_id'])
+    return {
+        'id': row['id'],
+        'question': row['question'],
+        'answer': row['answer'],
+        'category': category['type'] if category else None,
+        'category_id': row['category_id'],
+        'difficulty': row['difficulty']
+    }
+
+
+def int_arg(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+async def fetch_categories(connection):
+    """Returns the categories ordered by type, and the same by id."""
+    rows = await connection.fetch('SELECT id, type FROM categories ORDER BY type')
+    categories = [{'id': row['id'], 'type': row['type']} for row in rows]
+    return categories, {category['id']: category for category in categories}
+
+
+async def fetch_page(connection, request, category_id, categories):
+    """Async counterpart of paginate_questions(), same arguments and order."""
+    page = int_arg(request, 'page', 1)
+    cursor = int_arg(request, 'cursor', None)
+
+    total_questions = await connection.fetchval(
+        'SELECT count(*) FROM questions WHERE category_id = $1', category_id)
+
+    if cursor is not None:
+        rows = await connection.fetch(
+            f'SELECT {QUESTION_COLUMNS} FROM questions WHERE category_id = $1 '
+            'AND (question, id) > ((SELECT question FROM questions WHERE id = $2), $2) '
+            'ORDER BY question, id LIMIT $3', category_id, cursor, QUESTIONS_PER_PAGE)
+    else:
+        rows = await connection.fetch(
+            f'SELECT {QUESTION_COLUMNS} FROM questions WHERE category_id = $1 '
+            'ORDER BY question, id LIMIT $2 OFFSET $3', category_id,
+            QUESTIONS_PER_PAGE, max(page - 1, 0) * QUESTIONS_PER_PAGE)
+
+    questions = [format_question(row, categories) for row in rows]
+    next_cursor = questions[-1]['id'] if len(questions) == QUESTIONS_PER_PAGE else None
+    return questions, total_questions, next_cursor
+
+
+# ------------------------------------------------------------------------
+# GET /api/v1.0/categories
+# ------------------------------------------------------------------------
+async def get_categories(request):
+    async with pool.acquire(timeout=pool_timeout) as connection:
+        categories, by_id = await fetch_categories(connection)
+
+    if len(categories) == 0:
+        return error(404)
+
+    return json_response({
+        'success': True,
+        'categories': categories
+    })
+
+
+# ------------------------------------------------------------------------
+# GET /api/v1.0/questions?page=<val>&currCat=<cat_id>
+# ------------------------------------------------------------------------
+async def get_questions(request):
+    curr_cat_id = int_arg(request, 'currCat', 1)
+
+    async with pool.acquire(timeout=pool_timeout) as connection:
+        categories, by_id = await fetch_categories(connection)
+        if len(categories) == 0:
+            return error(404)
+
+        current_category = by_id.get(curr_cat_id, categories[0])
+        questions, total_questions, next_cursor = await fetch_page(
+            connection, request, current_category['id'], by_id)
+
+    if total_questions == 0 or len(questions) == 0:
+        return error(404)
+
+    return json_response({
+        'success': True,
+        'questions': questions,
+        'total_questions': total_questions,
+        'next_cursor': next_cursor,
+        'categories': categories,
+        'current_category': current_category
+    })
+
+
+# ------------------------------------------------------------------------
+# GET /api/v1.0/questions/<que_id>
+# ------------------------------------------------------------------------
+async def get_question(request):
+    async with pool.acquire(timeout=pool_timeout) as connection:
+        row = await connection.fetchrow(
+            f'SELECT {QUESTION_COLUMNS} FROM questions WHERE id = $1',
+            request.path_params['que_id'])
+        if row is None:
+            return error(404)
+        categories, by_id = await fetch_categories(connection)
+
+    return json_response({
+        'success': True,
+        'question': format_question(row, by_id)
+    })
+
+
+# ------------------------------------------------------------------------
+# GET /api/v1.0/categories/<cat_id>/questions?page=<val>
+# ------------------------------------------------------------------------
+async def get_quest_by_category(request):
+    async with pool.acquire(timeout=pool_timeout) as connection:
+        categories, by_id = await fetch_categories(connection)
+        category = by_id.get(request.path_params['cat_id'])
+        if category is None:
+            return error(404)
+
+        questions, total_questions, next_cursor = await fetch_page(
+            connection, request, category['id'], by_id)
+
+    if total_questions == 0 or len(questions) == 0:
+        return error(404)
+
+    return json_response({
+        'success': True,
+        'questions': questions,
+        'total_questions': total_questions,
+        'next_cursor': next_cursor,
+        'current_category': category,
+    })
+
+
+# ------------------------------------------------------------------------
+# POST /api/v1.0/quizzes
+# Picks the question with the quiz index and quiz sessions shared with the
+# mounted Flask app, only the chosen question is read from the database.
+# ------------------------------------------------------------------------
+async def load_question_index(connection):
+    if not question_index.loaded:
+        question_index.fill(await connection.fetch(
+            'SELECT id, category_id, difficulty FROM questions'))
+
+
+async def quiz_questions(connection, category_id, previous_questions, count,
+                         accuracy):
+    """Returns the response to a quiz request for the next `count`
+    questions, read with one query."""
+    excluded = list(previous_questions)
+    rows = []
+    while len(rows) < count:
+        ids = question_index.sample(category_id, excluded, count - len(rows), accuracy)
+        if not ids:
+            break
+        excluded.extend(ids)
+        found = {row['id']: row for row in await connection.fetch(
+            f'SELECT {QUESTION_COLUMNS} FROM questions WHERE id = ANY($1::int[])',
+            ids)}
+        for id in ids:
+            if id in found:
+                rows.append(found[id])
+            else:  # deleted behind our back, forget it
+                question_index.discard(id)
+
+    categories, by_id = await fetch_categories(connection)
+    questions = [format_question(row, by_id) for row in rows]
+    question_stats.served(mounted_app, questions)
+    return json_response({
+        'success': True,
+        'questions': questions
+    })
+
+
+async def post_quizzes(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return error(400)
+
+    async with pool.acquire(timeout=pool_timeout) as connection:
+        await load_question_index(connection)
+
+        while True:
+            if 'session_id' in body:
+                try:
+                    question_id = quiz_sessions.session_store.advance(
+                        body.get('session_id'))
+                except KeyError:  # unknown or expired session
+                    return error(404)
+
+            elif 'previous_questions' in body and 'quiz_category' in body:
+                try:
+                    accuracy = parse_accuracy(body.get('accuracy'))
+                    count = parse_count(body.get('count'))
+                except ValueError:
+                    return error(422)
+                if count is not None:
+                    return await quiz_questions(
+                        connection, int(body['quiz_category']['id']),
+                        body['previous_questions'], count, accuracy)
+                question_id = question_index.pick(
+                    int(body['quiz_category']['id']), body['previous_questions'],
+                    accuracy)
+
+            else:
+                return error(422)
+
+            if question_id is None:
+                return json_response({'success': True, 'question': None})
+
+            row = await connection.fetchrow(
+                f'SELECT {QUESTION_COLUMNS} FROM questions WHERE id = $1',
+                question_id)
+            if row is not None:
+                break
+            # deleted behind our back, forget it
+            question_index.discard(question_id)
+
+        categories, by_id = await fetch_categories(connection)
+
+    question = format_question(row, by_id)
+    question_stats.served(mounted_app, [question])
+    return json_response({
+        'success': True,
+        'question': question
+    })
+
+
+# ------------------------------------------------------------------------
+# POST /api/v1.0/rooms
+# Creates a live quiz room over `count` random questions of 'quiz_category'
+#      data: {"quiz_category": {"id": 1}, "count": 10}
+# POST /api/v1.0/rooms/<room_id>/next
+# Ends the current question of the room and starts the next one
+#      data: {"host_token": "<token returned on creation>"}
+# WebSocket /api/v1.0/rooms/<room_id>/players?name=<name>
+# Joins the room as a player, see flaskr/rooms.py
+# ------------------------------------------------------------------------
+async def post_room(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return error(400)
+    if not isinstance(body, dict) or 'quiz_category' not in body:
+        return error(422)
+    count = body.get('count', 10)
+    if isinstance(count, bool) or not isinstance(count, int) \
+            or not 1 <= count <= MAX_ROOM_QUESTIONS:
+        return error(422)
+
+    async with pool.acquire(timeout=pool_timeout) as connection:
+        await load_question_index(connection)
+        ids = question_index.ids(int(body['quiz_category']['id']))
+        ids = random.sample(ids, min(count, len(ids)))
+        # drawn once, the room keeps its questions whatever happens to them
+        found = {row['id']: row for row in await connection.fetch(
+            f'SELECT {QUESTION_COLUMNS} FROM questions WHERE id = ANY($1::int[])',
+            ids)}
+        categories, by_id = await fetch_categories(connection)
+
+    questions = [format_question(found[id], by_id) for id in ids if id in found]
+    if not questions:
+        return error(404)
+
+    room = rooms.create(int(body['quiz_category']['id']), questions)
+    return json_response({
+        'success': True,
+        'room_id': room.id,
+        'host_token': room.host_token,
+        'total_questions': len(questions)
+    }, 201)
+
+
+async def post_room_next(request):
+    room = rooms.get(request.path_params['room_id'])
+    if room is None:
+        return error(404)
+    try:
+        body = await request.json()
+    except ValueError:
+        return error(400)
+    if not isinstance(body, dict) or body.get('host_token') != room.host_token:
+        return error(403)
+
+    state = await room.advance()
+    return json_response(dict(state, success=True, finished=room.finished))
+
+
+async def room_players(websocket):
+    room = rooms.get(websocket.path_params['room_id'])
+    if room is None:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    player = room.join(websocket.query_params.get('name', 'player'))
+
+    async def send_queue():
+        while not player.dropped:
+            await websocket.send_text(await player.queue.get())
+        await websocket.close(code=4408)
+
+    sender = asyncio.ensure_future(send_queue())
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if not isinstance(message, dict) or message.get('type') != 'answer':
+                continue
+            index = message.get('index')
+            correct = await room.answer(player, index, message.get('answer', ''))
+            if correct is not None:
+                room.send(player, {'type': 'answered', 'index': index,
+                                   'correct': correct, 'score': player.score})
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        room.leave(player)
+        sender.cancel()
+
+
+def create_asgi_app(database_url=database_path, flask_app=None,
+                    profile=ENGINE_PROFILE):
+    global mounted_app
+    if flask_app is None:
+        flask_app = create_app()
+    mounted_app = flask_app
+    options = ENGINE_PROFILES[profile]
+
+    async def open_pool():
+        global pool, pool_timeout
+        max_size = options['pool_size'] + options['max_overflow']
+        settings = {}
+        if options['statement_timeout']:
+            settings['statement_timeout'] = str(options['statement_timeout'])
+        pool_timeout = options['pool_timeout']
+        pool = await asyncpg.create_pool(
+            database_url, min_size=min(POOL_MIN_SIZE, max_size), max_size=max_size,
+            statement_cache_size=100 if options['prepared_statements'] else 0,
+            server_settings=settings)
+
+    async def close_pool():
+        await pool.close()
+
+    return Starlette(
+        routes=[
+            Route('/api/v1.0/categories', get_categories, methods=['GET']),
+            Route('/api/v1.0/questions', get_questions, methods=['GET']),
+            Route('/api/v1.0/questions/{que_id:int}', get_question, methods=['GET']),
+            Route('/api/v1.0/categories/{cat_id:int}/questions',
+                  get_quest_by_category, methods=['GET']),
+            Route('/api/v1.0/quizzes', post_quizzes, methods=['POST']),
+            Route('/api/v1.0/rooms', post_room, methods=['POST']),
+            Route('/api/v1.0/rooms/{room_id}/next', post_room_next, methods=['POST']),
+            WebSocketRoute('/api/v1.0/rooms/{room_id}/players', room_players),
+            # everything else is served by the Flask app
+            Mount('', app=WSGIMiddleware(flask_app)),
+        ],
+        on_startup=[open_pool],
+        on_shutdown=[close_pool])
+
+
+app = create_asgi_app()
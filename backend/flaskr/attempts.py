@@ -0,0 +1,182 @@
+import atexit
+import logging
+import os
+import re
+import threading
+from collections import deque
+
+from models import db, on_change, replica_reads, Attempt, Question
+
+# ==============================================
+# Answer checking and recording, for POST /api/v1.0/quizzes/answers.
+# Answers are checked against the answer key, the words of the answer of
+# every question, loaded once and kept up to date by the Question model
+# change notifications: the request reads nothing from the database.
+# Attempts are then queued in memory, and a thread of each process writes
+# them to the attempts table in batches, every FLUSH_SECONDS or as soon
+# as BATCH_SIZE of them are waiting, so that the request never waits on a
+# commit. Up to MAX_PENDING attempts wait for their batch: past that, the
+# attempts are not recorded (while the database is down, for instance).
+# ==============================================
+
+FLUSH_SECONDS = 0.5
+BATCH_SIZE = 1000
+MAX_PENDING = 100000
+
+logger = logging.getLogger(__name__)
+
+
+ARTICLES = frozenset(('a', 'an', 'the'))
+
+
+def answer_words(text):
+    """The words of an answer, in order, ignoring case and punctuation."""
+    return tuple(re.findall(r'\w+', str(text or '').lower()))
+
+
+def is_correct(guess, expected_words):
+    """True if `guess` has the words of the expected answer, in the same
+    order, but for at most one article, e.g. "beatles!" for "The Beatles".
+    A guess naming more than the answer is not correct."""
+    if not expected_words:
+        return False
+    words = answer_words(guess)
+    if words == expected_words:
+        return True
+    if abs(len(words) - len(expected_words)) != 1:
+        return False
+    longer, shorter = sorted((words, expected_words), key=len, reverse=True)
+    return any(word in ARTICLES and longer[:i] + longer[i + 1:] == shorter
+               for i, word in enumerate(longer))
+
+
+class AnswerKey:
+    """Words and text of the answer of each question. Its category and
+    difficulty are those of the quiz index (see quiz.py)."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.answers = {}  # question id -> (answer words, answer)
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            with replica_reads(False):  # replicas may lag behind
+                rows = db.session.query(Question.id, Question.answer).all()
+            self.answers = {id: (answer_words(answer), answer) for id, answer in rows}
+            self.loaded = True
+
+    def reset(self):
+        with self.lock:
+            self.loaded = False
+            self.answers = {}
+
+    def question_changed(self, table, operation, question):
+        if table != Question.__tablename__:
+            return
+        if operation == 'reload':
+            self.reset()
+            return
+        with self.lock:
+            if not self.loaded:
+                return
+            self.answers.pop(question.id, None)
+            if operation != 'delete':
+                self.answers[question.id] = (answer_words(question.answer),
+                                             question.answer)
+
+    def get(self, question_id):
+        """Returns (answer words, answer), or None."""
+        self.load()
+        return self.answers.get(question_id)
+
+
+answer_key = AnswerKey()
+on_change(answer_key.question_changed)
+
+
+class AttemptWriter:
+    """Queue of the attempts to write, and the thread writing them."""
+
+    def __init__(self):
+        self.pending = deque()  # rows of the attempts table
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.app = None
+        self.pid = None  # process of the writing thread
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    def submit(self, app, attempt):
+        """Queues the `attempt` row, returns False when too many wait."""
+        if len(self.pending) >= MAX_PENDING:
+            with self.lock:
+                self.dropped += 1
+            return False
+        self.app = app
+        self.pending.append(attempt)
+        if self.pid != os.getpid():
+            self.start()
+        if len(self.pending) >= BATCH_SIZE:
+            self.wakeup.set()
+        return True
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self.run, name='attempt-writer', daemon=True).start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(FLUSH_SECONDS)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes the queued attempts, in batches, until none is left or a
+        batch fails. Returns the number of attempts written."""
+        written = 0
+        if not self.pending or self.app is None:
+            return written
+        with self.app.app_context():
+            try:
+                while self.pending:
+                    batch = []
+                    while self.pending and len(batch) < BATCH_SIZE:
+                        batch.append(self.pending.popleft())
+                    try:
+                        db.session.execute(Attempt.__table__.insert(), batch)
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception('could not write %d attempts', len(batch))
+                        # tried again on the next flush
+                        self.pending.extendleft(reversed(batch))
+                        with self.lock:
+                            self.failed_batches += 1
+                        break
+                    written += len(batch)
+                    with self.lock:
+                        self.written += len(batch)
+            finally:
+                db.session.remove()
+        return written
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed_batches': self.failed_batches,
+            }
+
+
+attempt_writer = AttemptWriter()
+# the attempts still queued when the process exits
+atexit.register(attempt_writer.flush)
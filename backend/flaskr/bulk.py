@@ -0,0 +1,238 @@
+import csv
+import io
+import json
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import db, notify_reload, Question
+from .catalog import category_catalog, find_category
+
+# ==============================================
+# Bulk import of questions, from NDJSON (one json object per line) or CSV
+# (with a header line) with the fields of POST /api/v1.0/questions.
+# Rows are read and validated one at a time and inserted by chunks, with
+# one executemany INSERT per chunk, or a COPY FROM STDIN on Postgres, and
+# one commit per chunk. Invalid rows are reported with their line number
+# and skipped; they do not stop the import.
+#
+# Bulk export writes questions in the same formats, so that an export can
+# be imported again, streaming them from a server-side cursor.
+# ==============================================
+
+# Rows inserted per statement and transaction, unless configured otherwise
+BULK_CHUNK_SIZE = 1000
+
+# Only the first errors are reported, the others are only counted
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ('ndjson', 'csv')
+
+COLUMNS = ('question', 'answer', 'category_id', 'difficulty')
+
+EXPORT_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def read_rows(lines, format):
+    """Yields (line number, row dict or error message) for every record of
+    `lines`, an iterable of text lines."""
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_num, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_num, 'invalid json'
+            continue
+        if not isinstance(row, dict):
+            yield line_num, 'not a json object'
+            continue
+        yield line_num, row
+
+
+def validate_row(row):
+    """Returns the column values of a new question, or raises ValueError."""
+    for field in ('question', 'answer', 'category', 'difficulty'):
+        if row.get(field) in (None, ''):
+            raise ValueError(f'missing {field}')
+
+    category = find_category(row['category'])
+    if category is None:
+        raise ValueError(f'unknown category {row["category"]}')
+
+    try:
+        difficulty = int(row['difficulty'])
+    except (TypeError, ValueError):
+        raise ValueError('difficulty is not an integer')
+
+    return (str(row['question']), str(row['answer']), category['id'], difficulty)
+
+
+def insert_chunk(values):
+    if db.engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(values)
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            f'COPY {Question.__tablename__} ({", ".join(COLUMNS)}) '
+            'FROM STDIN WITH (FORMAT csv)', buffer)
+    else:
+        db.session.execute(Question.__table__.insert(),
+                           [dict(zip(COLUMNS, row)) for row in values])
+    db.session.commit()
+
+
+def import_questions(lines, format, chunk_size=BULK_CHUNK_SIZE):
+    """Imports the questions of `lines`, returns a summary of the form
+    {'inserted': <count>, 'total_errors': <count>,
+     'errors': [{'line': <line number>, 'error': <message>}, ...]}."""
+    summary = {'inserted': 0, 'total_errors': 0, 'errors': []}
+
+    def error(line_num, message):
+        summary['total_errors'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'line': line_num, 'error': message})
+
+    def flush(chunk):
+        try:
+            insert_chunk([values for line_num, values in chunk])
+            summary['inserted'] += len(chunk)
+        except Exception as e:
+            db.session.rollback()
+            for line_num, values in chunk:
+                error(line_num, f'not inserted: {e.__class__.__name__}')
+
+    chunk = []
+    try:
+        for line_num, row in read_rows(lines, format):
+            if isinstance(row, str):
+                error(line_num, row)
+                continue
+            try:
+                chunk.append((line_num, validate_row(row)))
+            except ValueError as e:
+                error(line_num, str(e))
+                continue
+
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+
+        if chunk:
+            flush(chunk)
+    finally:
+        if summary['inserted']:
+            notify_reload(Question.__tablename__)
+
+    return summary
+
+
+def export_questions(format, category_id=None, difficulty=None,
+                     chunk_size=BULK_CHUNK_SIZE):
+    """Yields the questions, optionally only those of `category_id` and
+    `difficulty`, as chunks of text in `format`.
+
+    Rows are fetched `chunk_size` at a time through a server-side cursor
+    (yield_per) and written as they arrive, so memory use does not grow
+    with the table. The first row is sent on its own, right away.
+    """
+    selection = db.session.query(
+        Question.id, Question.question, Question.answer,
+        Question.category_id, Question.difficulty)
+    if category_id is not None:
+        selection = selection.filter(Question.category_id == category_id)
+    if difficulty is not None:
+        selection = selection.filter(Question.difficulty == difficulty)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == 'csv':
+        writer.writerow(EXPORT_FIELDS)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    count = 0
+    for id, question, answer, question_category_id, question_difficulty in \
+            selection.order_by(Question.id).yield_per(chunk_size):
+        category = category_catalog.get(question_category_id)
+        row = (id, question, answer, category['type'] if category else None,
+               question_difficulty)
+        if format == 'csv':
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n')
+
+        count += 1
+        if count == 1 or count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def chunk_size_setting():
+    return current_app.config.get('BULK_CHUNK_SIZE', BULK_CHUNK_SIZE)
+
+
+# ------------------------------------------------------------------------
+# flask import-questions <file> [--format ndjson|csv] [--chunk-size n]
+# ------------------------------------------------------------------------
+@click.command('import-questions')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'format', type=click.Choice(FORMATS), default=None,
+              help='Format of FILE, guessed from its extension by default.')
+@click.option('--chunk-size', type=int, default=None,
+              help='Rows inserted per transaction.')
+@with_appcontext
+def import_command(file, format, chunk_size):
+    """Imports the questions of FILE."""
+    if format is None:
+        format = 'csv' if file.name.endswith('.csv') else 'ndjson'
+
+    summary = import_questions(file, format, chunk_size or chunk_size_setting())
+
+    for e in summary['errors']:
+        click.echo(f'line {e["line"]}: {e["error"]}', err=True)
+    click.echo(f'{summary["inserted"]} questions imported, '
+               f'{summary["total_errors"]} rows rejected')
+
+
+# ------------------------------------------------------------------------
+# flask export-questions [--format ndjson|csv] [--category c]
+#                        [--difficulty d] [--output file]
+# ------------------------------------------------------------------------
+@click.command('export-questions')
+@click.option('--format', 'format', type=click.Choice(FORMATS), default='ndjson')
+@click.option('--category', default=None,
+              help='Only export the questions of this category (type or id).')
+@click.option('--difficulty', type=int, default=None,
+              help='Only export the questions of this difficulty.')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='File to write to, the standard output by default.')
+@with_appcontext
+def export_command(format, category, difficulty, output):
+    """Exports the questions."""
+    category_id = None
+    if category is not None:
+        found = find_category(category)
+        if found is None:
+            raise click.BadParameter(f'unknown category {category}',
+                                     param_hint='--category')
+        category_id = found['id']
+
+    for text in export_questions(format, category_id, difficulty,
+                                 chunk_size_setting()):
+        output.write(text)
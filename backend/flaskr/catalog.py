@@ -0,0 +1,76 @@
+import threading
+
+from models import on_change, replica_reads, Category
+
+# ==============================================
+# Process-level cache of the categories table.
+# Categories are read on almost every request but rarely change, so they
+# are loaded once, kept as formatted dicts by id and by lowercased type,
+# and dropped whenever Category.insert, update or delete commits.
+# ==============================================
+
+
+class CategoryCatalog:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.entries = None  # (categories ordered by type, by id, by type)
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.entries = None
+
+    def category_changed(self, table, operation, category):
+        if table == Category.__tablename__:
+            self.invalidate()
+
+    def load(self):
+        entries = self.entries
+        if entries is not None:
+            return entries
+
+        with self.lock:
+            version = self.version
+        # from the primary, a lagging replica would be cached until next write
+        with replica_reads(False):
+            categories = [category.format() for category
+                          in Category.query.order_by(Category.type).all()]
+        entries = (categories,
+                   {category['id']: category for category in categories},
+                   {category['type'].lower(): category for category in categories
+                    if category['type'] is not None})
+        with self.lock:
+            # do not keep what was read while a write was being committed
+            if self.version == version:
+                self.entries = entries
+        return entries
+
+    def all(self):
+        """Returns every category, ordered by type."""
+        return self.load()[0]
+
+    def get(self, id):
+        """Returns the category with `id`, or None."""
+        return self.load()[1].get(id)
+
+    def find(self, type):
+        """Returns the category named `type`, ignoring case, or None, also
+        when `type` is not a string."""
+        if not isinstance(type, str):
+            return None
+        return self.load()[2].get(type.lower())
+
+
+category_catalog = CategoryCatalog()
+on_change(category_catalog.category_changed)
+
+
+def find_category(category):
+    """Returns the category sent as its id or as its type, or None, also
+    when it is neither (e.g. a JSON list or true)."""
+    if isinstance(category, bool):
+        return None
+    if isinstance(category, int) or isinstance(category, str) and category.isdigit():
+        return category_catalog.get(int(category))
+    return category_catalog.find(category)
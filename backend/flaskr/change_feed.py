@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+
+from sqlalchemy import text
+
+import models
+from models import db, notify_change, replica_reads, use_change_feed, Category, Question
+
+# ==============================================
+# Change feed between the processes serving the app, set up by create_app()
+# when the CHANGE_FEED setting is on.
+# The in-process caches and indexes (categories, quiz index, search index,
+# read store, response cache) follow the changes notified by the model
+# write methods, which only reach the process making them. With the feed,
+# every committed change is also published as (table, operation, id), in
+# the transaction of the change, and a thread of every other process
+# receives it and notifies it to its own listeners, reading the changed
+# record from the database first:
+# - on Postgres, with NOTIFY on the CHANNEL channel, which the threads
+#   LISTEN to: events arrive as soon as the transaction commits;
+# - on SQLite, which has no server to push them, through the change_events
+#   outbox table, read when `PRAGMA data_version` shows that another
+#   connection committed, checked every OUTBOX_CHECK_SECONDS.
+# The listening thread is started by the first request of each process,
+# so also after a fork (e.g. gunicorn --preload).
+# ==============================================
+
+CHANNEL = 'trivia_changes'
+
+# Events per NOTIFY, keeping the payload under the 8000 bytes limit
+EVENTS_PER_NOTIFY = 100
+
+OUTBOX_TABLE = 'change_events'
+OUTBOX_CHECK_SECONDS = 0.05
+# Outbox events are deleted once older than this
+OUTBOX_RETENTION_SECONDS = 300
+
+# Wait before connecting again after the listening connection failed
+RECONNECT_SECONDS = 1
+
+MODELS = {model.__tablename__: model for model in (Question, Category)}
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed(ABC):
+    """Publishes the changes of this process and applies those of the
+    others. Subclasses implement publish() and listen()."""
+
+    def __init__(self, app):
+        self.app = app
+        self.engine = None
+        self.pid = None  # process of the listening thread
+        self.origins = {}  # process id -> identity of the process in events
+        self.thread = None
+        self.listening = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        # applied events and the delay from their commit to their application
+        self.events = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+
+    @abstractmethod
+    def publish(self, session, events):
+        """Adds the (table, operation, id) `events` to the transaction of
+        `session`."""
+
+    @abstractmethod
+    def listen(self):
+        """Applies the events of the other processes until stop()."""
+
+    @property
+    def origin(self):
+        # a new identity after a fork, the events of the parent are not ours
+        pid = os.getpid()
+        if pid not in self.origins:
+            self.origins[pid] = f'{uuid.uuid4().hex[:16]}-{pid}'
+        return self.origins[pid]
+
+    def start(self):
+        """Starts the listening thread of this process, if not running."""
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            with self.app.app_context():
+                self.engine = db.engine
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='change-feed',
+                                           daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout=5)
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.listen()
+            except Exception:
+                logger.exception('change feed connection lost')
+                if self.stopping.wait(RECONNECT_SECONDS):
+                    return
+                # events may have been missed meanwhile
+                self.apply(None, time.time(),
+                           [(table, 'reload', None) for table in MODELS])
+
+    def connection(self):
+        # a DBAPI connection of its own, out of the pool, held while listening
+        connection = self.engine.raw_connection()
+        connection.detach()
+        return connection.connection
+
+    def apply(self, origin, at, events):
+        """Notifies the (table, operation, id) `events` committed at `at`
+        by the process `origin` to the listeners of this process."""
+        if origin == self.origin:
+            return  # already notified when committed
+        with self.app.app_context():
+            try:
+                for table, operation, id in events:
+                    model = MODELS.get(table)
+                    if model is None:
+                        continue
+                    record = None
+                    if operation in ('insert', 'update'):
+                        with replica_reads(False):
+                            record = model.query.get(id)
+                        if record is None:  # deleted since
+                            operation = 'delete'
+                    if operation == 'delete':
+                        record = SimpleNamespace(id=id)
+                    notify_change(table, operation, record)
+            finally:
+                db.session.remove()
+
+        lag = max(time.time() - at, 0.0)
+        with self.lock:
+            self.events += len(events)
+            self.last_lag_seconds = lag
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'events': self.events,
+                'last_lag_seconds': round(self.last_lag_seconds, 6),
+                'max_lag_seconds': round(self.max_lag_seconds, 6),
+            }
+
+
+class PostgresChangeFeed(ChangeFeed):
+    def __init__(self, app):
+        super().__init__(app)
+        # pipe of the listening thread, written to by stop() to wake it up
+        self.wakeup = self.waker = None
+
+    def stop(self):
+        self.stopping.set()
+        with self.lock:
+            if self.waker is not None:
+                os.write(self.waker, b'.')
+        super().stop()
+
+    def publish(self, session, events):
+        for start in range(0, len(events), EVENTS_PER_NOTIFY):
+            payload = json.dumps({
+                'origin': self.origin,
+                'at': time.time(),
+                'events': events[start:start + EVENTS_PER_NOTIFY],
+            })
+            session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                            {'channel': CHANNEL, 'payload': payload},
+                            bind=db.engine)
+
+    def listen(self):
+        connection = self.connection()
+        with self.lock:
+            self.wakeup, self.waker = os.pipe()
+        try:
+            # the pool pre-ping may have left a transaction open
+            connection.rollback()
+            connection.autocommit = True
+            connection.cursor().execute(f'LISTEN {CHANNEL}')
+            self.listening.set()
+            while not self.stopping.is_set():
+                # wakes up on a notification, or on stop()
+                ready = select.select([connection, self.wakeup], [], [], 1)[0]
+                if connection not in ready:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    message = json.loads(notification.payload)
+                    self.apply(message['origin'], message['at'],
+                               [tuple(event) for event in message['events']])
+        finally:
+            self.listening.clear()
+            connection.close()
+            with self.lock:
+                os.close(self.wakeup)
+                os.close(self.waker)
+                self.wakeup = self.waker = None
+
+
+class OutboxChangeFeed(ChangeFeed):
+    def publish(self, session, events):
+        now = time.time()
+        bind = db.engine
+        session.execute(
+            text(f'INSERT INTO {OUTBOX_TABLE} '
+                 '(origin, table_name, operation, record_id, created_at) '
+                 'VALUES (:origin, :table, :operation, :id, :at)'),
+            [{'origin': self.origin, 'table': table, 'operation': operation,
+              'id': id, 'at': now} for table, operation, id in events],
+            bind=bind)
+        session.execute(
+            text(f'DELETE FROM {OUTBOX_TABLE} WHERE created_at < :before'),
+            {'before': now - OUTBOX_RETENTION_SECONDS}, bind=bind)
+
+    def listen(self):
+        connection = self.connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f'SELECT coalesce(max(id), 0) FROM {OUTBOX_TABLE}')
+            last_id, = cursor.fetchone()
+            connection.commit()
+            self.listening.set()
+            version = None
+            while not self.stopping.wait(OUTBOX_CHECK_SECONDS):
+                cursor.execute('PRAGMA data_version')
+                current, = cursor.fetchone()
+                if current == version:
+                    continue
+                version = current
+
+                cursor.execute(
+                    'SELECT id, origin, table_name, operation, record_id, created_at '
+                    f'FROM {OUTBOX_TABLE} WHERE id > ? ORDER BY id', (last_id,))
+                rows = cursor.fetchall()
+                connection.commit()
+                for id, origin, table, operation, record_id, at in rows:
+                    self.apply(origin, at, [(table, operation, record_id)])
+                    last_id = id
+        finally:
+            self.listening.clear()
+            connection.close()
+
+
+def feed_metrics():
+    """Returns the counters of the change feed, None without one."""
+    feed = models.change_feed
+    return feed.metrics() if feed is not None else None
+
+
+def init_change_feed(app):
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    feed = (PostgresChangeFeed if dialect == 'postgresql' else OutboxChangeFeed)(app)
+    use_change_feed(feed)
+
+    @app.before_request
+    def start_change_feed():
+        feed.start()
+
+    return feed
@@ -0,0 +1,289 @@
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from flask.json import JSONEncoder
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import INSTRUMENTATION_SAMPLE_RATE
+from models import pool_metrics
+from .change_feed import feed_metrics
+from .analytics import question_stats
+from .attempts import attempt_writer
+from .rate_limit import limited_requests
+from .response_cache import coalesced_requests
+
+# ==============================================
+# Opt-in per-request instrumentation, set up by create_app() when the
+# INSTRUMENTATION setting is on.
+# A sample of the requests (INSTRUMENTATION_SAMPLE_RATE, from 0 to 1) is
+# timed: database time and query count through SQLAlchemy engine events,
+# serialization time (format() in paginate_questions and JSON encoding),
+# total time and response size. Timings are returned in a Server-Timing
+# header and added up per route for GET /api/v1.0/metrics, in the
+# Prometheus text format, along with the state of the connection pool.
+# A sampled request running the same statement N_PLUS_ONE_THRESHOLD times
+# or more, the mark of one query per row (N+1), is counted and logged.
+# ==============================================
+
+N_PLUS_ONE_THRESHOLD = 5
+
+# Upper bounds of the buckets of the request duration histogram, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class RequestTiming:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_seconds = 0.0
+        self.statements = Counter()
+        self.spans = Counter()  # name -> seconds
+
+    @property
+    def queries(self):
+        return sum(self.statements.values())
+
+    def repeated_statements(self):
+        return [statement for statement, count in self.statements.items()
+                if count >= N_PLUS_ONE_THRESHOLD]
+
+
+def current_timing():
+    return g.get('timing') if has_request_context() else None
+
+
+@contextmanager
+def span(name):
+    """Adds the time spent in the block to the `name` timing of the current
+    request, if it is sampled."""
+    timing = current_timing()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.spans[name] += time.perf_counter() - start
+
+
+class TimedJSONEncoder(JSONEncoder):
+    def encode(self, o):
+        with span('serialize'):
+            return super().encode(o)
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = Counter()  # status -> count
+        self.sampled = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.serialize_seconds = 0.0
+        self.response_bytes = 0
+        self.n_plus_one = 0
+
+
+class Metrics:
+    """Request statistics by (route, method)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def stats(self, route, method):
+        key = (route, method)
+        if key not in self.routes:
+            self.routes[key] = RouteStats()
+        return self.routes[key]
+
+    def count(self, route, method, status):
+        with self.lock:
+            self.stats(route, method).requests[status] += 1
+
+    def record(self, route, method, timing, seconds, size, n_plus_one):
+        with self.lock:
+            stats = self.stats(route, method)
+            stats.sampled += 1
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+            stats.seconds += seconds
+            stats.db_seconds += timing.db_seconds
+            stats.queries += timing.queries
+            stats.serialize_seconds += timing.spans['serialize']
+            stats.response_bytes += size
+            stats.n_plus_one += n_plus_one
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format."""
+        lines = []
+
+        def family(name, type, help, samples):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{escape(value)}"'
+                                      for key, value in labels)
+                lines.append(f'{name}{suffix}{{{label_text}}} {value}'
+                             if label_text else f'{name}{suffix} {value}')
+
+        with self.lock:
+            routes = sorted(self.routes.items())
+
+            family('trivia_requests_total', 'counter',
+                   'Requests served.',
+                   [('', (('route', route), ('method', method), ('status', status)), count)
+                    for (route, method), stats in routes
+                    for status, count in sorted(stats.requests.items())])
+
+            samples = []
+            for (route, method), stats in routes:
+                if not stats.sampled:
+                    continue
+                labels = (('route', route), ('method', method))
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    samples.append(('_bucket', labels + (('le', str(bound)),), count))
+                samples.append(('_bucket', labels + (('le', '+Inf'),), stats.sampled))
+                samples.append(('_sum', labels, round(stats.seconds, 6)))
+                samples.append(('_count', labels, stats.sampled))
+            family('trivia_request_duration_seconds', 'histogram',
+                   'Total time of the sampled requests.', samples)
+
+            for name, attribute, help in (
+                    ('trivia_request_db_seconds_total', 'db_seconds',
+                     'Time spent running queries by the sampled requests.'),
+                    ('trivia_request_db_queries_total', 'queries',
+                     'Queries run by the sampled requests.'),
+                    ('trivia_request_serialize_seconds_total', 'serialize_seconds',
+                     'Time spent serializing by the sampled requests.'),
+                    ('trivia_response_bytes_total', 'response_bytes',
+                     'Size of the responses to the sampled requests.'),
+                    ('trivia_n_plus_one_total', 'n_plus_one',
+                     'Sampled requests running a statement once per row.')):
+                family(name, 'counter', help,
+                       [('', (('route', route), ('method', method)),
+                         round(getattr(stats, attribute), 6))
+                        for (route, method), stats in routes if stats.sampled])
+
+        pool = pool_metrics()
+        for name, type, help, value in (
+                ('trivia_db_pool_size', 'gauge', 'Connections kept in the pool.', pool['size']),
+                ('trivia_db_pool_checked_out', 'gauge', 'Connections in use.', pool['checked_out']),
+                ('trivia_db_pool_overflow', 'gauge', 'Connections open beyond the pool size.', pool['overflow']),
+                ('trivia_db_pool_checkouts_total', 'counter', 'Connections handed out.', pool['checkouts']),
+                ('trivia_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.', pool['wait_seconds_total']),
+                ('trivia_db_pool_timeouts_total', 'counter', 'Requests which gave up waiting for a connection.', pool['timeouts'])):
+            family(name, type, help, [('', (), value)])
+
+        attempts = attempt_writer.metrics()
+        for name, type, help, value in (
+                ('trivia_attempts_pending', 'gauge', 'Answers waiting to be written.', attempts['pending']),
+                ('trivia_attempts_written_total', 'counter', 'Answers written to the attempts table.', attempts['written']),
+                ('trivia_attempts_dropped_total', 'counter', 'Answers not recorded, too many were waiting.', attempts['dropped']),
+                ('trivia_attempts_failed_batches_total', 'counter', 'Batches of answers which failed to be written.', attempts['failed_batches'])):
+            family(name, type, help, [('', (), value)])
+
+        stats = question_stats.metrics()
+        for name, type, help, value in (
+                ('trivia_question_stats_pending', 'gauge', 'Questions with counters not written yet.', stats['pending']),
+                ('trivia_question_stats_failed_flushes_total', 'counter', 'Writes of the question counters which failed.', stats['failed_flushes'])):
+            family(name, type, help, [('', (), value)])
+
+        for name, help, value in (
+                ('trivia_coalesced_requests_total', 'Requests answered with the response of an identical one in flight.', coalesced_requests()),
+                ('trivia_rate_limited_requests_total', 'Requests answered 429.', limited_requests())):
+            if value is not None:
+                family(name, 'counter', help, [('', (), value)])
+
+        feed = feed_metrics()
+        if feed is not None:
+            for name, type, help, value in (
+                    ('trivia_change_feed_events_total', 'counter', 'Changes of other processes applied.', feed['events']),
+                    ('trivia_change_feed_lag_seconds', 'gauge', 'Delay from the publication of the last change applied to its application.', feed['last_lag_seconds']),
+                    ('trivia_change_feed_max_lag_seconds', 'gauge', 'Longest delay from the publication of a change to its application.', feed['max_lag_seconds'])):
+                family(name, type, help, [('', (), value)])
+
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_timing() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = current_timing()
+    if timing is None or not conn.info.get('query_start'):
+        return
+    timing.db_seconds += time.perf_counter() - conn.info['query_start'].pop()
+    timing.statements[statement] += 1
+
+
+def server_timing(timing, total):
+    """Returns the Server-Timing header value of `timing`, in milliseconds."""
+    serialize = timing.spans['serialize']
+    entries = [
+        f'db;dur={timing.db_seconds * 1000:.3f};desc="{timing.queries} queries"',
+        f'serialize;dur={serialize * 1000:.3f}',
+        f'app;dur={max(total - timing.db_seconds - serialize, 0) * 1000:.3f}',
+        f'total;dur={total * 1000:.3f}',
+    ]
+    return ', '.join(entries)
+
+
+def init_instrumentation(app):
+    sample_rate = app.config.get('INSTRUMENTATION_SAMPLE_RATE',
+                                 INSTRUMENTATION_SAMPLE_RATE)
+    app.json_encoder = TimedJSONEncoder
+
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_timing():
+        if random.random() < sample_rate:
+            g.timing = RequestTiming()
+
+    @app.after_request
+    def record_timing(response):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.count(route, request.method, response.status_code)
+
+        timing = g.pop('timing', None)
+        if timing is None:
+            return response
+
+        total = time.perf_counter() - timing.start
+        size = response.calculate_content_length() or 0
+        repeated = timing.repeated_statements()
+        for statement in repeated:
+            app.logger.warning('N+1 queries in %s %s: %d times %s', request.method,
+                               route, timing.statements[statement], statement)
+
+        metrics.record(route, request.method, timing, total, size, bool(repeated))
+        response.headers['Server-Timing'] = server_timing(timing, total)
+        return response
+
+    # ------------------------------------------------------------------------
+    # GET /api/v1.0/metrics
+    # Request and connection pool metrics, in the Prometheus text format
+    # ------------------------------------------------------------------------
+    @app.route('/api/v1.0/metrics')
+    def get_metrics():
+        return Response(metrics.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
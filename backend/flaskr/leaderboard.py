@@ -0,0 +1,221 @@
+import datetime
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import func, or_
+
+from models import db, on_change, replica_reads, Attempt, Category
+
+# ==============================================
+# Leaderboards of GET /api/v1.0/leaderboard: the players with the most
+# correct answers, overall and per category, for all time, the current day
+# and the current week (UTC). Each board keeps the score of every player
+# and, sorted, the TOP_SIZE best of them, updated as each attempt is
+# scored: reading a board costs the same at any number of attempts.
+# Scores only grow, so a player outside the top can only enter it by
+# passing the last of it, and the top stays exact.
+#
+# The boards are built by create_app(), by a single streaming pass over the
+# correct attempts of named players. A thread of each process then reads
+# the attempts written since, by any process, every REFRESH_SECONDS, by id:
+# every worker has the same boards, a second or so after the attempt
+# writers flush (see attempts.py). The ids of concurrent transactions may
+# commit out of order, so the ids skipped by a read are read again, until
+# found or GAP_SECONDS old (those of rolled back batches).
+# ==============================================
+
+TOP_SIZE = 100
+
+# Attempts read per round trip while loading the boards
+LOAD_BATCH_SIZE = 10000
+
+REFRESH_SECONDS = 1
+# The last attempts when loading, read by the first refresh instead, which
+# tracks the ids skipped
+RECENT_ATTEMPTS = 1000
+GAP_SECONDS = 60
+MAX_GAPS = 10000
+
+# Current period of each window, from a UTC datetime
+WINDOWS = {
+    'all': lambda at: None,
+    'day': lambda at: at.date(),
+    'week': lambda at: tuple(at.isocalendar()[:2]),
+}
+
+ALL_CATEGORIES = 0
+
+logger = logging.getLogger(__name__)
+
+
+class TopK:
+    """Scores of the players in a period, with the best of them in order."""
+    __slots__ = ('period', 'scores', 'top')
+
+    def __init__(self, period):
+        self.period = period
+        self.scores = {}  # player -> correct answers
+        self.top = []  # (-score, player) of the TOP_SIZE best players, sorted
+
+    def add(self, player):
+        """Counts one more correct answer of `player`."""
+        score = self.scores.get(player, 0)
+        self.scores[player] = score + 1
+        top = self.top
+        if score:
+            position = bisect_left(top, (-score, player))
+            if position < len(top) and top[position] == (-score, player):
+                del top[position]
+        entry = (-score - 1, player)
+        if len(top) < TOP_SIZE or entry < top[-1]:
+            insort(top, entry)
+            if len(top) > TOP_SIZE:
+                top.pop()
+
+    def best(self, limit):
+        return [{'rank': rank, 'player': player, 'score': -score}
+                for rank, (score, player) in enumerate(self.top[:limit], 1)]
+
+
+class Leaderboards:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()  # one refresh at a time
+        self.loaded = False
+        # (category id, window) -> TopK of the current period of the window,
+        # ALL_CATEGORIES for the attempts of every category
+        self.boards = {}
+        self.last_id = 0  # of the attempts read
+        self.gaps = {}  # id skipped -> monotonic time it was
+        self.app = None
+        self.pid = None  # process of the refreshing thread
+
+    def load(self):
+        """Builds the boards from the attempts table, if not done yet."""
+        with self.refresh_lock, self.lock:
+            if self.loaded:
+                return
+            with replica_reads(False):  # replicas may lag behind
+                last_id = db.session.query(func.max(Attempt.id)).scalar() or 0
+                base = max(last_id - RECENT_ATTEMPTS, 0)
+                attempts = db.session.query(
+                    Attempt.player, Attempt.category_id, Attempt.created_at
+                ).filter(Attempt.correct, Attempt.player.isnot(None),
+                         Attempt.id <= base) \
+                    .yield_per(LOAD_BATCH_SIZE)
+                try:
+                    for player, category_id, at in attempts:
+                        self.add(player, category_id, at)
+                except Exception:
+                    self.boards = {}
+                    raise
+            self.last_id = base
+            self.gaps = {}
+            self.loaded = True
+        self.refresh()
+
+    def reset(self):
+        with self.refresh_lock, self.lock:
+            self.loaded = False
+            self.boards = {}
+            self.last_id = 0
+            self.gaps = {}
+
+    def refresh(self):
+        """Counts the attempts written since the last refresh, and those
+        skipped by it written since."""
+        with self.refresh_lock:
+            if not self.loaded:
+                return
+            now = time.monotonic()
+            self.gaps = {id: skipped for id, skipped in self.gaps.items()
+                         if now - skipped < GAP_SECONDS}
+            read = Attempt.id > self.last_id
+            if self.gaps:
+                read = or_(read, Attempt.id.in_(sorted(self.gaps)))
+            with replica_reads(False):
+                rows = db.session.query(
+                    Attempt.id, Attempt.player, Attempt.category_id,
+                    Attempt.correct, Attempt.created_at
+                ).filter(read).order_by(Attempt.id).all()
+
+            with self.lock:
+                for id, player, category_id, correct, at in rows:
+                    if id > self.last_id:
+                        for skipped in range(self.last_id + 1, id):
+                            if len(self.gaps) >= MAX_GAPS:
+                                break
+                            self.gaps[skipped] = now
+                        self.last_id = id
+                    else:
+                        self.gaps.pop(id, None)
+                    if correct and player is not None:
+                        self.add(player, category_id, at)
+
+    def start(self, app):
+        """Starts the refreshing thread of the process, if not done yet."""
+        self.app = app
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self.run, name='leaderboard-refresh',
+                             daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(REFRESH_SECONDS)
+            with self.app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('could not read the new attempts')
+                finally:
+                    db.session.remove()
+
+    def category_changed(self, table, operation, category):
+        if table != Category.__tablename__ or operation != 'delete':
+            return
+        with self.lock:
+            for window in WINDOWS:
+                self.boards.pop((category.id, window), None)
+
+    def add(self, player, category_id, at):
+        categories = (ALL_CATEGORIES,) if category_id is None \
+            else (ALL_CATEGORIES, category_id)
+        for window, period_of in WINDOWS.items():
+            period = period_of(at)
+            for category in categories:
+                board = self.boards.get((category, window))
+                if board is None or board.period is not None and board.period < period:
+                    board = self.boards[category, window] = TopK(period)
+                elif board.period != period:
+                    continue  # of a past period
+                board.add(player)
+
+    def top(self, category_id, window, limit):
+        """Returns the `limit` best players of the board and the number of
+        players on it."""
+        period = WINDOWS[window](datetime.datetime.utcnow())
+        with self.lock:
+            board = self.boards.get((category_id, window))
+            if board is None or board.period != period:
+                return [], 0
+            return board.best(limit), len(board.scores)
+
+
+leaderboards = Leaderboards()
+on_change(leaderboards.category_changed)
+
+
+def init_leaderboards(app):
+    with app.app_context():
+        leaderboards.load()
+
+    @app.before_request
+    def start_leaderboards():
+        leaderboards.start(app)
@@ -0,0 +1,326 @@
+import random
+import threading
+
+from models import db, on_change, replica_reads, Category, Question
+from . import read_store
+
+# ==============================================
+# In-process index of question ids, used by POST /api/v1.0/quizzes
+# to pick a random question without loading the question pool.
+# Ids are also grouped by difficulty within each category, so that the
+# difficulty of the next question can follow the accuracy of the player.
+# ==============================================
+
+# Key of the pool holding every question, whatever its category.
+# Like the 'quiz_category' id sent by the frontend for "ALL", it is never
+# the id of a real category.
+ALL_CATEGORIES = 0
+
+# Most questions returned by one POST /api/v1.0/quizzes with a `count`
+MAX_QUIZ_COUNT = 50
+
+
+class IdPool:
+    """A list of ids supporting O(1) add, remove and random choice."""
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}  # id -> index in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.positions
+
+    def add(self, id):
+        if id not in self.positions:
+            self.positions[id] = len(self.ids)
+            self.ids.append(id)
+
+    def remove(self, id):
+        position = self.positions.pop(id, None)
+        if position is None:
+            return
+        # move the last id into the freed slot
+        last = self.ids.pop()
+        if last != id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def choice(self, excluded):
+        """Returns a random id not in `excluded` (a set), or None.
+
+        The cost depends on the size of `excluded`, not on the size of
+        the pool: while at least a quarter of the pool is eligible, ids are
+        drawn at random until one is not excluded (4 draws on average).
+        Past that point the pool is at most a third bigger than `excluded`,
+        so scanning it is no more expensive than reading `excluded` was.
+        """
+        taken = sum(1 for id in excluded if id in self.positions)
+        eligible = len(self.ids) - taken
+        if eligible <= 0:
+            return None
+
+        if eligible * 4 >= len(self.ids):
+            while True:
+                id = random.choice(self.ids)
+                if id not in excluded:
+                    return id
+
+        return random.choice([id for id in self.ids if id not in excluded])
+
+
+class QuestionIndex:
+    """Question ids grouped by category, and by difficulty within each
+    category, loaded once from the database and kept up to date by the
+    Question model change notifications, and those of category deletes."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.pools = {}
+        self.levels = {}  # category id -> {difficulty: IdPool}
+        self.keys = {}  # question id -> (category id, difficulty)
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            with replica_reads(False):  # replicas may lag behind
+                self.fill(db.session.query(
+                    Question.id, Question.category_id, Question.difficulty).all())
+
+    def fill(self, rows):
+        """Loads the index from (question id, category id, difficulty) rows."""
+        with self.lock:
+            self.pools = {ALL_CATEGORIES: IdPool()}
+            self.levels = {ALL_CATEGORIES: {}}
+            self.keys = {}
+            for id, category_id, difficulty in rows:
+                self._add(id, category_id, difficulty)
+            self.loaded = True
+
+    def reset(self):
+        with self.lock:
+            self.loaded = False
+            self.pools = {}
+            self.levels = {}
+            self.keys = {}
+
+    def _add(self, id, category_id, difficulty):
+        self.keys[id] = (category_id, difficulty)
+        for key in (ALL_CATEGORIES, category_id):
+            self.pools.setdefault(key, IdPool()).add(id)
+            self.levels.setdefault(key, {}).setdefault(difficulty, IdPool()).add(id)
+
+    def _remove(self, id):
+        category_id, difficulty = self.keys.pop(id, (None, None))
+        for key in (ALL_CATEGORIES, category_id):
+            if key in self.pools:
+                self.pools[key].remove(id)
+                if difficulty in self.levels[key]:
+                    self.levels[key][difficulty].remove(id)
+
+    def question_changed(self, table, operation, question):
+        if table == Category.__tablename__ and operation == 'delete':
+            self.category_deleted(question.id)
+            return
+        if table != Question.__tablename__:
+            return
+        if operation == 'reload':
+            self.reset()
+            return
+        with self.lock:
+            if not self.loaded:
+                return
+            self._remove(question.id)
+            if operation != 'delete':
+                self._add(question.id, question.category_id, question.difficulty)
+
+    def category_deleted(self, category_id):
+        # deleting a category sets the category of its questions to NULL
+        with self.lock:
+            if not self.loaded or category_id not in self.pools:
+                return
+            for id in list(self.pools[category_id].ids):
+                difficulty = self.keys[id][1]
+                self._remove(id)
+                self._add(id, None, difficulty)
+            del self.pools[category_id]
+            del self.levels[category_id]
+
+    def difficulties(self, category_id, accuracy):
+        """Returns the difficulties of category `category_id`, the one
+        matching `accuracy` (from 0 to 1) first, then the others by
+        distance to it, the easier first."""
+        levels = sorted(difficulty for difficulty, pool
+                        in self.levels.get(category_id, {}).items()
+                        if len(pool) and difficulty is not None)
+        if not levels:
+            return [None]
+        target = round(accuracy * (len(levels) - 1))
+        order = sorted(range(len(levels)), key=lambda i: (abs(i - target), i))
+        return [levels[i] for i in order] + [None]
+
+    def pick(self, category_id, previous_questions, accuracy=None):
+        """Returns the id of a random question of category `category_id`
+        (or of any category for ALL_CATEGORIES) that is not in
+        `previous_questions`.
+
+        Given the `accuracy` of the player so far, from 0 to 1, the question
+        is taken from the difficulty of the same rank among those of the
+        category (the easiest for 0, the hardest for 1), or the closest one
+        with questions left.
+        """
+        self.load()
+        with self.lock:
+            return self._pick(category_id, set(previous_questions), accuracy)
+
+    def sample(self, category_id, previous_questions, count, accuracy=None):
+        """Returns the ids of up to `count` distinct random questions, picked
+        like pick() does."""
+        self.load()
+        excluded = set(previous_questions)
+        chosen = []
+        with self.lock:
+            while len(chosen) < count:
+                id = self._pick(category_id, excluded, accuracy)
+                if id is None:
+                    break
+                chosen.append(id)
+                excluded.add(id)
+        return chosen
+
+    def _pick(self, category_id, excluded, accuracy):
+        pool = self.pools.get(category_id)
+        if pool is None:
+            return None
+        if accuracy is None:
+            return pool.choice(excluded)
+
+        levels = self.levels[category_id]
+        for difficulty in self.difficulties(category_id, accuracy):
+            if difficulty in levels:
+                id = levels[difficulty].choice(excluded)
+                if id is not None:
+                    return id
+        return None
+
+    def key(self, question_id):
+        """Returns the (category id, difficulty) of the question, or None."""
+        self.load()
+        with self.lock:
+            return self.keys.get(question_id)
+
+    def ids(self, category_id):
+        """Returns a copy of the question ids of category `category_id`."""
+        self.load()
+        with self.lock:
+            pool = self.pools.get(category_id)
+            return list(pool.ids) if pool is not None else []
+
+    def discard(self, id):
+        with self.lock:
+            if self.loaded:
+                self._remove(id)
+
+
+question_index = QuestionIndex()
+on_change(question_index.question_changed)
+
+
+def parse_count(value):
+    """Returns the `count` of a quiz request, None if not given, raises
+    ValueError unless it is an integer from 1 to MAX_QUIZ_COUNT."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(value)
+    if not 1 <= value <= MAX_QUIZ_COUNT:
+        raise ValueError(value)
+    return value
+
+
+def parse_category_id(quiz_category):
+    """Returns the category id of the `quiz_category` of a quiz request,
+    raises ValueError unless it is an object with an integer `id`."""
+    if not isinstance(quiz_category, dict):
+        raise ValueError(quiz_category)
+    id = quiz_category.get('id')
+    if isinstance(id, bool) or not isinstance(id, (int, str)):
+        raise ValueError(id)
+    return int(id)
+
+
+def parse_accuracy(value):
+    """Returns the `accuracy` of a quiz request, None if not given, raises
+    ValueError unless it is a number from 0 to 1."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(value)
+    if not 0 <= value <= 1:
+        raise ValueError(value)
+    return float(value)
+
+
+def formatted_questions(ids):
+    """Returns {id: formatted question} for the `ids` found, from the read
+    store if there is one, else from the database."""
+    store = read_store.question_store
+    if store is not None:
+        found = {}
+        for id in ids:
+            question = store.get(id)
+            if question is not None:
+                found[id] = question
+        return found
+
+    found = {question.id: question.format() for question
+             in Question.query.filter(Question.id.in_(ids))}
+    missing = [id for id in ids if id not in found]
+    if missing:
+        # maybe added too recently to have reached the replica read from
+        with replica_reads(False):
+            found.update((question.id, question.format()) for question
+                         in Question.query.filter(Question.id.in_(missing)))
+    return found
+
+
+def random_question(category_id, previous_questions, accuracy=None):
+    """Returns a random formatted question of category `category_id` not in
+    `previous_questions`, of a difficulty matching `accuracy` if given, or
+    None once all of them have been asked."""
+    while True:
+        question_id = question_index.pick(category_id, previous_questions, accuracy)
+        if question_id is None:
+            return None
+
+        question = formatted_questions([question_id]).get(question_id)
+        if question is not None:
+            return question
+
+        # deleted behind our back (e.g. by another process), forget it
+        question_index.discard(question_id)
+
+
+def random_questions(category_id, previous_questions, count, accuracy=None):
+    """Returns up to `count` distinct random formatted questions, chosen
+    like random_question() does, read with one query (two if some are
+    missing from the replica read from)."""
+    excluded = list(previous_questions)
+    chosen = []
+    while len(chosen) < count:
+        ids = question_index.sample(category_id, excluded, count - len(chosen), accuracy)
+        if not ids:
+            break
+        excluded.extend(ids)
+
+        found = formatted_questions(ids)
+        for id in ids:
+            if id in found:
+                chosen.append(found[id])
+            else:
+                question_index.discard(id)
+    return chosen
@@ -0,0 +1,130 @@
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+
+from .quiz import question_index
+
+# ==============================================
+# Server-side quiz sessions.
+# A session is created once with a shuffled array of the question ids of
+# the chosen category; every following turn only moves a cursor along it,
+# so the client does not send 'previous_questions' and no query is needed
+# to find the next question.
+# ==============================================
+
+# Seconds a session is kept after its last use
+QUIZ_SESSION_TTL = 60 * 60
+
+
+class QuizSession:
+    def __init__(self, question_ids, ttl):
+        self.question_ids = question_ids  # array('l') of shuffled ids
+        self.cursor = 0
+        self.ttl = ttl
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + self.ttl
+
+    def remaining(self):
+        return len(self.question_ids) - self.cursor
+
+
+class SessionStore(ABC):
+    """Interface of the quiz session stores.
+
+    A store keeps the shuffled question ids of each session and its cursor.
+    Other stores (e.g. one backed by Redis) can be plugged in with
+    use_session_store(); they only need these three methods.
+    """
+
+    @abstractmethod
+    def create(self, question_ids):
+        """Saves a new session for `question_ids`, returns its id."""
+
+    @abstractmethod
+    def advance(self, session_id):
+        """Returns the next question id of the session (None when all have
+        been served) and moves the cursor past it. Raises KeyError for an
+        unknown or expired session."""
+
+    @abstractmethod
+    def delete(self, session_id):
+        """Drops the session, returns False if it did not exist."""
+
+
+class MemorySessionStore(SessionStore):
+    """Keeps sessions in this process and evicts them `ttl` seconds after
+    their last use. Sessions are held in least recently used order, so
+    expired ones are always at the front and eviction is O(1) per session."""
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def evict_expired(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.sessions:
+                session_id, session = next(iter(self.sessions.items()))
+                if session.expires_at > now:
+                    break
+                del self.sessions[session_id]
+
+    def create(self, question_ids):
+        self.evict_expired()
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[session_id] = QuizSession(question_ids, self.ttl)
+        return session_id
+
+    def advance(self, session_id):
+        self.evict_expired()
+        with self.lock:
+            session = self.sessions[session_id]
+            session.touch()
+            self.sessions.move_to_end(session_id)
+
+            if session.remaining() <= 0:
+                return None
+            question_id = session.question_ids[session.cursor]
+            session.cursor += 1
+            return question_id
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+
+session_store = MemorySessionStore()
+
+
+def use_session_store(store):
+    """Replaces the store used for new and existing quiz sessions."""
+    global session_store
+    session_store = store
+
+
+def parse_seed(value):
+    """Returns the `seed` of a session request, raises ValueError unless it
+    is an integer, a string or None."""
+    if isinstance(value, bool) or not isinstance(value, (int, str, type(None))):
+        raise ValueError(value)
+    return value
+
+
+def create_session(category_id, seed=None):
+    """Starts a quiz session over the questions of category `category_id`
+    (or all of them for ALL_CATEGORIES), in an order drawn from `seed`.
+    Returns (session id, number of questions)."""
+    question_ids = array('l', question_index.ids(category_id))
+    random.Random(seed).shuffle(question_ids)
+    return session_store.create(question_ids), len(question_ids)
@@ -0,0 +1,95 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+
+# ==============================================
+# Rate limiting, set up by create_app() when RATE_LIMIT_PER_SECOND is set.
+# Each client address has a token bucket per route (its url rule, e.g.
+# /api/v1.0/questions/<int:que_id>) holding up to `burst` tokens, refilled
+# at `rate` tokens per second. A request takes a token, or is answered 429
+# with a Retry-After header of the seconds until the next one, before its
+# view runs: a client flooding a route does not reach the database.
+# The buckets are kept by a store: MemoryBucketStore keeps those of one
+# process, so that each worker applies the limit on its own. A store
+# shared by the workers, e.g. on Redis, only has to implement take().
+# Behind reverse proxies, the client address is the forwarded one once
+# TRUSTED_PROXIES is set (see config.py).
+# ==============================================
+
+# Buckets kept by MemoryBucketStore, the least recently used are dropped
+MAX_BUCKETS = 100000
+
+
+class MemoryBucketStore:
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.lock = threading.Lock()
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()  # key -> (tokens, time they were counted)
+
+    def take(self, key, rate, burst, now):
+        """Takes a token from the bucket `key`, returns 0 if there was one,
+        else the seconds until there is."""
+        with self.lock:
+            tokens, counted = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - counted) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_buckets:
+                # full by now, or nearly
+                self.buckets.popitem(last=False)
+            return wait
+
+
+class RateLimiter:
+    def __init__(self, rate, burst, store=None):
+        self.rate = rate
+        self.burst = burst
+        self.store = store if store is not None else MemoryBucketStore()
+        self.lock = threading.Lock()
+        self.limited = 0  # requests answered 429
+
+    def check(self):
+        """Returns the seconds the client of the request has to wait before
+        sending it, 0 if it may be served."""
+        if request.method == 'OPTIONS':  # CORS preflight
+            return 0
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        wait = self.store.take((request.remote_addr, route), self.rate, self.burst,
+                               time.time())
+        if wait:
+            with self.lock:
+                self.limited += 1
+        return wait
+
+
+def limited_requests():
+    """Returns the requests answered 429, None without rate limiting."""
+    limiter = current_app.extensions.get('rate_limiter')
+    return limiter.limited if limiter is not None else None
+
+
+def init_rate_limit(app, rate, burst, store=None):
+    limiter = app.extensions['rate_limiter'] = RateLimiter(rate, burst, store)
+
+    @app.before_request
+    def limit_rate():
+        wait = limiter.check()
+        if not wait:
+            return None
+        response = jsonify({
+            'success': False,
+            'error': 429,
+            'message': 'too many requests'
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(math.ceil(wait), 1))
+        return response
+
+    return limiter
@@ -0,0 +1,183 @@
+import threading
+from array import array
+
+from models import db, on_change, replica_reads, Category, Question
+from .catalog import category_catalog
+
+# ==============================================
+# Optional read-optimized snapshot of the questions table, set up by
+# create_app() when the QUESTION_STORE setting is on.
+# The columns are held as parallel arrays, one slot per question, instead
+# of one ORM instance per row, and each category keeps the ids of its
+# questions as an integer array sorted by (question, id), the order of the
+# question pages. Question pages, GET /api/v1.0/questions/<id> and the
+# quizzes are then served without querying the database or building ORM
+# instances. The store is loaded from the database on first use and kept
+# up to date by the model change notifications.
+#
+# Strings are compared by code point, like the "C" collation: with another
+# collation, pages may be ordered differently than by the database.
+# ==============================================
+
+# Stands for NULL in the integer columns
+NULL = -1
+
+
+class QuestionStore:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self._clear()
+
+    def _clear(self):
+        # one slot per question, in no particular order
+        self.ids = array('q')
+        self.questions = []
+        self.answers = []
+        self.category_ids = array('q')
+        self.difficulties = array('q')
+        self.rows = {}  # question id -> slot
+        self.by_category = {}  # category id or None -> array of sorted ids
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self._clear()
+            with replica_reads(False):  # replicas may lag behind
+                rows = db.session.query(
+                    Question.id, Question.question, Question.answer,
+                    Question.category_id, Question.difficulty).all()
+            groups = {}
+            for row in rows:
+                self._append(*row)
+                groups.setdefault(row[3], []).append(row[0])
+            for category_id, ids in groups.items():
+                ids.sort(key=self._key)
+                self.by_category[category_id] = array('q', ids)
+            self.loaded = True
+
+    def reset(self):
+        with self.lock:
+            self.loaded = False
+            self._clear()
+
+    def _key(self, id):
+        # (question, id) order, NULL questions last like on Postgres
+        question = self.questions[self.rows[id]]
+        return (question is None, question or '', id)
+
+    def _position(self, ids, key):
+        # bisect_left of `key` in the sorted `ids`
+        low, high = 0, len(ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(ids[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _append(self, id, question, answer, category_id, difficulty):
+        self.rows[id] = len(self.ids)
+        self.ids.append(id)
+        self.questions.append(question)
+        self.answers.append(answer)
+        self.category_ids.append(NULL if category_id is None else category_id)
+        self.difficulties.append(NULL if difficulty is None else difficulty)
+
+    def _add(self, id, question, answer, category_id, difficulty):
+        self._append(id, question, answer, category_id, difficulty)
+        ids = self.by_category.setdefault(category_id, array('q'))
+        ids.insert(self._position(ids, self._key(id)), id)
+
+    def _remove(self, id):
+        if id not in self.rows:
+            return
+        category_id = self._column(self.category_ids, self.rows[id])
+        ids = self.by_category[category_id]
+        del ids[self._position(ids, self._key(id))]
+
+        # move the last slot into the freed one
+        slot = self.rows.pop(id)
+        last = len(self.ids) - 1
+        for column in (self.ids, self.questions, self.answers,
+                       self.category_ids, self.difficulties):
+            if slot != last:
+                column[slot] = column[last]
+            column.pop()
+        if slot != last:
+            self.rows[self.ids[slot]] = slot
+
+    @staticmethod
+    def _column(column, slot):
+        value = column[slot]
+        return None if value == NULL else value
+
+    def question_changed(self, table, operation, record):
+        if operation == 'reload' or (
+                table == Category.__tablename__ and operation == 'delete'):
+            # deleting a category sets the category of its questions to NULL
+            self.reset()
+            return
+        if table != Question.__tablename__:
+            return
+        with self.lock:
+            if not self.loaded:
+                return
+            self._remove(record.id)
+            if operation != 'delete':
+                self._add(record.id, record.question, record.answer,
+                          record.category_id, record.difficulty)
+
+    def _format(self, slot):
+        category_id = self._column(self.category_ids, slot)
+        category = category_catalog.get(category_id) if category_id is not None else None
+        return {
+            'id': self.ids[slot],
+            'question': self.questions[slot],
+            'answer': self.answers[slot],
+            'category': category['type'] if category else None,
+            'category_id': category_id,
+            'difficulty': self._column(self.difficulties, slot),
+        }
+
+    def get(self, id):
+        """Returns the formatted question with `id`, or None."""
+        self.load()
+        with self.lock:
+            slot = self.rows.get(id)
+            return self._format(slot) if slot is not None else None
+
+    def page(self, category_id, offset, limit, cursor=None):
+        """Returns (questions, total): `limit` formatted questions of category
+        `category_id` in (question, id) order, from `offset` or right after
+        the question with id `cursor`, and the number of questions of the
+        category."""
+        self.load()
+        with self.lock:
+            ids = self.by_category.get(category_id, ())
+            if cursor is not None:
+                if cursor not in self.rows:
+                    return [], len(ids)
+                # right after the key of the cursor, whatever its category
+                offset = self._position(ids, self._key(cursor)[:2] + (cursor + 0.5,))
+            return ([self._format(self.rows[id]) for id in ids[offset:offset + limit]],
+                    len(ids))
+
+
+question_store = None
+
+
+def use_question_store(store):
+    """Replaces the store served from, None to query the database."""
+    global question_store
+    question_store = store
+
+
+def store_changed(table, operation, record):
+    if question_store is not None:
+        question_store.question_changed(table, operation, record)
+
+
+on_change(store_changed)
@@ -0,0 +1,63 @@
+import functools
+import math
+import time
+
+from flask import current_app, g, request
+
+from config import REPLICA_LAG_SECONDS
+from models import replica_reads
+
+# ==============================================
+# Routing of read-only requests to the read replicas set up by setup_db().
+# Views decorated with read_only() run their queries on a replica, unless
+# the client wrote something less than REPLICA_LAG_SECONDS ago: every
+# successful POST, PATCH or DELETE which is not read-only sets a cookie
+# sending the client's reads to the primary until then, so that it reads
+# its own writes even though the replicas may lag behind.
+# ==============================================
+
+PRIMARY_COOKIE = 'read_primary_until'
+
+WRITE_METHODS = ('POST', 'PATCH', 'DELETE')
+
+
+def lag_seconds():
+    return current_app.config.get('REPLICA_LAG_SECONDS', REPLICA_LAG_SECONDS)
+
+
+def wrote_recently():
+    try:
+        until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+    except ValueError:
+        return False
+    return time.time() < until
+
+
+def read_only(*methods):
+    """Sends the queries of the view to a replica for requests made with
+    one of `methods`, which must not write anything."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in methods:
+                return view(*args, **kwargs)
+
+            g.read_only = True
+            with replica_reads(not wrote_recently()):
+                return view(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def remember_writes(response):
+    """after_request hook starting the read-your-writes window of a client
+    after each of its successful writes."""
+    if (current_app.extensions.get('replica_router') is not None
+            and request.method in WRITE_METHODS
+            and response.status_code < 400
+            and not g.get('read_only')):
+        lag = lag_seconds()
+        response.set_cookie(PRIMARY_COOKIE, f'{time.time() + lag:.3f}',
+                            max_age=math.ceil(lag), httponly=True)
+    return response
@@ -0,0 +1,187 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import request, make_response
+
+from models import on_change, read_may_be_stale
+from .replicas import lag_seconds, wrote_recently
+
+# ==============================================
+# Cache of serialized JSON responses for the read-heavy GET endpoints.
+# Responses are stored as bytes under their path and query arguments, with
+# an ETag computed from the body, so a hit neither queries the database nor
+# serializes anything, and a client sending back a matching If-None-Match
+# gets an empty 304. Every committed model write bumps the version counter,
+# which empties the cache. Responses read from a replica shortly after a
+# write are not stored, as the replica may not have caught up yet.
+# On a miss, with single_flight set (see SINGLE_FLIGHT), concurrent
+# requests of the same key do not all run the view: the first one does,
+# the others wait for its response and answer with it, so that a burst of
+# identical requests runs the queries of one.
+# ==============================================
+
+# Upper bound of the total size of the cached bodies
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class ResponseCache:
+    """Least recently used cache of response bodies, bounded in bytes."""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (body, etag)
+        self.size = 0
+        self.version = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def bump_version(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+            self.size = 0
+
+    def model_changed(self, table, operation, record):
+        self.bump_version()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, version):
+        """Stores `body` unless the data changed since `version` was read,
+        returns the (body, etag) entry."""
+        entry = (body, hashlib.sha1(body).hexdigest())
+        if len(body) > self.max_bytes:
+            return entry
+
+        with self.lock:
+            if version != self.version:
+                return entry
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key)[0])
+            self.entries[key] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                old_key, (old_body, old_etag) = self.entries.popitem(last=False)
+                self.size -= len(old_body)
+        return entry
+
+
+response_cache = ResponseCache()
+on_change(response_cache.model_changed)
+
+
+class Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent calls of the same key
+    waiting for it and sharing its result, or its exception."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> Call in flight
+        self.shared = 0  # calls answered with the result of another
+
+    def do(self, key, function):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+
+single_flight = None
+
+
+def use_single_flight(flight):
+    global single_flight
+    single_flight = flight
+
+
+def coalesced_requests():
+    """Returns the requests answered with the response of another, None
+    without request coalescing."""
+    flight = single_flight
+    return flight.shared if flight is not None else None
+
+
+def cache_key():
+    return request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+
+
+def cached_response(view):
+    """Serves GET requests of `view` from response_cache, other methods
+    and unsuccessful responses go through unchanged."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET':
+            return view(*args, **kwargs)
+
+        key = cache_key()
+        entry = response_cache.get(key)
+        if entry is None:
+            flight = single_flight
+            render = functools.partial(render_view, view, key, args, kwargs)
+            if flight is None:
+                body, etag, status = render()
+            else:
+                # those reading their own writes from the primary apart
+                body, etag, status = flight.do((key, wrote_recently()), render)
+        else:
+            (body, etag), status = entry, 200
+
+        response = make_response(body, status)
+        response.mimetype = 'application/json'
+        if etag is None:  # not cached
+            return response
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    return wrapper
+
+
+def render_view(view, key, args, kwargs):
+    """Runs `view`, returns the (body, etag, status) of its response, the
+    etag None unless it was cached."""
+    version = response_cache.version
+    response = make_response(view(*args, **kwargs))
+    body = response.get_data()
+    if response.status_code != 200 or read_may_be_stale(lag_seconds()):
+        return body, None, response.status_code
+    body, etag = response_cache.put(key, body, version)
+    return body, etag, 200
@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import json
+import secrets
+import time
+from collections import Counter
+
+from .attempts import answer_words, is_correct
+
+# ==============================================
+# Live quiz rooms, served by the WebSocket routes of flaskr/asgi.py.
+# A host creates a room for a category: its question sequence is drawn
+# once, then the host moves the room from question to question, and every
+# player connected to the room receives the questions and, once a question
+# is over, its results. Players answer over their connection, answers are
+# aggregated in the room as they come, under the lock of the room.
+#
+# A message is serialized once per broadcast and queued for each player,
+# whose connection sends its queue in order. A player letting more than
+# PLAYER_QUEUE_SIZE messages pile up is disconnected rather than slowing
+# down the others.
+#
+# Rooms live in the memory of the worker which created them: serve them
+# from a single worker, or route each room to the same worker.
+# ==============================================
+
+MAX_ROOM_QUESTIONS = 50
+
+PLAYER_QUEUE_SIZE = 16
+
+# Players listed in the results, by score
+LEADERBOARD_SIZE = 10
+
+# Most given answers listed in the results
+TOP_ANSWERS = 5
+
+# Rooms without activity for this long are deleted
+ROOM_IDLE_SECONDS = 3600
+
+
+def normalize(answer):
+    return ' '.join(str(answer).lower().split())
+
+
+class Player:
+    __slots__ = ('id', 'name', 'queue', 'score', 'answered', 'dropped')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.queue = asyncio.Queue(PLAYER_QUEUE_SIZE)
+        self.score = 0
+        self.answered = -1  # index of the last question answered
+        self.dropped = False
+
+
+class Room:
+    def __init__(self, id, category_id, questions):
+        self.id = id
+        self.host_token = secrets.token_urlsafe(16)
+        self.category_id = category_id
+        self.questions = questions  # formatted questions, in order
+        self.lock = asyncio.Lock()
+        self.players = {}  # player id -> Player
+        self.next_player_id = 1
+        self.current = -1  # index of the question being played
+        self.open = False  # whether the current question takes answers
+        self.answers = Counter()  # normalized answer -> players
+        self.correct = 0
+        self.touched = time.monotonic()
+
+    @property
+    def finished(self):
+        return self.current >= len(self.questions)
+
+    def state(self):
+        return {'room_id': self.id, 'total_questions': len(self.questions),
+                'current': self.current, 'players': len(self.players)}
+
+    def join(self, name):
+        player = Player(self.next_player_id, str(name)[:40])
+        self.next_player_id += 1
+        self.players[player.id] = player
+        self.touched = time.monotonic()
+        self.send(player, dict(self.state(), type='joined', player_id=player.id))
+        if self.open:
+            self.send(player, self.question_message())
+        return player
+
+    def leave(self, player):
+        self.players.pop(player.id, None)
+
+    def send(self, player, message, text=None):
+        try:
+            player.queue.put_nowait(text or json.dumps(message))
+        except asyncio.QueueFull:
+            # too slow, its connection closes on its next send
+            player.dropped = True
+            self.leave(player)
+
+    def broadcast(self, message):
+        text = json.dumps(message)  # once for all the players
+        for player in list(self.players.values()):
+            self.send(player, None, text)
+
+    def question_message(self):
+        question = self.questions[self.current]
+        return {
+            'type': 'question',
+            'index': self.current,
+            'total_questions': len(self.questions),
+            # without the answer
+            'question': {key: question[key] for key in
+                         ('id', 'question', 'category', 'category_id', 'difficulty')},
+        }
+
+    def leaderboard(self):
+        best = heapq.nlargest(LEADERBOARD_SIZE, self.players.values(),
+                              key=lambda player: (player.score, -player.id))
+        return [{'player_id': player.id, 'name': player.name, 'score': player.score}
+                for player in best]
+
+    async def answer(self, player, index, answer):
+        """Records the `answer` of `player` to question `index`, returns
+        whether it is correct, None if the question does not take answers
+        or was already answered."""
+        async with self.lock:
+            if not self.open or index != self.current or player.answered == index:
+                return None
+            player.answered = index
+            given = normalize(answer)
+            self.answers[given] += 1
+            correct = is_correct(answer, answer_words(self.questions[index]['answer']))
+            if correct:
+                self.correct += 1
+                player.score += 1
+            self.touched = time.monotonic()
+            return correct
+
+    async def advance(self):
+        """Ends the current question, broadcasting its results, then starts
+        the next one, or ends the quiz. Returns the state of the room."""
+        async with self.lock:
+            if self.finished:
+                return self.state()
+            if self.open:
+                question = self.questions[self.current]
+                self.broadcast({
+                    'type': 'results',
+                    'index': self.current,
+                    'answer': question['answer'],
+                    'answered': sum(self.answers.values()),
+                    'correct': self.correct,
+                    'answers': [{'answer': answer, 'players': count} for answer, count
+                                in self.answers.most_common(TOP_ANSWERS)],
+                    'leaderboard': self.leaderboard(),
+                })
+
+            self.current += 1
+            self.answers = Counter()
+            self.correct = 0
+            self.open = not self.finished
+            self.touched = time.monotonic()
+            if self.open:
+                self.broadcast(self.question_message())
+            else:
+                self.broadcast({'type': 'finished', 'leaderboard': self.leaderboard()})
+            return self.state()
+
+
+class RoomRegistry:
+    def __init__(self):
+        self.rooms = {}
+
+    def create(self, category_id, questions):
+        self.expire()
+        room = Room(secrets.token_urlsafe(8), category_id, questions)
+        self.rooms[room.id] = room
+        return room
+
+    def get(self, room_id):
+        return self.rooms.get(room_id)
+
+    def expire(self):
+        deadline = time.monotonic() - ROOM_IDLE_SECONDS
+        for room_id, room in list(self.rooms.items()):
+            if room.touched < deadline:
+                del self.rooms[room_id]
+
+
+rooms = RoomRegistry()
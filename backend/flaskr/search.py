@@ -0,0 +1,213 @@
+import bisect
+import math
+import re
+import threading
+from abc import ABC, abstractmethod
+
+from sqlalchemy import desc, func, literal_column
+
+from models import db, on_change, Question
+
+# ==============================================
+# Question search, used by the search branch of POST /api/v1.0/questions.
+# A search term matches the questions containing all of its words, the
+# last word also matching as a prefix ("capi" finds "capital"), and the
+# results are ranked by relevance.
+# Two backends are available: PostgresSearch, for a Postgres database with
+# the GIN index of migrations/0002_question_search_index.sql, and
+# InvertedIndexSearch, an in-process index used with any other database.
+# ==============================================
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class SearchBackend(ABC):
+    """Interface of the search backends."""
+
+    @abstractmethod
+    def search(self, term, category_id=None, offset=0, limit=10):
+        """Returns (results, total) where `results` is the list of
+        (question id, score) pairs ranked from `offset` to `offset + limit`,
+        and `total` the number of questions matching `term`."""
+
+    def question_changed(self, table, operation, question):
+        """Follows a change notified by the models, while in use."""
+
+
+class PostgresSearch(SearchBackend):
+    # must be the expression of the ix_questions_question_tsv index
+    document = func.to_tsvector(literal_column("'simple'::regconfig"),
+                                func.coalesce(Question.question, ''))
+
+    def search(self, term, category_id=None, offset=0, limit=10):
+        words = tokenize(term)
+        if not words:
+            return [], 0
+
+        query = func.to_tsquery(literal_column("'simple'::regconfig"),
+                                ' & '.join(words) + ':*')
+        score = func.ts_rank(self.document, query).label('score')
+
+        selection = db.session.query(Question.id, score).filter(
+            self.document.op('@@')(query))
+        if category_id is not None:
+            selection = selection.filter(Question.category_id == category_id)
+
+        total = selection.count()
+        results = selection.order_by(desc('score'), Question.id).offset(
+            offset).limit(limit).all()
+        return [(id, float(score)) for id, score in results], total
+
+
+class InvertedIndexSearch(SearchBackend):
+    """Keeps, for every word, the questions containing it and how often.
+
+    Loaded from the questions table on first use, then kept up to date by
+    the Question model change notifications. A search only visits the
+    postings of its words, so its cost follows the number of matches, not
+    the number of questions. Matches are scored with tf-idf.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.postings = {}  # word -> {question id: occurrences}
+        self.words = []  # sorted vocabulary, for prefix lookups
+        self.documents = {}  # question id -> (words, category id)
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.postings, self.words, self.documents = {}, [], {}
+            rows = db.session.query(
+                Question.id, Question.question, Question.category_id)
+            for id, question, category_id in rows:
+                self._add(id, question, category_id)
+            self.loaded = True
+
+    def reset(self):
+        with self.lock:
+            self.loaded = False
+            self.postings, self.words, self.documents = {}, [], {}
+
+    def _add(self, id, text, category_id):
+        words = tokenize(text)
+        self.documents[id] = (words, category_id)
+        for word in words:
+            if word not in self.postings:
+                self.postings[word] = {}
+                bisect.insort(self.words, word)
+            self.postings[word][id] = self.postings[word].get(id, 0) + 1
+
+    def _remove(self, id):
+        document = self.documents.pop(id, None)
+        if document is None:
+            return
+        for word in set(document[0]):
+            postings = self.postings[word]
+            postings.pop(id, None)
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+    def question_changed(self, table, operation, question):
+        if table != Question.__tablename__:
+            return
+        if operation == 'reload':
+            self.reset()
+            return
+        with self.lock:
+            if not self.loaded:
+                return
+            self._remove(question.id)
+            if operation != 'delete':
+                self._add(question.id, question.question, question.category_id)
+
+    def _prefixed(self, prefix):
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + '\uffff')
+        return self.words[start:end]
+
+    def _idf(self, word):
+        return math.log(1 + len(self.documents) / len(self.postings[word]))
+
+    def search(self, term, category_id=None, offset=0, limit=10):
+        words = tokenize(term)
+        if not words:
+            return [], 0
+
+        self.load()
+        with self.lock:
+            # one {question id: score} per word of the term, smallest first
+            matches = []
+            for word in words[:-1]:
+                postings = self.postings.get(word, {})
+                idf = self._idf(word) if postings else 0
+                matches.append({id: count * idf for id, count in postings.items()})
+            last_word = {}
+            for word in self._prefixed(words[-1]):
+                idf = self._idf(word)
+                for id, count in self.postings[word].items():
+                    last_word[id] = last_word.get(id, 0) + count * idf
+            matches.append(last_word)
+            matches.sort(key=len)
+
+            scores = {}
+            for id, score in matches[0].items():
+                if category_id is not None and \
+                        self.documents[id][1] != category_id:
+                    continue
+                if all(id in other for other in matches[1:]):
+                    length = len(self.documents[id][0])
+                    scores[id] = (score + sum(other[id] for other in matches[1:])) / length
+
+        results = sorted(scores.items(), key=lambda result: (-result[1], result[0]))
+        return results[offset:offset + limit], len(results)
+
+
+search_backend = None
+
+
+def use_search_backend(backend):
+    """Replaces the backend used by search_questions()."""
+    global search_backend
+    search_backend = backend
+
+
+def question_changed(table, operation, question):
+    if search_backend is not None:
+        search_backend.question_changed(table, operation, question)
+
+
+# registered once: a replaced backend stops following the changes
+on_change(question_changed)
+
+
+def default_backend():
+    if db.engine.dialect.name == 'postgresql':
+        return PostgresSearch()
+    return InvertedIndexSearch()
+
+
+def search_questions(term, category_id=None, offset=0, limit=10):
+    """Returns (questions, total), the ranked page of formatted questions
+    matching `term`, each with its 'score', and the number of matches."""
+    if search_backend is None:
+        use_search_backend(default_backend())
+
+    results, total = search_backend.search(term, category_id, offset, limit)
+
+    ids = [id for id, score in results]
+    questions = {question.id: question for question in
+                 Question.query.filter(Question.id.in_(ids)).all()} if ids else {}
+
+    formatted = []
+    for id, score in results:
+        if id in questions:
+            question = questions[id].format()
+            question['score'] = round(score, 4)
+            formatted.append(question)
+    return formatted, total
@@ -0,0 +1,183 @@
+import os
+import re
+import sqlite3
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect
+
+# ==============================================
+# Versioned schema migrations, applied by setup_db() when the app starts.
+#
+# migrations/<version>_<name>.sql files are applied in version order, each
+# in its own transaction along with the insertion of its version into the
+# schema_migrations table, so that each one runs once. A migration can have
+# variants for a database system, <version>_<name>.<dialect>.sql (e.g.
+# .postgresql.sql or .sqlite.sql), used instead of the plain .sql file; a
+# version without a file for the database system is only recorded.
+#
+# On SQLite, which has no advisory locks, the whole run is a single
+# transaction instead, begun with BEGIN IMMEDIATE: it holds the write lock
+# from the reading of the applied versions to the last migration, so that
+# processes starting together wait for the first one, then find nothing
+# to apply. A failed migration rolls back every migration of the run.
+#
+# Databases set up before this table existed (by trivia.psql or by
+# db.create_all()) are given the versions their tables already match.
+# ==============================================
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+FILE_NAME = re.compile(r'^(\d+)_(\w+)(?:\.(postgresql|sqlite))?\.sql$')
+
+# Held while migrating, so that workers starting together do not all migrate
+POSTGRES_LOCK_ID = 20190617
+
+
+def migrations(dialect, directory=MIGRATIONS_DIR):
+    """Returns the (version, name, path or None) migrations for `dialect`,
+    in version order."""
+    files = {}  # version -> {dialect or None: (name, path)}
+    for file_name in os.listdir(directory):
+        match = FILE_NAME.match(file_name)
+        if match is not None:
+            files.setdefault(int(match[1]), {})[match[3]] = (
+                match[2], os.path.join(directory, file_name))
+
+    found = []
+    for version in sorted(files):
+        variants = files[version]
+        name, path = variants.get(dialect) or variants.get(None) or (
+            next(iter(variants.values()))[0], None)
+        found.append((version, name, path))
+    return found
+
+
+def baseline_version(engine):
+    """Returns the last version the tables of a database set up without
+    migrations match, or None for an empty database."""
+    inspector = inspect(engine)
+    if 'questions' not in inspector.get_table_names():
+        return None
+    columns = {column['name'] for column in inspector.get_columns('questions')}
+    return 1 if 'category_id' in columns else 0
+
+
+def applied_versions(engine, cursor):
+    if MIGRATIONS_TABLE in inspect(engine).get_table_names():
+        cursor.execute(f'SELECT version FROM {MIGRATIONS_TABLE}')
+        return {version for version, in cursor.fetchall()}
+
+    baseline = baseline_version(engine)
+    cursor.execute(f'CREATE TABLE {MIGRATIONS_TABLE} ('
+                   'version integer PRIMARY KEY, name varchar(200), '
+                   'applied_at timestamp DEFAULT CURRENT_TIMESTAMP)')
+    applied = set()
+    if baseline is not None:
+        for version, name, path in migrations(engine.dialect.name):
+            if version <= baseline:
+                cursor.execute(f'INSERT INTO {MIGRATIONS_TABLE} (version, name) '
+                               f"VALUES ({version}, '{name}')")
+                applied.add(version)
+    return applied
+
+
+def sqlite_statements(script):
+    """Splits an SQL script into its statements, for cursor.execute(),
+    which, unlike executescript(), does not commit the transaction."""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \n;'):
+                yield statement
+            statement = ''
+    if statement.strip():
+        yield statement
+
+
+def migrate(engine):
+    """Applies the migrations missing from the database of `engine`,
+    returns the (version, name) of those applied."""
+    dialect = engine.dialect.name
+    connection = engine.raw_connection()
+    done = []
+    try:
+        cursor = connection.cursor()
+        if dialect == 'postgresql':
+            cursor.execute('SELECT pg_advisory_lock(%s)', (POSTGRES_LOCK_ID,))
+            # index builds may outlast the statement timeout of the profile
+            cursor.execute('SET statement_timeout = 0')
+        elif dialect == 'sqlite':
+            isolation_level = connection.connection.isolation_level
+            connection.connection.isolation_level = None
+            cursor.execute('BEGIN IMMEDIATE')
+
+        applied = applied_versions(engine, cursor)
+        if dialect != 'sqlite':
+            connection.commit()
+
+        for version, name, path in migrations(dialect):
+            if version in applied:
+                continue
+            script = ''
+            if path is not None:
+                with open(path) as migration:
+                    script = migration.read()
+            record = (f'INSERT INTO {MIGRATIONS_TABLE} (version, name) '
+                      f"VALUES ({version}, '{name}');")
+            if dialect == 'sqlite':
+                for statement in sqlite_statements(f'{script}\n;\n{record}'):
+                    cursor.execute(statement)
+            else:
+                cursor.execute(f'{script}\n;{record}')
+                connection.commit()
+            done.append((version, name))
+        if dialect == 'sqlite':
+            cursor.execute('COMMIT')
+    except Exception:
+        if dialect == 'sqlite':
+            if connection.connection.in_transaction:
+                cursor.execute('ROLLBACK')
+        else:
+            connection.rollback()
+        raise
+    finally:
+        if dialect == 'postgresql':
+            cursor = connection.cursor()
+            cursor.execute('RESET statement_timeout')
+            cursor.execute('SELECT pg_advisory_unlock(%s)', (POSTGRES_LOCK_ID,))
+            connection.commit()
+        elif dialect == 'sqlite':
+            connection.connection.isolation_level = isolation_level
+        connection.close()
+    return done
+
+
+# ------------------------------------------------------------------------
+# flask migrate [--list]
+# ------------------------------------------------------------------------
+@click.command('migrate')
+@click.option('--list', 'list_only', is_flag=True,
+              help='Only list the migrations and whether they are applied.')
+@with_appcontext
+def migrate_command(list_only):
+    """Applies the missing schema migrations."""
+    from models import db
+
+    if list_only:
+        connection = db.engine.raw_connection()
+        try:
+            applied = applied_versions(db.engine, connection.cursor())
+            connection.commit()
+        finally:
+            connection.close()
+        for version, name, path in migrations(db.engine.dialect.name):
+            state = 'applied' if version in applied else 'pending'
+            click.echo(f'{version:04d} {name} {state}')
+        return
+
+    for version, name in migrate(db.engine):
+        click.echo(f'applied {version:04d} {name}')
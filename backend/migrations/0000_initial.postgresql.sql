@@ -0,0 +1,17 @@
+--
+-- Tables of the first version of the trivia schema, as in the original
+-- trivia.psql: questions.category holds the id of the category.
+--
+
+CREATE TABLE public.categories (
+    id serial PRIMARY KEY,
+    type text
+);
+
+CREATE TABLE public.questions (
+    id serial PRIMARY KEY,
+    question text,
+    answer text,
+    difficulty integer,
+    category integer
+);
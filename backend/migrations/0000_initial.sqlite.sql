@@ -0,0 +1,17 @@
+--
+-- Tables of the first version of the trivia schema, as created by
+-- db.create_all(): questions.category holds the type of the category.
+--
+
+CREATE TABLE categories (
+    id INTEGER NOT NULL PRIMARY KEY,
+    type VARCHAR
+);
+
+CREATE TABLE questions (
+    id INTEGER NOT NULL PRIMARY KEY,
+    question VARCHAR,
+    answer VARCHAR,
+    category VARCHAR,
+    difficulty INTEGER
+);
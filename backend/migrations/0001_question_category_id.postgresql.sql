@@ -0,0 +1,42 @@
+--
+-- Replaces questions.category with questions.category_id, an indexed
+-- foreign key to categories.id.
+--
+-- Databases created by db.create_all() hold the category type as text in
+-- questions.category, while databases loaded from the previous trivia.psql
+-- hold the category id there. Both are converted. Types that do not exist
+-- in categories yet are added to it first, so no question loses its category.
+--
+-- Applied by migrate.py, in the same transaction as its version.
+--
+
+ALTER TABLE public.questions ADD COLUMN category_id integer;
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'questions'
+            AND column_name = 'category') = 'integer' THEN
+
+        UPDATE public.questions SET category_id = category;
+
+    ELSE
+        INSERT INTO public.categories (type)
+            SELECT DISTINCT q.category FROM public.questions q
+            WHERE q.category IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM public.categories c
+                WHERE lower(c.type) = lower(q.category));
+
+        UPDATE public.questions q SET category_id = (
+            SELECT min(c.id) FROM public.categories c
+            WHERE lower(c.type) = lower(q.category));
+    END IF;
+END $$;
+
+-- also drops the foreign key constraint of the old column, if any
+ALTER TABLE public.questions DROP COLUMN category;
+
+ALTER TABLE ONLY public.questions
+    ADD CONSTRAINT questions_category_id_fkey FOREIGN KEY (category_id) REFERENCES public.categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+
+CREATE INDEX ix_questions_category_id ON public.questions USING btree (category_id);
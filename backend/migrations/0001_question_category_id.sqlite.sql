@@ -0,0 +1,32 @@
+--
+-- Replaces questions.category, the type of the category, with
+-- questions.category_id, an indexed foreign key to categories.id.
+-- Types that do not exist in categories yet are added to it first, so no
+-- question loses its category. SQLite cannot add a foreign key to an
+-- existing table, so the table is copied.
+--
+
+INSERT INTO categories (type)
+    SELECT DISTINCT q.category FROM questions q
+    WHERE q.category IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM categories c WHERE lower(c.type) = lower(q.category));
+
+CREATE TABLE questions_new (
+    id INTEGER NOT NULL PRIMARY KEY,
+    question VARCHAR,
+    answer VARCHAR,
+    category_id INTEGER REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL,
+    difficulty INTEGER
+);
+
+INSERT INTO questions_new (id, question, answer, category_id, difficulty)
+    SELECT q.id, q.question, q.answer,
+        (SELECT min(c.id) FROM categories c WHERE lower(c.type) = lower(q.category)),
+        q.difficulty
+    FROM questions q;
+
+DROP TABLE questions;
+
+ALTER TABLE questions_new RENAME TO questions;
+
+CREATE INDEX ix_questions_category_id ON questions (category_id);
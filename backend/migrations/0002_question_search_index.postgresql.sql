@@ -0,0 +1,8 @@
+--
+-- Full-text index of questions.question, used by the Postgres backend of
+-- the question search (flaskr/search.py). The indexed expression must stay
+-- the same as PostgresSearch.document for the index to be used.
+--
+
+CREATE INDEX IF NOT EXISTS ix_questions_question_tsv ON public.questions
+    USING gin (to_tsvector('simple'::regconfig, COALESCE(question, ''::text)));
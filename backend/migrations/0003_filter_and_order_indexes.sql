@@ -0,0 +1,34 @@
+--
+-- Indexes of the columns the endpoints filter and order on:
+-- - questions (category_id, question, id): the category filter and the
+--   (question, id) order of the question pages, and of their cursors
+-- - questions (difficulty): the difficulty filter of the exports
+-- - categories (lower(type)), unique: the case-insensitive lookup of a
+--   category by type, which also keeps two categories from only
+--   differing by case
+--
+-- Categories whose types only differ by case are merged first: their
+-- questions move to the oldest of them.
+--
+
+UPDATE questions SET category_id = (
+    SELECT min(same.id) FROM categories c
+        JOIN categories same ON lower(same.type) = lower(c.type)
+    WHERE c.id = questions.category_id)
+WHERE category_id IN (
+    SELECT c.id FROM categories c
+        JOIN categories older ON lower(older.type) = lower(c.type) AND older.id < c.id);
+
+DELETE FROM categories WHERE id IN (
+    SELECT c.id FROM categories c
+        JOIN categories older ON lower(older.type) = lower(c.type) AND older.id < c.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_categories_type_lower ON categories (lower(type));
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id_question
+    ON questions (category_id, question, id);
+
+-- its leading column already covers it
+DROP INDEX IF EXISTS ix_questions_category_id;
+
+CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON questions (difficulty);
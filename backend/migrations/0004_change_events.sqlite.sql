@@ -0,0 +1,15 @@
+--
+-- Outbox of the change feed on SQLite (flaskr/change_feed.py): the model
+-- writes add their changes to it in their own transaction, the other
+-- processes read those past the last id they have seen. Postgres sends
+-- the changes with NOTIFY instead and has no such table.
+--
+
+CREATE TABLE change_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin VARCHAR(64) NOT NULL,
+    table_name VARCHAR(64) NOT NULL,
+    operation VARCHAR(16) NOT NULL,
+    record_id INTEGER,
+    created_at REAL NOT NULL
+);
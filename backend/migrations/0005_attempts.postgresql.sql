@@ -0,0 +1,16 @@
+--
+-- Answers submitted to POST /api/v1.0/quizzes/answers, written in batches
+-- by flaskr/attempts.py. question_id and category_id are copied as they
+-- were when the answer was checked, without foreign keys: a question
+-- deleted before its attempts are written must not fail their batch.
+--
+
+CREATE TABLE attempts (
+    id bigserial PRIMARY KEY,
+    player varchar(64),
+    question_id integer NOT NULL,
+    category_id integer,
+    correct boolean NOT NULL,
+    answer_ms integer,
+    created_at timestamp NOT NULL
+);
@@ -0,0 +1,16 @@
+--
+-- Answers submitted to POST /api/v1.0/quizzes/answers, written in batches
+-- by flaskr/attempts.py. question_id and category_id are copied as they
+-- were when the answer was checked, without foreign keys: a question
+-- deleted before its attempts are written must not fail their batch.
+--
+
+CREATE TABLE attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    player VARCHAR(64),
+    question_id INTEGER NOT NULL,
+    category_id INTEGER,
+    correct BOOLEAN NOT NULL,
+    answer_ms INTEGER,
+    created_at TIMESTAMP NOT NULL
+);
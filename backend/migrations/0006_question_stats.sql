@@ -0,0 +1,30 @@
+--
+-- Counters of the questions served by POST /api/v1.0/quizzes and of the
+-- answers checked by POST /api/v1.0/quizzes/answers, added to by the
+-- upserts of flaskr/analytics.py:
+-- - question_stats, per question
+-- - question_bucket_stats, per category and difficulty, category 0 adding
+--   up every category, for the rollups of GET /api/v1.0/categories/<id>/stats
+-- answer_ms_total adds up the answer times of the `timed` answers which
+-- had one. No foreign keys, the counters outlive the questions.
+--
+
+CREATE TABLE question_stats (
+    question_id integer PRIMARY KEY,
+    served bigint NOT NULL DEFAULT 0,
+    answered bigint NOT NULL DEFAULT 0,
+    correct bigint NOT NULL DEFAULT 0,
+    timed bigint NOT NULL DEFAULT 0,
+    answer_ms_total bigint NOT NULL DEFAULT 0
+);
+
+CREATE TABLE question_bucket_stats (
+    category_id integer NOT NULL,
+    difficulty integer NOT NULL,
+    served bigint NOT NULL DEFAULT 0,
+    answered bigint NOT NULL DEFAULT 0,
+    correct bigint NOT NULL DEFAULT 0,
+    timed bigint NOT NULL DEFAULT 0,
+    answer_ms_total bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (category_id, difficulty)
+);
@@ -1,28 +1,399 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from types import SimpleNamespace
+from contextlib import contextmanager
+import itertools
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, DateTime, ForeignKey, \
+    Index, create_engine, event, func, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
-from config import database_path
+from migrate import migrate
+from config import database_path, ENGINE_PROFILE, ENGINE_PROFILES, \
+    REPLICA_DATABASE_PATHS, REPLICA_STRATEGY
 
 # database_name = 'trivia'
 # database_path = 'postgresql://{}@{}/{}'.format(
 #     'postgres', 'localhost:5432', database_name)
 
-db = SQLAlchemy()
+"""
+Read replicas
+    queries made inside a replica_reads() block are sent to one of the
+    replica databases given to setup_db(), chosen once per session by the
+    app's ReplicaRouter, round-robin or by least connections. Everything
+    else goes to the primary: writes, the queries of a session once it has
+    written, and all queries when no replica is configured.
+
+    with replica_reads():
+        questions = Question.query.all()
+"""
+_routing = threading.local()
+
+# time of the last change notified in this process, see read_may_be_stale()
+last_change_time = 0.0
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    previous = getattr(_routing, 'enabled', False)
+    _routing.enabled = enabled
+    try:
+        yield
+    finally:
+        _routing.enabled = previous
+
+
+class ReplicaRouter:
+    STRATEGIES = ('round_robin', 'least_connections')
+
+    def __init__(self, app, bind_keys, strategy='round_robin'):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'unknown replica strategy {strategy}')
+        self.app = app
+        self.bind_keys = bind_keys
+        self.strategy = strategy
+        self.lock = threading.Lock()
+        self.turns = itertools.cycle(range(len(bind_keys)))
+        self.engines = [None] * len(bind_keys)
+        self.in_use = [0] * len(bind_keys)  # connections checked out
+        self.sessions = [0] * len(bind_keys)  # sessions routed so far
+
+    def engine(self, i):
+        if self.engines[i] is None:
+            engine = db.get_engine(self.app, bind=self.bind_keys[i])
+
+            def checkout(dbapi_connection, record, proxy):
+                with self.lock:
+                    self.in_use[i] += 1
+
+            def checkin(dbapi_connection, record):
+                with self.lock:
+                    self.in_use[i] -= 1
+
+            event.listen(engine, 'checkout', checkout)
+            event.listen(engine, 'checkin', checkin)
+            self.engines[i] = engine
+        return self.engines[i]
+
+    def choose(self):
+        """Returns the engine of the replica the next session reads from."""
+        with self.lock:
+            if self.strategy == 'least_connections':
+                i = min(range(len(self.bind_keys)),
+                        key=lambda i: (self.in_use[i], self.sessions[i]))
+            else:
+                i = next(self.turns)
+            self.sessions[i] += 1
+        return self.engine(i)
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.replica = None  # engine read from, once chosen
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            self.wrote = True
+        router = self.app.extensions.get('replica_router')
+        if (router is None or self.wrote or self._flushing
+                or not getattr(_routing, 'enabled', False)):
+            return super().get_bind(mapper, clause)
+
+        if self.replica is None:
+            self.replica = router.choose()
+        return self.replica
+
+    def flush(self, objects=None):
+        if not self._is_clean():
+            # read what was written from the primary from now on
+            self.wrote = True
+        super().flush(objects)
+
+    def close(self):
+        super().close()
+        self.replica = None
+        self.wrote = False
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_may_be_stale(lag_seconds):
+    """True if the current session read from a replica less than
+    `lag_seconds` after the last change made by this process."""
+    return (db.session().replica is not None
+            and time.time() - last_change_time < lag_seconds)
+
+
+db = RoutingSQLAlchemy()
+
+"""
+Change listeners
+    functions registered with on_change(listener) are called as
+    listener(table, operation, record) after every insert, update or delete
+    committed through the model methods below, so that in-process indexes
+    can follow the database without reloading it. `record` holds the column
+    values of the changed record, taken before the commit, as attributes:
+    reading them costs no query, unlike the expired record itself.
+    Changes made in bulk, outside the model methods, are notified once with
+    the 'reload' operation and no record: listeners then drop what they
+    derived from `table`.
+"""
+change_listeners = []
+
+
+def on_change(listener):
+    change_listeners.append(listener)
+    return listener
+
+
+def notify_change(table, operation, record):
+    global last_change_time
+    last_change_time = time.time()
+    for listener in change_listeners:
+        listener(table, operation, record)
+
+
+"""
+Change feed
+    the changes committed by this process are also published to the other
+    processes (the other workers of the server) through the change feed set
+    with use_change_feed(), see flaskr/change_feed.py. publish_changes()
+    adds them to the transaction about to be committed, so that they are
+    only sent if it commits.
+"""
+change_feed = None
+
+
+def use_change_feed(feed):
+    """Replaces the change feed, stopping the previous one; None to stop
+    publishing changes."""
+    global change_feed
+    if change_feed is not None and change_feed is not feed:
+        change_feed.stop()
+    change_feed = feed
+
+
+def publish_changes(changes):
+    if change_feed is None or not changes:
+        return
+    db.session.flush()  # ids of the inserted records
+    change_feed.publish(db.session, [
+        (table, operation, record.id if record is not None else None)
+        for table, operation, record in changes])
+
+
+def record_values(record):
+    """The column values of the model instance `record`, as attributes."""
+    if record is None:
+        return None
+    return SimpleNamespace(**{column.key: getattr(record, column.key)
+                              for column in orm.object_mapper(record).column_attrs})
+
+
+def prepare_changes(changes):
+    """Flushes the session, publishes `changes` and returns them with the
+    column values of their records, read before the commit expires them."""
+    db.session.flush()  # ids of the inserted records
+    changes = [(table, operation, record_values(record))
+               for table, operation, record in changes]
+    publish_changes(changes)
+    return changes
+
+
+def notify_reload(table):
+    """Notifies, here and in the other processes, a change of `table`
+    made in bulk outside the model methods."""
+    if change_feed is not None:
+        publish_changes([(table, 'reload', None)])
+        db.session.commit()
+    notify_change(table, 'reload', None)
+
+
+"""
+unit_of_work()
+    context manager grouping the writes of the model methods in a single
+    transaction: inside it, insert, update and delete only queue their
+    changes in the session, which is committed once when the block ends
+    (and rolled back if it raises). Their change notifications are sent
+    after that commit. Nested blocks join the outermost one.
+
+    with unit_of_work():
+        for question in questions:
+            question.delete()
+"""
+_pending = threading.local()
+
+
+@contextmanager
+def unit_of_work():
+    if getattr(_pending, 'changes', None) is not None:
+        yield
+        return
+
+    _pending.changes = []
+    try:
+        yield
+        _pending.changes = prepare_changes(_pending.changes)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        changes, _pending.changes = _pending.changes, None
+
+    for change in changes:
+        notify_change(*change)
+
+
+def commit_change(table, operation, record):
+    # commits now, unless inside a unit_of_work() block
+    if getattr(_pending, 'changes', None) is not None:
+        _pending.changes.append((table, operation, record))
+        return
+    changes = prepare_changes([(table, operation, record)])
+    db.session.commit()
+    notify_change(*changes[0])
+
+
+"""
+MeteredQueuePool
+    the connection pool of Postgres engines: a QueuePool that also records
+    how many checkouts were made, how long they waited for a connection,
+    and how many gave up after pool_timeout seconds.
+"""
+
+
+class MeteredQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                self.timeouts += timed_out
+
+
+"""
+engine_options(profile, database_path)
+    SQLAlchemy engine options of the ENGINE_PROFILES entry named `profile`
+    for the database at `database_path`
+"""
+
+
+def engine_options(profile, database_path=database_path):
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f'unknown engine profile {profile}')
+
+    options = dict(ENGINE_PROFILES[profile])
+    statement_timeout = options.pop('statement_timeout', 0)
+    options.pop('prepared_statements', None)
+
+    if make_url(database_path).get_backend_name() != 'postgresql':
+        # SQLite connections are not pooled, only pre-ping and recycle apply
+        for name in ('pool_size', 'max_overflow', 'pool_timeout'):
+            options.pop(name, None)
+        return options
+
+    options['poolclass'] = MeteredQueuePool
+    if statement_timeout:
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+
+"""
+pool_metrics()
+    state of the connection pool of the bound application: connections
+    held by requests (checked_out), idle in the pool (checked_in) and opened
+    beyond pool_size (overflow), and the checkouts made so far, the time
+    they spent waiting for a connection and how many timed out
+"""
+
+
+def pool_metrics():
+    pool = db.engine.pool
+    metrics = {
+        'profile': db.get_app().config.get('ENGINE_PROFILE'),
+        'size': 0,
+        'checked_out': 0,
+        'checked_in': 0,
+        'overflow': 0,
+        'checkouts': 0,
+        'wait_seconds_total': 0.0,
+        'wait_seconds_max': 0.0,
+        'timeouts': 0,
+    }
+    if isinstance(pool, QueuePool):
+        metrics.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+        })
+    if isinstance(pool, MeteredQueuePool):
+        with pool.stats_lock:
+            metrics.update({
+                'checkouts': pool.checkouts,
+                'wait_seconds_total': round(pool.wait_seconds, 6),
+                'wait_seconds_max': round(pool.max_wait_seconds, 6),
+                'timeouts': pool.timeouts,
+            })
+    return metrics
+
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, with the engine
+    options of the `profile` engine profile, by default the ENGINE_PROFILE
+    of the app config or of config.py, and the read replicas at
+    `replica_paths` (of the same database system) chosen with
+    `replica_strategy`, by default those of config.py
 """
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, profile=None,
+             replica_paths=None, replica_strategy=None):
+    profile = profile or app.config.get('ENGINE_PROFILE', ENGINE_PROFILE)
+    if replica_paths is None:
+        replica_paths = REPLICA_DATABASE_PATHS
+    binds = {f'replica_{i}': path for i, path in enumerate(replica_paths)}
+
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = binds or None
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(profile, database_path)
+    app.config["ENGINE_PROFILE"] = profile
+    app.extensions['replica_router'] = ReplicaRouter(
+        app, list(binds), replica_strategy or REPLICA_STRATEGY) if binds else None
     # app.config.from_object('config')  # loads from 'config.py'
     db.app = app
     db.init_app(app)
-    db.create_all()
+    migrate(db.engine)
 
 
 """
@@ -33,41 +404,51 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # created by the migrations, see migrations/
+    __table_args__ = (
+        Index('ix_questions_category_id_question', 'category_id', 'question', 'id'),
+        Index('ix_questions_difficulty', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category_id = Column(Integer, ForeignKey(
+        'categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
-    def __init__(self, question, answer, category, difficulty):
+    # loaded in the same query as the question, for format()
+    category = db.relationship('Category', lazy='joined')
+
+    def __init__(self, question, answer, category_id, difficulty):
         self.question = question
         self.answer = answer
-        self.category = category
+        self.category_id = category_id
         self.difficulty = difficulty
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit_change(self.__tablename__, 'insert', self)
 
     def update(self):
-        db.session.commit()
+        commit_change(self.__tablename__, 'update', self)
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        commit_change(self.__tablename__, 'delete', self)
 
     def format(self):
         return {
             'id': self.id,
             'question': self.question,
             'answer': self.answer,
-            'category': self.category,
+            'category': self.category.type if self.category else None,
+            'category_id': self.category_id,
             'difficulty': self.difficulty
         }
 
     def __repr__(self) -> str:
-        return f'<id: {self.id} question: {self.question} category: {self.category}>'
+        return f'<id: {self.id} question: {self.question} category: {self.category_id}>'
 
 
 """
@@ -82,19 +463,23 @@ class Category(db.Model):
     id = Column(Integer, primary_key=True)
     type = Column(String)
 
+    __table_args__ = (
+        Index('ix_categories_type_lower', func.lower(type), unique=True),
+    )
+
     def __init__(self, type):
         self.type = type
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit_change(self.__tablename__, 'insert', self)
 
     def update(self):
-        db.session.commit()
+        commit_change(self.__tablename__, 'update', self)
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        commit_change(self.__tablename__, 'delete', self)
 
     def format(self):
         return {
@@ -104,3 +489,55 @@ class Category(db.Model):
 
     def __repr__(self) -> str:
         return f'<id: {self.id} type: {self.type}>'
+
+
+"""
+Attempt
+    an answer submitted to POST /api/v1.0/quizzes/answers. Attempts are
+    only ever written in batches by flaskr/attempts.py, through the table.
+"""
+
+
+class Attempt(db.Model):
+    __tablename__ = 'attempts'
+
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+    player = Column(String(64))
+    # not foreign keys, see migrations/0005_attempts.*.sql
+    question_id = Column(Integer, nullable=False)
+    category_id = Column(Integer)
+    correct = Column(Boolean, nullable=False)
+    answer_ms = Column(Integer)
+    created_at = Column(DateTime, nullable=False)
+
+
+"""
+QuestionStat, QuestionBucketStat
+    the counters of the questions served and answered, per question and
+    per category and difficulty, only ever added to by the upserts of
+    flaskr/analytics.py.
+"""
+
+
+class QuestionStat(db.Model):
+    __tablename__ = 'question_stats'
+
+    # not a foreign key, see migrations/0006_question_stats.sql
+    question_id = Column(Integer, primary_key=True, autoincrement=False)
+    served = Column(BigInteger, nullable=False, default=0)
+    answered = Column(BigInteger, nullable=False, default=0)
+    correct = Column(BigInteger, nullable=False, default=0)
+    timed = Column(BigInteger, nullable=False, default=0)
+    answer_ms_total = Column(BigInteger, nullable=False, default=0)
+
+
+class QuestionBucketStat(db.Model):
+    __tablename__ = 'question_bucket_stats'
+
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
+    difficulty = Column(Integer, primary_key=True, autoincrement=False)
+    served = Column(BigInteger, nullable=False, default=0)
+    answered = Column(BigInteger, nullable=False, default=0)
+    correct = Column(BigInteger, nullable=False, default=0)
+    timed = Column(BigInteger, nullable=False, default=0)
+    answer_ms_total = Column(BigInteger, nullable=False, default=0)
@@ -1,10 +1,29 @@
+import asyncio
+import datetime
 import os
+import random
+import re
+import tempfile
+import threading
+import time
 import unittest
+import uuid
 import json
 from flask_sqlalchemy import SQLAlchemy
-
-from flaskr import create_app
-from models import setup_db, Question, Category
+from sqlalchemy import create_engine
+
+from flaskr import create_app, read_store, search
+from flaskr.analytics import question_stats
+from flaskr.attempts import answer_words, attempt_writer, is_correct
+from flaskr.change_feed import PostgresChangeFeed
+from flaskr.leaderboard import leaderboards, TopK
+from flaskr.quiz_sessions import SessionStore
+from flaskr.rate_limit import MemoryBucketStore
+from flaskr.response_cache import response_cache, SingleFlight
+from flaskr.rooms import Room
+from migrate import migrate, migrations
+import models
+from models import setup_db, db, Attempt, Question, Category
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -17,7 +36,7 @@ class TriviaTestCase(unittest.TestCase):
         self.database_name = "trivia_test"
         self.database_path = "postgresql://{}/{}".format(
             'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+        setup_db(self.app, self.database_path, 'test')
 
         # binds the app to the current context
         with self.app.app_context():
@@ -89,6 +108,19 @@ class TriviaTestCase(unittest.TestCase):
             self.assertGreater(count_after_post, count_before_post)
             self.assertTrue(added_category)  # added_category not None
 
+    def test_post_categories_detects_existing_type_ignoring_case(self):
+        res = self.client().post('/api/v1.0/categories',
+                                 json={'type': 'Category14'})
+        data = json.loads(res.data)
+
+        res2 = self.client().post('/api/v1.0/categories',
+                                  json={'type': 'CATEGORY14'})
+        data2 = json.loads(res2.data)
+
+        self.assertEqual(res2.status_code, 200)
+        self.assertTrue('existing' in data2['message'])
+        self.assertEqual(data2['id'], data['id'])
+
     def test_422_sent_on_post_categories_when_body_has_no_required_data(self):
         res = self.client().post('/api/v1.0/categories', json={'fake': 'data'})
         data = json.loads(res.data)
@@ -99,6 +131,22 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['message'])
         self.assertTrue('unprocessable' in data['message'])
 
+    def test_422_sent_on_category_type_which_is_not_a_string(self):
+        for type in (3, ['cat32'], {'type': 'cat32'}, True, None):
+            res = self.client().post('/api/v1.0/categories', json={'type': type})
+            self.assertEqual(res.status_code, 422)
+            self.assertFalse(json.loads(res.data)['success'])
+
+            res = self.client().patch('/api/v1.0/categories/1', json={'type': type})
+            self.assertEqual(res.status_code, 422)
+
+            res = self.client().post('/api/v1.0/questions', json={
+                'question': 'What is 4 x 4?',
+                'answer': '16',
+                'category': type if type != 3 else 3.5,
+                'difficulty': 1})
+            self.assertEqual(res.status_code, 422)
+
     def test_get_categories_by_id(self):
         res = self.client().post('/api/v1.0/categories',
                                  json={'type': 'category2'})
@@ -131,6 +179,30 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(int(data2['deleted']), id)
         self.assertLess(count_after_delete, count_before_delete)
 
+    def test_304_sent_on_get_categories_with_matching_etag(self):
+        # names of this run only, so that the posts below always write
+        run = uuid.uuid4().hex
+        self.client().post('/api/v1.0/categories', json={'type': f'category16 {run}'})
+
+        res = self.client().get('/api/v1.0/categories')
+        etag = res.headers['ETag']
+
+        res2 = self.client().get('/api/v1.0/categories',
+                                 headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res2.status_code, 304)
+        self.assertEqual(res2.data, b'')
+
+        # a write changes the data, so the old etag no longer matches
+        self.client().post('/api/v1.0/categories', json={'type': f'category17 {run}'})
+        res3 = self.client().get('/api/v1.0/categories',
+                                 headers={'If-None-Match': etag})
+        data3 = json.loads(res3.data)
+
+        self.assertEqual(res3.status_code, 200)
+        self.assertTrue(f'category17 {run}' in [cat['type'] for cat in data3['categories']])
+
     def test_404_sent_on_get_categories_with_non_existing_id(self):
         res = self.client().get(f'/api/v1.0/categories/-5')
         data = json.loads(res.data)
@@ -178,6 +250,18 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['message'])
         self.assertTrue('unprocessable' in data['message'])
 
+    def test_422_sent_on_patch_category_with_type_of_another_category(self):
+        self.client().post('/api/v1.0/categories', json={'type': 'category19'})
+        res = self.client().post('/api/v1.0/categories', json={'type': 'category20'})
+        cat_id = json.loads(res.data)['id']
+
+        res = self.client().patch(f'/api/v1.0/categories/{cat_id}',
+                                  json={'type': 'CATEGORY19'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
     def test_400_sent_on_patch_category_without_req_body(self):
         res_post = self.client().post(
             '/api/v1.0/categories', json={'type': 'category4'})
@@ -205,8 +289,10 @@ class TriviaTestCase(unittest.TestCase):
         posted_id = int(post_res_data['id'])
         # --- TEST DATA PREPS
 
+        # category types are unique: a name of this run only
+        updated_type = f'updated_category4 {uuid.uuid4().hex}'
         patch_res = self.client().patch(
-            f'/api/v1.0/categories/{posted_id}', json={'type': 'updated_category4'})
+            f'/api/v1.0/categories/{posted_id}', json={'type': updated_type})
         patch_res_data = json.loads(patch_res.data)
         updated_id = int(patch_res_data['updated'])
 
@@ -216,7 +302,7 @@ class TriviaTestCase(unittest.TestCase):
 
         if category is not None:
             self.assertEqual(posted_id, updated_id)
-            self.assertEqual(category.type, 'updated_category4')
+            self.assertEqual(category.type, updated_type)
 
     # ------- QUESTION RESOURCE TESTS HERE ------
     def test_get_paginated_questions(self):
@@ -250,6 +336,39 @@ class TriviaTestCase(unittest.TestCase):
         self.assertGreaterEqual(int(data['total_questions']), 1)
         self.assertTrue(len(data['questions']))
 
+    def test_get_next_page_of_questions_with_cursor(self):
+        # ------ TEST DATA PPREPS -------
+        res_post_cat = self.client().post(
+            '/api/v1.0/categories', json={'type': 'category11'})
+        data_post_cat = json.loads(res_post_cat.data)
+
+        for i in range(12):
+            self.client().post('/api/v1.0/questions', json={
+                'question': f'cursor question {i:02d}?',
+                'answer': 'fine',
+                'category': 'category11',
+                'difficulty': 1})
+        # ------ End Data Preps -------
+
+        res = self.client().get(
+            f'/api/v1.0/categories/{data_post_cat["id"]}/questions?page=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertTrue(data['next_cursor'])
+
+        res2 = self.client().get(
+            f'/api/v1.0/categories/{data_post_cat["id"]}/questions?cursor={data["next_cursor"]}')
+        data2 = json.loads(res2.data)
+        res3 = self.client().get(
+            f'/api/v1.0/categories/{data_post_cat["id"]}/questions?page=2')
+        data3 = json.loads(res3.data)
+
+        self.assertEqual(res2.status_code, 200)
+        self.assertEqual(data2['total_questions'], data['total_questions'])
+        self.assertEqual(data2['questions'], data3['questions'])
+
     def test_404_sent_on_get_req_when_no_question_in_db(self):
         # empty all existing questions in db first
         existing_ques = Question.query.all()
@@ -266,7 +385,23 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['message'])
         self.assertTrue('not found' in data['message'])
 
+    def test_pages_before_the_first_are_the_first_page(self):
+        res_cat = self.client().post('/api/v1.0/categories', json={'type': 'cat33'})
+        cat_id = json.loads(res_cat.data)['id']
+        self.client().post('/api/v1.0/questions', json={
+            'question': 'What is 2 + 2?', 'answer': '4',
+            'category': 'cat33', 'difficulty': 1})
+        first_page = json.loads(self.client().get(
+            f'/api/v1.0/questions?currCat={cat_id}&page=1').data)
+        for page in (0, -2):
+            res = self.client().get(f'/api/v1.0/questions?currCat={cat_id}&page={page}')
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(json.loads(res.data)['questions'], first_page['questions'])
+
     def test_get_question_by_id(self):
+        self.client().post('/api/v1.0/categories', json={'type': 'category5'})
+
         question = {
             'question': 'What is 2 x 2?',
             'answer': '4',
@@ -284,6 +419,8 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data2['question']['question'], question['question'])
 
     def test_delete_question_by_id(self):
+        self.client().post('/api/v1.0/categories', json={'type': 'category5'})
+
         question = {
             'question': 'What is 2 x 2?',
             'answer': '4',
@@ -305,6 +442,76 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(int(data2['deleted']), id)
         self.assertLess(count_after_delete, count_before_delete)
 
+    def test_batch_patch_and_delete_questions(self):
+        self.client().post('/api/v1.0/categories', json={'type': 'cat20'})
+        self.client().post('/api/v1.0/categories', json={'type': 'cat21'})
+        ids = []
+        for i in range(3):
+            res = self.client().post('/api/v1.0/questions', json={
+                'question': f'Batch {i}?', 'answer': f'{i}',
+                'category': 'cat20', 'difficulty': 1})
+            ids.append(json.loads(res.data)['id'])
+
+        res_patch = self.client().patch('/api/v1.0/questions', json={
+            'ids': ids, 'category': 'cat21', 'difficulty': 5})
+        data_patch = json.loads(res_patch.data)
+
+        self.assertEqual(res_patch.status_code, 200)
+        self.assertEqual(data_patch['updated'], sorted(ids))
+        for id in ids:
+            question = Question.query.get(id).format()
+            self.assertEqual(question['category'], 'cat21')
+            self.assertEqual(question['difficulty'], 5)
+
+        count_before_delete = Question.query.count()
+        res_del = self.client().delete('/api/v1.0/questions', json={'ids': ids})
+        data_del = json.loads(res_del.data)
+
+        self.assertEqual(res_del.status_code, 200)
+        self.assertEqual(data_del['deleted'], sorted(ids))
+        self.assertEqual(Question.query.count(), count_before_delete - 3)
+
+    def test_batch_patch_runs_no_query_per_question(self):
+        app = self.instrumented_app()
+        client = app.test_client()
+        client.post('/api/v1.0/categories', json={'type': 'cat30'})
+        ids = []
+        for i in range(50):
+            res = client.post('/api/v1.0/questions', json={
+                'question': f'Batch query {i}?', 'answer': f'{i}',
+                'category': 'cat30', 'difficulty': 1})
+            ids.append(json.loads(res.data)['id'])
+        # the indexes listening to the changes, loaded beforehand
+        client.post('/api/v1.0/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': 0}})
+        client.post('/api/v1.0/quizzes/answers', json={'question_id': ids[0], 'answer': '0'})
+        client.post('/api/v1.0/questions', json={'searchTerm': 'batch query'})
+
+        for method, body in (('PATCH', {'ids': ids, 'difficulty': 3}),
+                             ('DELETE', {'ids': ids})):
+            res = client.open('/api/v1.0/questions', method=method, json=body)
+            self.assertEqual(res.status_code, 200)
+            text = client.get('/api/v1.0/metrics').data.decode()
+            queries = re.search(r'trivia_request_db_queries_total\{route="/api/v1.0/questions",'
+                                f'method="{method}"}} (\\d+)', text)
+            # the questions, the batch of changes, and the commit
+            self.assertLessEqual(int(queries[1]), 5, method)
+
+    def test_404_sent_on_batch_delete_with_non_existing_ids(self):
+        res = self.client().delete('/api/v1.0/questions', json={'ids': [-5, -6]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_422_sent_on_batch_requests_with_ids_which_are_not_integers(self):
+        for ids in (['a', None], [1, 2.5], [True], 7):
+            for method, body in (('patch', {'ids': ids, 'difficulty': 3}),
+                                 ('delete', {'ids': ids})):
+                res = getattr(self.client(), method)('/api/v1.0/questions', json=body)
+                self.assertEqual(res.status_code, 422, (method, ids))
+                self.assertFalse(json.loads(res.data)['success'])
+
     def test_404_sent_on_get_question_with_non_existing_id(self):
         res = self.client().get(f'/api/v1.0/questions/-5')
         data = json.loads(res.data)
@@ -316,6 +523,8 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue('not found' in data['message'])
 
     def test_post_questions(self):
+        self.client().post('/api/v1.0/categories', json={'type': 'category6'})
+
         question = {
             'question': 'What is 4 x 4?',
             'answer': '16',
@@ -329,6 +538,39 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data_res['success'], True)
         self.assertTrue(data_res['id'])
 
+    def test_post_questions_with_category_id(self):
+        res_cat = self.client().post('/api/v1.0/categories', json={'type': 'category6'})
+        res_cat_data = json.loads(res_cat.data)
+
+        question = {
+            'question': 'What is 5 x 5?',
+            'answer': '25',
+            'category': res_cat_data['id'],
+            'difficulty': 1}
+
+        res = self.client().post('/api/v1.0/questions', json=question)
+        data_res = json.loads(res.data)
+
+        added_question = Question.query.get(data_res['id'])
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(added_question.category_id, res_cat_data['id'])
+        self.assertEqual(added_question.format()['category'], 'category6')
+
+    def test_422_sent_on_post_questions_with_unknown_category(self):
+        question = {
+            'question': 'What is 4 x 4?',
+            'answer': '16',
+            'category': 'kililklkllkosksoosksosk',
+            'difficulty': 1}
+
+        res = self.client().post('/api/v1.0/questions', json=question)
+        data_res = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data_res['error'], 422)
+        self.assertTrue('unprocessable' in data_res['message'])
+
     def test_422_sent_on_post_questions_with_missing_required_body_fields(self):
         # Required Fields: 'question', 'answer', 'category', 'difficulty'
         question_with_missing_req_fields = {
@@ -342,6 +584,69 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data_res['error'], 422)
         self.assertTrue('unprocessable' in data_res['message'])
 
+    def test_post_questions_bulk_reports_invalid_lines(self):
+        self.client().post('/api/v1.0/categories', json={'type': 'cat18'})
+        count_before_post = Question.query.count()
+
+        lines = [
+            json.dumps({'question': 'Bulk 1?', 'answer': '1',
+                        'category': 'cat18', 'difficulty': 1}),
+            '{not json',
+            json.dumps({'question': 'Bulk 2?', 'answer': '2',
+                        'category': 'kililklkllkosksoosksosk', 'difficulty': 1}),
+            json.dumps({'question': 'Bulk 3?', 'answer': '3',
+                        'category': 'cat18', 'difficulty': 2}),
+        ]
+        res = self.client().post('/api/v1.0/questions/bulk?chunk_size=1',
+                                 data='\n'.join(lines),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        count_after_post = Question.query.count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['total_errors'], 2)
+        self.assertEqual([e['line'] for e in data['errors']], [2, 3])
+        self.assertEqual(count_after_post, count_before_post + 2)
+
+    def test_post_questions_bulk_from_csv(self):
+        self.client().post('/api/v1.0/categories', json={'type': 'cat18'})
+
+        res = self.client().post(
+            '/api/v1.0/questions/bulk',
+            data='question,answer,category,difficulty\n"Bulk, csv?",yes,cat18,3\n',
+            content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['total_errors'], 0)
+
+    def test_get_questions_export_for_category(self):
+        res_cat = self.client().post('/api/v1.0/categories', json={'type': 'cat19'})
+        res_cat_data = json.loads(res_cat.data)
+        self.client().post('/api/v1.0/questions', json={
+            'question': 'Exported?', 'answer': 'yes',
+            'category': 'cat19', 'difficulty': 4})
+
+        res = self.client().get(
+            f'/api/v1.0/questions/export?category={res_cat_data["id"]}')
+        exported = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(len(exported), 0)
+        self.assertTrue(all(q['category'] == 'cat19' for q in exported))
+        self.assertTrue('Exported?' in [q['question'] for q in exported])
+
+    def test_404_sent_on_get_questions_export_with_non_existing_category(self):
+        res = self.client().get(
+            '/api/v1.0/questions/export?category=kililklkllkosksoosksosk')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
     def test_get_results_on_post_questions_with_search_term(self):
         # ---- TEST DATA PREPS ----
         new_category = {
@@ -373,10 +678,55 @@ class TriviaTestCase(unittest.TestCase):
             self.assertEqual(search_results.status_code, 200)
             self.assertEqual(search_results_data['success'], True)
             self.assertGreater(len(search_results_data['questions']), 0)
+            self.assertTrue('score' in search_results_data['questions'][0])
 
         else:
             self.assertTrue(False)
 
+    def test_search_matches_prefix_of_last_word(self):
+        self.client().post('/api/v1.0/categories', json={'type': 'cat15'})
+        self.client().post('/api/v1.0/questions', json={
+            'question': 'Which is the zyxwvutsrq of all planets?',
+            'answer': 'none',
+            'category': 'cat15',
+            'difficulty': 2})
+
+        search_results = self.client().post(
+            '/api/v1.0/questions', json={'searchTerm': 'which zyxwv'})
+        search_results_data = json.loads(search_results.data)
+
+        self.assertEqual(search_results.status_code, 200)
+        self.assertEqual(search_results_data['questions'][0]['question'],
+                         'Which is the zyxwvutsrq of all planets?')
+
+        res = self.client().post('/api/v1.0/questions?page=0',
+                                 json={'searchTerm': 'which zyxwv'})
+        self.assertEqual(json.loads(res.data)['questions'], search_results_data['questions'])
+
+    def test_replaced_search_backends_stop_following_the_changes(self):
+        previous = search.search_backend
+        listeners = len(models.change_listeners)
+        try:
+            with self.app.app_context():
+                replaced = search.InvertedIndexSearch()
+                search.use_search_backend(replaced)
+                replaced.load()
+                backend = search.InvertedIndexSearch()
+                search.use_search_backend(backend)
+                backend.load()
+            self.assertEqual(len(models.change_listeners), listeners)
+
+            self.client().post('/api/v1.0/categories', json={'type': 'cat31'})
+            self.client().post('/api/v1.0/questions', json={
+                'question': 'Which is the qwxzvk of all moons?',
+                'answer': 'none',
+                'category': 'cat31',
+                'difficulty': 2})
+            self.assertEqual(backend.search('qwxzvk')[1], 1)
+            self.assertEqual(replaced.search('qwxzvk')[1], 0)
+        finally:
+            search.use_search_backend(previous)
+
     def test_422_sent_on_search_term_with_non_existing_currentCategoryId(self):
         searchData = {'searchTerm': 'what is',
                       'currentCategoryId': -10000}
@@ -512,6 +862,230 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(quiz_fetch_res_data['success'], True)
         self.assertTrue(quiz_fetch_res_data['question'])
 
+    def test_post_quizzes_never_repeats_previous_questions(self):
+        # ---- TEST PREPARATIONS ---
+        new_category = {'type': 'cat12'}
+        res_cat = self.client().post('/api/v1.0/categories', json=new_category)
+        res_cat_data = json.loads(res_cat.data)
+
+        for i in range(3):
+            self.client().post('/api/v1.0/questions', json={
+                'question': f'What is {i} + {i}?',
+                'answer': f'{i + i}',
+                'category': new_category['type'],
+                'difficulty': 1})
+        # ------- END PREPARATIONS ---
+
+        quiz_category = {'id': res_cat_data['id'], 'type': new_category['type']}
+        previous_questions = []
+        while True:
+            res = self.client().post('/api/v1.0/quizzes', json={
+                'previous_questions': previous_questions,
+                'quiz_category': quiz_category})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            if data['question'] is None:
+                break
+            self.assertNotIn(data['question']['id'], previous_questions)
+            self.assertEqual(data['question']['category'], new_category['type'])
+            previous_questions.append(data['question']['id'])
+
+        self.assertGreaterEqual(len(previous_questions), 3)
+
+    def test_post_quizzes_forgets_the_questions_of_deleted_categories(self):
+        # ---- TEST PREPARATIONS ---
+        new_category = {'type': f'cat34 {uuid.uuid4().hex}'}
+        res_cat = self.client().post('/api/v1.0/categories', json=new_category)
+        cat_id = json.loads(res_cat.data)['id']
+        res_q = self.client().post('/api/v1.0/questions', json={
+            'question': 'What is 5 + 5?', 'answer': '10',
+            'category': new_category['type'], 'difficulty': 1})
+        question_id = json.loads(res_q.data)['id']
+        quiz = {'previous_questions': [], 'quiz_category': {'id': cat_id}}
+        # loads the quiz index and the answer key
+        res = self.client().post('/api/v1.0/quizzes', json=quiz)
+        self.assertEqual(json.loads(res.data)['question']['id'], question_id)
+        self.client().post('/api/v1.0/quizzes/answers', json={
+            'question_id': question_id, 'answer': '10'})
+        # ------- END PREPARATIONS ---
+
+        self.client().delete(f'/api/v1.0/categories/{cat_id}')
+
+        res = self.client().post('/api/v1.0/quizzes', json=quiz)
+        self.assertIsNone(json.loads(res.data).get('question'))
+        self.client().post('/api/v1.0/quizzes/answers', json={
+            'question_id': question_id, 'answer': '10'})
+        attempt_writer.flush()
+        with self.app.app_context():
+            attempts = Attempt.query.filter(Attempt.question_id == question_id) \
+                .order_by(Attempt.id).all()
+            self.assertEqual([attempt.category_id for attempt in attempts], [cat_id, None])
+
+    def test_post_quizzes_difficulty_follows_accuracy(self):
+        # ---- TEST PREPARATIONS ---
+        new_category = {'type': 'cat22'}
+        res_cat = self.client().post('/api/v1.0/categories', json=new_category)
+        res_cat_data = json.loads(res_cat.data)
+
+        for difficulty in (1, 1, 3, 5, 5):
+            self.client().post('/api/v1.0/questions', json={
+                'question': f'How hard is {difficulty}?',
+                'answer': f'{difficulty}',
+                'category': new_category['type'],
+                'difficulty': difficulty})
+        # ------- END PREPARATIONS ---
+
+        quiz_category = {'id': res_cat_data['id'], 'type': new_category['type']}
+
+        def next_question(previous_questions, accuracy):
+            res = self.client().post('/api/v1.0/quizzes', json={
+                'previous_questions': previous_questions,
+                'quiz_category': quiz_category,
+                'accuracy': accuracy})
+            self.assertEqual(res.status_code, 200)
+            return json.loads(res.data)['question']
+
+        self.assertEqual(next_question([], 0)['difficulty'], 1)
+        self.assertEqual(next_question([], 0.5)['difficulty'], 3)
+        self.assertEqual(next_question([], 1)['difficulty'], 5)
+
+        # once the hardest questions are asked, the closest difficulty
+        previous_questions = []
+        difficulties = []
+        for i in range(5):
+            question = next_question(previous_questions, 1)
+            previous_questions.append(question['id'])
+            difficulties.append(question['difficulty'])
+        self.assertEqual(difficulties, [5, 5, 3, 1, 1])
+        self.assertIsNone(next_question(previous_questions, 1))
+
+    def test_post_quizzes_returns_count_distinct_questions(self):
+        # ---- TEST PREPARATIONS ---
+        new_category = {'type': 'cat23'}
+        res_cat = self.client().post('/api/v1.0/categories', json=new_category)
+        res_cat_data = json.loads(res_cat.data)
+
+        for i in range(4):
+            self.client().post('/api/v1.0/questions', json={
+                'question': f'What is {i} - {i}?',
+                'answer': '0',
+                'category': new_category['type'],
+                'difficulty': 2})
+        # ------- END PREPARATIONS ---
+
+        quiz_category = {'id': res_cat_data['id'], 'type': new_category['type']}
+        res = self.client().post('/api/v1.0/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': quiz_category,
+            'count': 3})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(len(set(ids)), 3)
+        self.assertTrue(all(question['category'] == new_category['type']
+                            for question in data['questions']))
+
+        # only the question left is returned
+        res = self.client().post('/api/v1.0/quizzes', json={
+            'previous_questions': ids,
+            'quiz_category': quiz_category,
+            'count': 3})
+        data = json.loads(res.data)
+
+        self.assertEqual(len(data['questions']), 1)
+        self.assertNotIn(data['questions'][0]['id'], ids)
+
+    def test_422_sent_on_post_quizzes_with_invalid_count(self):
+        for count in (0, 51, 2.5, '3'):
+            res = self.client().post('/api/v1.0/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'id': 0, 'type': 'all'},
+                'count': count})
+
+            self.assertEqual(res.status_code, 422)
+
+    def test_422_sent_on_post_quizzes_with_invalid_accuracy(self):
+        for accuracy in (-0.1, 1.5, '0.5', True):
+            res = self.client().post('/api/v1.0/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'id': 0, 'type': 'all'},
+                'accuracy': accuracy})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertFalse(data['success'])
+
+    def test_quiz_session_serves_each_question_once(self):
+        # ---- TEST PREPARATIONS ---
+        new_category = {'type': 'cat13'}
+        res_cat = self.client().post('/api/v1.0/categories', json=new_category)
+        res_cat_data = json.loads(res_cat.data)
+
+        for i in range(3):
+            self.client().post('/api/v1.0/questions', json={
+                'question': f'What is {i} x {i}?',
+                'answer': f'{i * i}',
+                'category': new_category['type'],
+                'difficulty': 1})
+        # ------- END PREPARATIONS ---
+
+        res = self.client().post('/api/v1.0/quizzes/sessions', json={
+            'quiz_category': {'id': res_cat_data['id'], 'type': new_category['type']}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertTrue(data['session_id'])
+
+        served = []
+        for i in range(data['total_questions'] + 1):
+            quiz_res = self.client().post(
+                '/api/v1.0/quizzes', json={'session_id': data['session_id']})
+            quiz_data = json.loads(quiz_res.data)
+            self.assertEqual(quiz_res.status_code, 200)
+            if quiz_data['question'] is not None:
+                served.append(quiz_data['question']['id'])
+
+        self.assertEqual(len(served), len(set(served)))
+        self.assertEqual(len(served), data['total_questions'])
+
+        res_del = self.client().delete(
+            f'/api/v1.0/quizzes/sessions/{data["session_id"]}')
+        self.assertEqual(res_del.status_code, 200)
+
+    def test_422_sent_on_quiz_requests_with_invalid_category_or_seed(self):
+        for quiz_category in ({}, {'id': 'all'}, {'id': [1]}, {'id': True}, 3, None):
+            res = self.client().post('/api/v1.0/quizzes/sessions',
+                                     json={'quiz_category': quiz_category})
+            self.assertEqual(res.status_code, 422, quiz_category)
+            res = self.client().post('/api/v1.0/quizzes', json={
+                'previous_questions': [], 'quiz_category': quiz_category})
+            self.assertEqual(res.status_code, 422, quiz_category)
+
+        for seed in ([1], {'a': 1}, 1.5, True):
+            res = self.client().post('/api/v1.0/quizzes/sessions', json={
+                'quiz_category': {'id': 0}, 'seed': seed})
+            self.assertEqual(res.status_code, 422, seed)
+            self.assertFalse(json.loads(res.data)['success'])
+
+    def test_stores_missing_a_method_of_the_interface_cannot_be_created(self):
+        class PartialStore(SessionStore):
+            def create(self, question_ids):
+                return 'id'
+
+        with self.assertRaises(TypeError):
+            PartialStore()
+
+    def test_404_sent_on_post_quizzes_with_unknown_session_id(self):
+        res = self.client().post('/api/v1.0/quizzes', json={'session_id': 'unknown'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+        self.assertTrue('not found' in data['message'])
+
     def test_422_sent_on_post_quizzes_with_missing_required_body_properties(self):
         body_data = {
             'invalid': 'invalid'
@@ -524,6 +1098,508 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(quiz_fetch_res_data['error'], 422)
         self.assertTrue('unprocessable' in quiz_fetch_res_data['message'])
 
+    def test_quiz_answers_are_checked_and_recorded(self):
+        # ---- TEST PREPARATIONS ---
+        new_category = {'type': 'cat27'}
+        self.client().post('/api/v1.0/categories', json=new_category)
+        res_q = self.client().post('/api/v1.0/questions', json={
+            'question': 'Whose autobiography is entitled I Know Why the Caged Bird Sings?',
+            'answer': 'Maya Angelou',
+            'category': new_category['type'],
+            'difficulty': 2})
+        question_id = json.loads(res_q.data)['id']
+        # ------- END PREPARATIONS ---
+
+        res = self.client().post('/api/v1.0/quizzes/answers', json={
+            'question_id': question_id, 'answer': 'maya ANGELOU!',
+            'player': 'ada', 'answer_ms': 4200})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['correct'])
+        self.assertEqual(data['answer'], 'Maya Angelou')
+
+        res = self.client().post('/api/v1.0/quizzes/answers', json={
+            'question_id': question_id, 'answer': 'Maya'})
+        self.assertFalse(json.loads(res.data)['correct'])
+
+        attempt_writer.flush()
+        with self.app.app_context():
+            attempts = Attempt.query.filter(Attempt.question_id == question_id) \
+                .order_by(Attempt.id).all()
+            self.assertEqual([(attempt.player, attempt.correct, attempt.answer_ms)
+                              for attempt in attempts],
+                             [('ada', True, 4200), (None, False, None)])
+            self.assertTrue(all(attempt.category_id for attempt in attempts))
+
+    def test_answers_naming_more_than_the_answer_are_not_correct(self):
+        expected = answer_words('Maya Angelou')
+        for guess in ('maya angelou', 'Maya Angelou!', ' MAYA  angelou. '):
+            self.assertTrue(is_correct(guess, expected), guess)
+        for guess in ('muhammad ali maya angelou apollo 13 george washington',
+                      'It was Maya Angelou', 'Maya Angelou Maya Angelou',
+                      'angelou maya', 'maya', ''):
+            self.assertFalse(is_correct(guess, expected), guess)
+
+        # but for one article
+        self.assertTrue(is_correct('beatles', answer_words('The Beatles')))
+        self.assertTrue(is_correct('the Nile', answer_words('Nile')))
+        self.assertFalse(is_correct('the the Nile', answer_words('Nile')))
+        self.assertFalse(is_correct('a Nile', answer_words('The Nile')))
+
+    def test_404_sent_on_post_quiz_answers_with_unknown_question(self):
+        res = self.client().post('/api/v1.0/quizzes/answers', json={
+            'question_id': 10 ** 9, 'answer': 'anything'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_422_sent_on_post_quiz_answers_with_invalid_body(self):
+        for body in ({'answer': 'anything'},
+                     {'question_id': 'one', 'answer': 'anything'},
+                     {'question_id': 1, 'answer': 4},
+                     {'question_id': 1, 'answer': 'anything', 'player': ''},
+                     {'question_id': 1, 'answer': 'anything', 'answer_ms': -1}):
+            res = self.client().post('/api/v1.0/quizzes/answers', json=body)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422, body)
+            self.assertFalse(data['success'])
+
+    # ------- QUESTION STATS TESTS HERE ------
+
+    def test_question_stats_count_serves_and_answers(self):
+        # ---- TEST PREPARATIONS ---
+        # a category of this run only, the stats of earlier runs are kept
+        new_category = {'type': f'cat29 {uuid.uuid4().hex}'}
+        res_cat = self.client().post('/api/v1.0/categories', json=new_category)
+        cat_id = json.loads(res_cat.data)['id']
+        res_q = self.client().post('/api/v1.0/questions', json={
+            'question': 'What is the capital of Mongolia?',
+            'answer': 'Ulaanbaatar',
+            'category': new_category['type'],
+            'difficulty': 4})
+        question_id = json.loads(res_q.data)['id']
+        # ------- END PREPARATIONS ---
+
+        res = self.client().post('/api/v1.0/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': cat_id}, 'count': 5})
+        self.assertEqual([question['id'] for question in json.loads(res.data)['questions']],
+                         [question_id])
+        for answer, answer_ms in (('ulaanbaatar', 3000), ('Astana', 5000), ('Ulan Bator', None)):
+            self.client().post('/api/v1.0/quizzes/answers', json={
+                'question_id': question_id, 'answer': answer, 'answer_ms': answer_ms})
+
+        expected = {'served': 1, 'answered': 3, 'correct': 1,
+                    'correct_rate': 0.3333, 'avg_answer_ms': 4000.0}
+        # from the counters in memory, then from the table
+        for flush in (False, True):
+            if flush:
+                self.assertTrue(question_stats.flush())
+            res = self.client().get(f'/api/v1.0/questions/{question_id}/stats')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['stats'], expected)
+
+            res = self.client().get(f'/api/v1.0/categories/{cat_id}/stats')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['category']['type'], new_category['type'])
+            self.assertEqual(data['stats'], expected)
+            self.assertEqual(data['difficulties'], [dict(expected, difficulty=4)])
+
+        res = self.client().get('/api/v1.0/categories/0/stats')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(data['category'])
+        self.assertGreaterEqual(data['stats']['answered'], 3)
+
+    def test_404_sent_on_get_stats_of_unknown_question_or_category(self):
+        res = self.client().get(f'/api/v1.0/questions/{10 ** 9}/stats')
+        self.assertEqual(res.status_code, 404)
+        res = self.client().get(f'/api/v1.0/categories/{10 ** 9}/stats')
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(json.loads(res.data)['success'])
+
+    # ------- LEADERBOARD TESTS HERE ------
+
+    def test_leaderboard_ranks_players_by_correct_answers(self):
+        # ---- TEST PREPARATIONS ---
+        new_category = {'type': 'cat28'}
+        res_cat = self.client().post('/api/v1.0/categories', json=new_category)
+        cat_id = json.loads(res_cat.data)['id']
+        res_q = self.client().post('/api/v1.0/questions', json={
+            'question': 'What is the largest lake in Africa?',
+            'answer': 'Lake Victoria',
+            'category': new_category['type'],
+            'difficulty': 2})
+        question_id = json.loads(res_q.data)['id']
+        # players of this run only, the attempts of earlier runs are kept
+        run = str(time.time())
+        answers = {f'ada {run}': ['lake victoria'] * 3,
+                   f'bob {run}': ['lake victoria', 'nile', 'Lake Victoria.'],
+                   f'cy {run}': ['nile']}
+        for player, guesses in answers.items():
+            for guess in guesses:
+                self.client().post('/api/v1.0/quizzes/answers', json={
+                    'question_id': question_id, 'answer': guess, 'player': player})
+        attempt_writer.flush()
+        with self.app.app_context():
+            leaderboards.refresh()
+        # ------- END PREPARATIONS ---
+
+        for category, window in ((cat_id, 'all'), (cat_id, 'week'), (0, 'day')):
+            res = self.client().get(
+                f'/api/v1.0/leaderboard?category={category}&window={window}&limit=100')
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            scores = [(player['player'], player['score']) for player in data['players']
+                      if player['player'].endswith(run)]
+            self.assertEqual(scores, [(f'ada {run}', 3), (f'bob {run}', 2)])
+            ranks = [player['rank'] for player in data['players']]
+            self.assertEqual(ranks, list(range(1, len(ranks) + 1)))
+
+        res = self.client().get(f'/api/v1.0/leaderboard?category={cat_id}')
+        self.assertEqual(json.loads(res.data)['category']['type'], 'cat28')
+
+    def test_leaderboard_counts_attempts_written_by_other_processes(self):
+        run = str(time.time())
+        with self.app.app_context():
+            leaderboards.refresh()
+            # ids of two batches of other workers, the later committing first
+            ids = [db.session.execute("SELECT nextval('attempts_id_seq')").scalar()
+                   for i in range(2)]
+            for id in reversed(ids):
+                db.session.execute(Attempt.__table__.insert(), {
+                    'id': id, 'player': f'dee {run}', 'question_id': 1,
+                    'category_id': None, 'correct': True,
+                    'created_at': datetime.datetime.utcnow()})
+                db.session.commit()
+                leaderboards.refresh()
+
+        for window in ('all', 'day'):
+            self.assertEqual(leaderboards.boards[0, window].scores[f'dee {run}'], 2)
+
+    def test_leaderboard_top_stays_exact_past_its_size(self):
+        board = TopK(None)
+        rng = random.Random(1)
+        for i in range(5000):
+            board.add(f'p{rng.randint(1, 300)}')
+
+        expected = sorted(board.scores.items(), key=lambda item: (-item[1], item[0]))
+        self.assertEqual([(player['player'], player['score']) for player in board.best(100)],
+                         expected[:100])
+
+    def test_422_and_404_sent_on_get_leaderboard_with_invalid_arguments(self):
+        res = self.client().get('/api/v1.0/leaderboard?window=year')
+        self.assertEqual(res.status_code, 422)
+        res = self.client().get('/api/v1.0/leaderboard?limit=0')
+        self.assertEqual(res.status_code, 422)
+        res = self.client().get(f'/api/v1.0/leaderboard?category={10 ** 9}')
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(json.loads(res.data)['success'])
+
+    # ------- MIGRATION TESTS HERE ------
+
+    def test_sqlite_workers_starting_together_migrate_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f'sqlite:///{directory}/trivia.db')
+            runs = []
+            threads = [threading.Thread(target=lambda: runs.append(migrate(engine)))
+                       for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            applied = [version for run in runs for version, name in run]
+            self.assertEqual(len(runs), 4)
+            self.assertEqual(sorted(applied),
+                             [version for version, name, path in migrations('sqlite')])
+            engine.dispose()
+
+    # ------- DATABASE POOL TESTS HERE ------
+
+    def test_get_pool_metrics(self):
+        self.client().get('/api/v1.0/categories/1')
+        res = self.client().get('/api/v1.0/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['pool']['profile'], 'test')
+        self.assertEqual(data['pool']['size'], 2)
+        self.assertEqual(data['pool']['checked_out'], 0)
+        self.assertGreater(data['pool']['checkouts'], 0)
+        self.assertEqual(data['pool']['timeouts'], 0)
+
+    def test_reads_go_to_replica_except_after_own_writes(self):
+        # the test database stands in for its own replica
+        setup_db(self.app, self.database_path, 'test',
+                 replica_paths=[self.database_path],
+                 replica_strategy='least_connections')
+        router = self.app.extensions['replica_router']
+        client = self.client()
+
+        client.get('/api/v1.0/questions?page=2')
+        self.assertEqual(router.sessions, [1])
+
+        res = client.post('/api/v1.0/categories', json={'type': 'category18'})
+        self.assertTrue('read_primary_until' in res.headers['Set-Cookie'])
+
+        client.get('/api/v1.0/questions?page=3')
+        self.assertEqual(router.sessions, [1])
+
+    # ------- COALESCING AND RATE LIMITING TESTS HERE ------
+
+    def test_single_flight_shares_the_call_in_flight(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        while flight.shared < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(flight.calls, {})
+
+        def failing():
+            raise ValueError('failed')
+        with self.assertRaises(ValueError):
+            flight.do('key', failing)
+        self.assertEqual(flight.do('key', lambda: 'again'), 'again')
+
+    def test_429_sent_past_the_rate_limit_of_a_route(self):
+        app = create_app({'RATE_LIMIT_PER_SECOND': 0.01, 'RATE_LIMIT_BURST': 2})
+        setup_db(app, self.database_path, 'test')
+        client = app.test_client()
+
+        statuses = [client.get('/api/v1.0').status_code for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+        res = client.get('/api/v1.0')
+        data = json.loads(res.data)
+        self.assertEqual(data['error'], 429)
+        self.assertFalse(data['success'])
+        self.assertTrue(1 <= int(res.headers['Retry-After']) <= 100)
+
+        # other routes have buckets of their own
+        self.assertEqual(client.get('/api/v1.0/pool').status_code, 200)
+        self.assertEqual(app.extensions['rate_limiter'].limited, 2)
+
+    def test_rate_limit_keys_on_the_forwarded_address_behind_trusted_proxies(self):
+        for proxies, statuses in ((1, [200, 200, 429]), (0, [200, 429, 429])):
+            app = create_app({'RATE_LIMIT_PER_SECOND': 0.01, 'RATE_LIMIT_BURST': 1,
+                              'TRUSTED_PROXIES': proxies})
+            setup_db(app, self.database_path, 'test')
+            client = app.test_client()
+
+            # two clients behind the proxy, then the first one again
+            self.assertEqual(
+                [client.get('/api/v1.0', headers={'X-Forwarded-For': address}).status_code
+                 for address in ('203.0.113.1', '203.0.113.2', '203.0.113.1')],
+                statuses, proxies)
+
+    def test_token_buckets_refill_at_the_rate(self):
+        store = MemoryBucketStore(max_buckets=2)
+        self.assertEqual(store.take('a', 2, 1, 100), 0)
+        self.assertEqual(store.take('a', 2, 1, 100), 0.5)
+        self.assertEqual(store.take('a', 2, 1, 100.25), 0.25)
+        self.assertEqual(store.take('a', 2, 1, 101), 0)
+
+        store.take('b', 2, 1, 101)
+        store.take('c', 2, 1, 101)
+        self.assertEqual(list(store.buckets), ['b', 'c'])
+
+    # ------- READ STORE TESTS HERE ------
+
+    def test_read_store_serves_the_same_responses(self):
+        store_app = create_app({'QUESTION_STORE': True})
+        setup_db(store_app, self.database_path, 'test')
+        store_client = store_app.test_client()
+        store = read_store.question_store
+
+        # ---- TEST PREPARATIONS ---
+        res_cat = store_client.post('/api/v1.0/categories', json={'type': 'cat24'})
+        cat_id = json.loads(res_cat.data)['id']
+        # loads the store, the writes below then update it
+        store_client.get(f'/api/v1.0/categories/{cat_id}/questions')
+        self.assertTrue(store.loaded)
+        ids = []
+        for i in range(12):
+            res = store_client.post('/api/v1.0/questions', json={
+                'question': f'Question {(i * 7) % 12:02d}?',
+                'answer': f'{i}',
+                'category': 'cat24',
+                'difficulty': i % 5 + 1})
+            ids.append(json.loads(res.data)['id'])
+        store_client.patch('/api/v1.0/questions', json={
+            'ids': ids[:2], 'difficulty': 3})
+        store_client.delete(f'/api/v1.0/questions/{ids[2]}')
+        # ------- END PREPARATIONS ---
+
+        db_app = create_app()
+        setup_db(db_app, self.database_path, 'test')
+        paths = [f'/api/v1.0/categories/{cat_id}/questions?page=1',
+                 f'/api/v1.0/categories/{cat_id}/questions?page=2',
+                 f'/api/v1.0/categories/{cat_id}/questions?page=0',
+                 f'/api/v1.0/questions?currCat={cat_id}&page=2',
+                 f'/api/v1.0/questions/{ids[0]}',
+                 f'/api/v1.0/questions/{ids[2]}']
+        first_page = json.loads(store_client.get(paths[0]).data)
+        paths.append(f'/api/v1.0/categories/{cat_id}/questions'
+                     f'?cursor={first_page["next_cursor"]}')
+
+        for path in paths:
+            read_store.use_question_store(None)
+            response_cache.bump_version()
+            expected = db_app.test_client().get(path)
+            read_store.use_question_store(store)
+            response_cache.bump_version()
+            res = store_client.get(path)
+            self.assertEqual(res.status_code, expected.status_code, path)
+            self.assertEqual(json.loads(res.data), json.loads(expected.data), path)
+
+        self.assertEqual(first_page['total_questions'], 11)
+
+    # ------- LIVE ROOM TESTS HERE ------
+
+    def test_room_broadcasts_questions_and_aggregated_results(self):
+        questions = [
+            {'id': 1, 'question': 'What is 1 + 1?', 'answer': '2',
+             'category': 'cat26', 'category_id': 1, 'difficulty': 1},
+            {'id': 2, 'question': 'What is 2 + 2?', 'answer': 'Four',
+             'category': 'cat26', 'category_id': 1, 'difficulty': 1},
+        ]
+
+        async def play():
+            room = Room('room', 1, questions)
+            alice, bob = room.join('alice'), room.join('bob')
+            self.assertIsNone(await room.answer(alice, 0, '2'))  # not started
+
+            await room.advance()
+            self.assertTrue(await room.answer(alice, 0, ' 2 '))
+            self.assertFalse(await room.answer(bob, 0, '3'))
+            self.assertIsNone(await room.answer(bob, 0, '2'))  # answered already
+
+            await room.advance()
+            self.assertTrue(await room.answer(bob, 1, 'four'))
+            await room.advance()
+            self.assertTrue(room.finished)
+
+            messages = []
+            while not alice.queue.empty():
+                messages.append(json.loads(alice.queue.get_nowait()))
+            return messages
+
+        messages = asyncio.run(play())
+
+        self.assertEqual([message['type'] for message in messages],
+                         ['joined', 'question', 'results', 'question',
+                          'results', 'finished'])
+        self.assertNotIn('answer', messages[1]['question'])
+        results = messages[2]
+        self.assertEqual(results['answer'], '2')
+        self.assertEqual(results['answered'], 2)
+        self.assertEqual(results['correct'], 1)
+        self.assertEqual(results['leaderboard'][0]['name'], 'alice')
+        self.assertEqual([player['score'] for player in messages[5]['leaderboard']],
+                         [1, 1])
+
+    # ------- CHANGE FEED TESTS HERE ------
+
+    def test_change_feed_applies_the_changes_of_other_processes(self):
+        app = create_app({'CHANGE_FEED': True})
+        # a profile with pre-ping, which leaves a transaction open on the
+        # connections it checks
+        setup_db(app, self.database_path, 'web')
+        client = app.test_client()
+        # stands for the feed of another worker
+        other = PostgresChangeFeed(app)
+        other.start()
+        self.assertTrue(other.listening.wait(5))
+
+        applied = []
+
+        def listener(table, operation, record):
+            if threading.current_thread() is other.thread:
+                applied.append((table, operation, record.id))
+
+        models.on_change(listener)
+        try:
+            res = client.post('/api/v1.0/categories', json={'type': 'cat25'})
+            cat_id = json.loads(res.data)['id']
+            client.delete(f'/api/v1.0/categories/{cat_id}')
+
+            deadline = time.time() + 5
+            while len(applied) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            models.change_listeners.remove(listener)
+            other.stop()
+            models.use_change_feed(None)
+
+        self.assertEqual(applied, [('categories', 'insert', cat_id),
+                                   ('categories', 'delete', cat_id)])
+        self.assertEqual(other.metrics()['events'], 2)
+        self.assertLess(other.metrics()['max_lag_seconds'], 1)
+
+    # ------- INSTRUMENTATION TESTS HERE ------
+
+    def instrumented_app(self):
+        app = create_app({'INSTRUMENTATION': True,
+                          'INSTRUMENTATION_SAMPLE_RATE': 1})
+        setup_db(app, self.database_path, 'test')
+        return app
+
+    def test_server_timing_header_and_metrics(self):
+        client = self.instrumented_app().test_client()
+
+        res = client.get('/api/v1.0/questions?page=1')
+        status = res.status_code
+        timings = res.headers['Server-Timing']
+        self.assertTrue('db;dur=' in timings)
+        self.assertTrue('serialize;dur=' in timings)
+        self.assertTrue('total;dur=' in timings)
+
+        res = client.get('/api/v1.0/metrics')
+        text = res.data.decode()
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue('trivia_requests_total{route="/api/v1.0/questions",'
+                        f'method="GET",status="{status}"}} 1' in text)
+        self.assertTrue('trivia_request_duration_seconds_count{'
+                        'route="/api/v1.0/questions",method="GET"} 1' in text)
+        self.assertTrue('trivia_db_pool_checked_out 0' in text)
+
+    def test_n_plus_one_queries_are_counted(self):
+        app = self.instrumented_app()
+
+        @app.route('/n-plus-one')
+        def n_plus_one():
+            # one category lookup per question
+            ids = [question.category_id for question in Question.query.limit(6)]
+            return json.dumps([Category.query.get(id).type for id in ids])
+
+        client = app.test_client()
+        client.get('/n-plus-one')
+        text = client.get('/api/v1.0/metrics').data.decode()
+        self.assertTrue('trivia_n_plus_one_total{route="/n-plus-one",'
+                        'method="GET"} 1' in text)
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -15,6 +15,8 @@ class QuizView extends Component {
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
+      correct: false,
+      questionShownAt: 0,
       forceEnd: false,
     };
   }
@@ -56,6 +58,10 @@ class QuizView extends Component {
       data: JSON.stringify({
         previous_questions: previousQuestions,
         quiz_category: this.state.quizCategory,
+        // share of correct answers so far, to adapt the difficulty
+        accuracy: previousQuestions.length
+          ? this.state.numCorrect / previousQuestions.length
+          : undefined,
       }),
       xhrFields: {
         withCredentials: true,
@@ -67,6 +73,7 @@ class QuizView extends Component {
           previousQuestions: previousQuestions,
           currentQuestion: result.question,
           guess: '',
+          questionShownAt: Date.now(),
           forceEnd: result.question ? false : true,
         });
         return;
@@ -80,10 +87,32 @@ class QuizView extends Component {
 
   submitGuess = (event) => {
     event.preventDefault();
-    let evaluate = this.evaluateAnswer();
-    this.setState({
-      numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
-      showAnswer: true,
+    const showResult = (correct) => {
+      this.setState({
+        numCorrect: !correct ? this.state.numCorrect : this.state.numCorrect + 1,
+        correct: correct,
+        showAnswer: true,
+      });
+    };
+
+    // scored, and recorded, by the server
+    $.ajax({
+      url: '/quizzes/answers', //TODO: update request URL
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        question_id: this.state.currentQuestion.id,
+        answer: this.state.guess,
+        answer_ms: Date.now() - this.state.questionShownAt,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => showResult(result.correct),
+      // not recorded, checked here instead
+      error: (error) => showResult(this.evaluateAnswer()),
     });
   };
 
@@ -95,6 +124,7 @@ class QuizView extends Component {
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
+      correct: false,
       forceEnd: false,
     });
   };
@@ -153,7 +183,7 @@ class QuizView extends Component {
   };
 
   renderCorrectAnswer() {
-    let evaluate = this.evaluateAnswer();
+    let evaluate = this.state.correct;
     return (
       <div className='quiz-play-holder'>
         <div className='quiz-question'>